@@ -1,5 +1,7 @@
 # Django settings for resteasy project.
 
+import os
+
 DEBUG = True
 TEMPLATE_DEBUG = DEBUG
 
@@ -20,6 +22,29 @@ DATABASES = {
     }
 }
 
+# Aliases of DATABASES, e.g. replicas of default, that GET requests read
+# from. Writing requests always use default. See specifications.db.
+SPECIFICATIONS_READ_DATABASES = ()
+DATABASE_ROUTERS = ['resteasy.specifications.db.PrimaryReplicaRouter']
+
+# 'production' keeps connections open across requests and tunes SQLite for
+# concurrent readers and writers; 'development' keeps Django's defaults.
+DATABASE_PROFILE = os.environ.get('RESTEASY_DATABASE_PROFILE', 'development')
+SPECIFICATIONS_PERSISTENT_CONNECTIONS = DATABASE_PROFILE == 'production'
+SPECIFICATIONS_SQLITE_PRAGMAS = ()
+if DATABASE_PROFILE == 'production':
+    SPECIFICATIONS_SQLITE_PRAGMAS = (
+        # Readers keep reading while a write is in progress
+        ('journal_mode', 'WAL'),
+        # Safe with WAL, and avoids an fsync per transaction
+        ('synchronous', 'NORMAL'),
+        # 64MB of page cache per connection
+        ('cache_size', -65536),
+        ('temp_store', 'MEMORY'),
+        # Milliseconds a writer waits for another one instead of failing
+        ('busy_timeout', 30000),
+    )
+
 # Local time zone for this installation. Choices can be found here:
 # http://en.wikipedia.org/wiki/List_of_tz_zones_by_name
 # although not all choices may be available on all operating systems.
@@ -93,6 +118,9 @@ TEMPLATE_LOADERS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    # First, so that it times the other middleware too
+    'resteasy.specifications.metrics.MetricsMiddleware',
+    'resteasy.specifications.db.DatabaseMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -102,6 +130,21 @@ MIDDLEWARE_CLASSES = (
 
 ROOT_URLCONF = 'resteasy.urls'
 
+# Number of serialized read responses kept in each process's LRU cache.
+# Set to 0 to disable the in-process tier.
+SPECIFICATIONS_CACHE_SIZE = 1000
+
+# Alias in CACHES of a shared cache to use behind the in-process tier, e.g.
+# a memcached backend, or None to only cache in-process.
+SPECIFICATIONS_CACHE_BACKEND = None
+
+# Number of compiled payload validators kept in each process.
+SPECIFICATIONS_VALIDATOR_CACHE_SIZE = 200
+
+# Whether ?profile=true returns a sampled profile of the request instead of
+# its response. Only turn this on where clients are trusted.
+SPECIFICATIONS_PROFILING = False
+
 TEMPLATE_DIRS = (
     # Put strings here, like "/home/html/django_templates" or "C:/www/django/templates".
     # Always use forward slashes, even on Windows.
@@ -0,0 +1,146 @@
+'''
+Batched writes for the specification models.
+
+Django's ORM saves one row per statement, which is far too slow when a whole
+specification tree is loaded at once. These helpers write many instances of
+the same model with a handful of executemany statements instead.
+'''
+
+from django.db import connections, router, transaction
+
+BATCH_SIZE = 500
+
+def chunks(items, size=BATCH_SIZE):
+    items = list(items)
+    for start in xrange(0, len(items), size):
+        yield items[start:start + size]
+
+def existing_ids(model, ids):
+    found = set()
+    for chunk in chunks(ids):
+        found.update(model.objects.filter(pk__in=chunk)
+                                  .values_list('pk', flat=True))
+    return found
+
+def save_models(models, update_existing=True):
+    '''
+    Inserts or updates a list of instances of one model class. Rows whose
+    primary key already exists are updated, like Model.save() would do, or
+    left untouched when update_existing is False.
+    The ids must already be set, i.e. generate_id() must have been called.
+    '''
+    if not models:
+        return
+
+    model = type(models[0])
+    opts = model._meta
+    using = router.db_for_write(model)
+    connection = connections[using]
+    quote_name = connection.ops.quote_name
+    fields = opts.local_fields
+    table = quote_name(opts.db_table)
+
+    existing = existing_ids(model, [instance.pk for instance in models])
+    new_models = [instance for instance in models
+                  if instance.pk not in existing]
+    old_models = [instance for instance in models
+                  if instance.pk in existing]
+
+    cursor = connection.cursor()
+    if new_models:
+        sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+                    table,
+                    ', '.join(quote_name(field.column) for field in fields),
+                    ', '.join(['%s'] * len(fields)))
+        for chunk in chunks(new_models):
+            rows = [_get_row(instance, fields, connection)
+                    for instance in chunk]
+            cursor.executemany(sql, rows)
+
+    if old_models and update_existing:
+        value_fields = [field for field in fields if not field.primary_key]
+        sql = 'UPDATE %s SET %s WHERE %s = %%s' % (
+                    table,
+                    ', '.join('%s = %%s' % quote_name(field.column)
+                              for field in value_fields),
+                    quote_name(opts.pk.column))
+        for chunk in chunks(old_models):
+            rows = [_get_row(instance, value_fields + [opts.pk], connection)
+                    for instance in chunk]
+            cursor.executemany(sql, rows)
+
+    transaction.set_dirty(using=using)
+
+def insert_rows(model, field_names, rows):
+    '''
+    Inserts rows of values, already in their database representation, into
+    the given fields. This skips both the instantiation of models and the
+    check for existing rows, so it is only for rows known to be new.
+    '''
+    if not rows:
+        return
+
+    opts = model._meta
+    using = router.db_for_write(model)
+    connection = connections[using]
+    quote_name = connection.ops.quote_name
+    columns = [opts.get_field(field_name).column for field_name in field_names]
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+                quote_name(opts.db_table),
+                ', '.join(quote_name(column) for column in columns),
+                ', '.join(['%s'] * len(columns)))
+
+    cursor = connection.cursor()
+    for chunk in chunks(rows):
+        cursor.executemany(sql, chunk)
+
+    transaction.set_dirty(using=using)
+
+def _get_row(instance, fields, connection):
+    return [field.get_db_prep_save(getattr(instance, field.attname),
+                                   connection=connection)
+            for field in fields]
+
+def update_field(model, field_name, values):
+    '''
+    Sets one column of many rows, given as (primary key, value) pairs.
+    '''
+    if not values:
+        return
+
+    opts = model._meta
+    using = router.db_for_write(model)
+    connection = connections[using]
+    quote_name = connection.ops.quote_name
+    field = opts.get_field(field_name)
+    sql = 'UPDATE %s SET %s = %%s WHERE %s = %%s' % (
+                quote_name(opts.db_table),
+                quote_name(field.column),
+                quote_name(opts.pk.column))
+
+    cursor = connection.cursor()
+    for chunk in chunks(values):
+        cursor.executemany(sql, [(value, pk) for pk, value in chunk])
+
+    transaction.set_dirty(using=using)
+
+def delete_rows(model, ids):
+    '''
+    Deletes rows by primary key without collecting related objects, unlike
+    QuerySet.delete(), which would load self-referencing element trees into
+    memory. Callers are responsible for deleting dependent rows too.
+    '''
+    opts = model._meta
+    using = router.db_for_write(model)
+    connection = connections[using]
+    quote_name = connection.ops.quote_name
+
+    cursor = connection.cursor()
+    for chunk in chunks(ids):
+        sql = 'DELETE FROM %s WHERE %s IN (%s)' % (
+                    quote_name(opts.db_table),
+                    quote_name(opts.pk.column),
+                    ', '.join(['%s'] * len(chunk)))
+        cursor.execute(sql, chunk)
+
+    transaction.set_dirty(using=using)
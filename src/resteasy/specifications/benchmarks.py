@@ -0,0 +1,323 @@
+'''
+Benchmarks of every view of the specification API.
+
+generate() loads synthetic specifications of a configurable scale through
+the bulk view, then run_benchmarks() sends each scenario's requests through
+the Django test client and measures latency percentiles, throughput, the
+number of queries and the peak memory of the process. compare() checks the
+results against a baseline saved from an earlier run.
+
+The 'benchmark' management command runs all of this against a throwaway
+test database and writes the results as JSON.
+'''
+
+import platform
+import resource
+import time
+from django.db import connection
+from django.test.client import Client
+from resteasy.specifications.cache import response_cache
+from resteasy.specifications.serialization import json_codec
+
+DEFAULT_SCALE = {
+                 'specifications': 2,
+                 'resources': 20,
+                 'depth': 3,
+                 'fanOut': 4
+                }
+# Results of a scenario are only compared once they are slower than this,
+# so that scenarios taking fractions of a millisecond do not flap.
+MIN_COMPARED_SECONDS = 0.001
+
+class Scenario(object):
+    '''
+    A named request, built for each iteration by get_request(iteration) as
+    (method, path, data, extra headers). POST data is sent as JSON.
+    '''
+    def __init__(self, name, get_request):
+        self.name = name
+        self.get_request = get_request
+
+def generate(client, scale):
+    '''
+    Loads the specifications named bench0, bench1... with version v1, each
+    with scale['resources'] resources holding a tree of elements with
+    scale['fanOut'] children per element down to scale['depth'] levels.
+    Returns the loaded data needed by the scenarios.
+    '''
+    data = {'scale': scale, 'resources': []}
+    for spec_index in xrange(scale['specifications']):
+        response = _send(client, 'POST', '/specifications/bulk',
+                         _build_bulk(spec_index, scale))
+        data['resources'].extend(resource['id'] for resource
+                                 in json_codec.loads(response.content)
+                                                   ['resources'])
+    return data
+
+def _build_bulk(spec_index, scale):
+    name = 'bench%d' % spec_index
+    return {
+            'name': name,
+            'version': 'v1',
+            'resources': [{
+                           'url': '%s/v1/items%d/{id}' % (name, index),
+                           'elements': _build_elements(scale['depth'],
+                                                       scale['fanOut'])
+                          }
+                          for index in xrange(scale['resources'])]
+           }
+
+def _build_elements(depth, fan_out):
+    elements = []
+    if depth < 1:
+        return elements
+    for index in xrange(fan_out):
+        children = _build_elements(depth - 1, fan_out)
+        element = {
+                   'name': 'field%d' % index,
+                   'type': 'object' if children else 'string',
+                   'required': index % 2 == 0
+                  }
+        if children:
+            element['elements'] = children
+        elements.append(element)
+    return elements
+
+def get_scenarios(data):
+    resource_ids = data['resources']
+    def resource_id(iteration):
+        return resource_ids[iteration % len(resource_ids)]
+    def elements(iteration, **parameters):
+        # Always the same resource, so that repeated reads hit the cache
+        return ('GET', '/specifications/%s/elements' % resource_ids[0],
+                parameters, {})
+    def get(path, **parameters):
+        return lambda iteration: ('GET', path, parameters, {})
+
+    return [
+        Scenario('index', get('/specifications')),
+        Scenario('resources', get('/specifications/bench0/v1/resources')),
+        Scenario('resources_page', get('/specifications/bench0/v1/resources',
+                                       limit='10')),
+        Scenario('resources_stream', get('/specifications/bench0/v1/resources',
+                                         stream='true')),
+        Scenario('resources_fields', get('/specifications/bench0/v1/resources',
+                                         fields='id,url')),
+        Scenario('resource', lambda iteration: ('GET',
+                    '/specifications/resource/%s' % resource_id(iteration),
+                    {}, {})),
+        Scenario('elements', elements),
+        Scenario('elements_uncached', _uncached(elements)),
+        Scenario('elements_tree', lambda iteration: elements(iteration,
+                                                             shape='tree')),
+        Scenario('elements_stream', lambda iteration: elements(iteration,
+                                                               stream='true')),
+        Scenario('elements_not_modified', _not_modified(elements)),
+        Scenario('batch_elements', lambda iteration: ('POST',
+                    '/specifications/elements',
+                    {'resourceIds': resource_ids}, {})),
+        Scenario('batch_elements_specification',
+                 get('/specifications/elements', specName='bench0',
+                     specVersion='v1')),
+        Scenario('elements_gzip', lambda iteration: elements(iteration)[:3] +
+                    ({'HTTP_ACCEPT_ENCODING': 'gzip'},)),
+        Scenario('diff', get('/specifications/bench0/v1/diff/v1')),
+        Scenario('cache_stats', get('/specifications/cache')),
+        Scenario('routes', lambda iteration: ('GET', '/specifications/routes',
+                    {'path': 'bench0/v1/items%d/7'
+                             % (iteration % len(resource_ids))}, {})),
+        Scenario('changes', get('/specifications/changes', limit='100')),
+        Scenario('search', get('/specifications/search', q='field1')),
+        Scenario('search_filtered', get('/specifications/search',
+                                        q='field1 string', specName='bench0',
+                                        limit='10')),
+        Scenario('mock', lambda iteration: ('GET',
+                    '/mock/bench0/v1/items%d/7' % (iteration
+                                                   % len(resource_ids)),
+                    {}, {})),
+        Scenario('validate', lambda iteration: ('POST',
+                    '/specifications/%s/validate' % resource_id(iteration),
+                    {'field0': {}, 'field1': 'x'}, {})),
+        Scenario('validate_batch', lambda iteration: ('POST',
+                    '/specifications/validate',
+                    '\n'.join(json_codec.dumps({'resourceId': id,
+                                                'payload': {'field0': {}}})
+                              for id in resource_ids),
+                    {})),
+        Scenario('create_specification', lambda iteration: ('POST',
+                    '/specifications/specification',
+                    {'name': 'created', 'version': 'v%d' % iteration}, {})),
+        Scenario('create_resource', lambda iteration: ('POST',
+                    '/specifications/resource',
+                    {'specName': 'bench0', 'specVersion': 'v1',
+                     'url': 'bench0/v1/created%d' % iteration}, {})),
+        Scenario('create_element', lambda iteration: ('POST',
+                    '/specifications/element',
+                    {'resourceId': resource_id(iteration),
+                     'name': 'created%d' % iteration, 'type': 'string'}, {})),
+        Scenario('bulk', lambda iteration: ('POST', '/specifications/bulk',
+                    _build_bulk(1000 + iteration,
+                                dict(data['scale'], resources=1)), {})),
+        Scenario('clone', lambda iteration: ('POST', '/specifications/clone',
+                    {'name': 'bench0', 'version': 'v1',
+                     'newVersion': 'clone%d' % iteration}, {})),
+        Scenario('delete_element', _delete_created('element', resource_id)),
+        Scenario('delete_resource', _delete_created('resource', resource_id)),
+        Scenario('delete_specification', _delete_created('specification',
+                                                         resource_id)),
+    ]
+
+def _uncached(get_request):
+    def get_uncached_request(iteration):
+        response_cache.clear()
+        return get_request(iteration)
+    return get_uncached_request
+
+def _not_modified(get_request):
+    etags = {}
+    def get_conditional_request(iteration):
+        method, path, parameters, extra = get_request(iteration)
+        if path not in etags:
+            etags[path] = Client().get(path, parameters)['ETag']
+        return (method, path, parameters,
+                dict(extra, HTTP_IF_NONE_MATCH=etags[path]))
+    return get_conditional_request
+
+def _delete_created(kind, resource_id):
+    # Creates what each request deletes before the request is timed
+    def get_request(iteration):
+        client = Client()
+        if kind == 'specification':
+            response = _send(client, 'POST', '/specifications/clone',
+                             {'name': 'bench0', 'version': 'v1',
+                              'newVersion': 'deleted%d' % iteration})
+            id = json_codec.loads(response.content)['specification']['id']
+            return 'DELETE', '/specifications/specification/%s' % id, {}, {}
+        elif kind == 'resource':
+            response = _send(client, 'POST', '/specifications/resource',
+                             {'specName': 'bench0', 'specVersion': 'v1',
+                              'url': 'bench0/v1/deleted%d' % iteration})
+            id = json_codec.loads(response.content)['id']
+            return 'DELETE', '/specifications/resource/%s' % id, {}, {}
+        response = _send(client, 'POST', '/specifications/element',
+                         {'resourceId': resource_id(iteration),
+                          'name': 'deleted%d' % iteration, 'type': 'string'})
+        id = json_codec.loads(response.content)[0]
+        return 'DELETE', '/specifications/element/%s' % id, {}, {}
+    return get_request
+
+def run_benchmarks(scale=None, iterations=50, names=None):
+    '''
+    Generates data of the given scale in the current database and runs the
+    scenarios, or those whose names are listed, iterations times each.
+    '''
+    scale = dict(DEFAULT_SCALE, **(scale or {}))
+    client = Client()
+    started = time.time()
+    data = generate(client, scale)
+    results = {
+               'scale': scale,
+               'iterations': iterations,
+               'generateSeconds': round(time.time() - started, 3),
+               'python': platform.python_version(),
+               'scenarios': {}
+              }
+
+    old_debug_cursor = connection.use_debug_cursor
+    connection.use_debug_cursor = True
+    try:
+        for scenario in get_scenarios(data):
+            if names and scenario.name not in names:
+                continue
+            results['scenarios'][scenario.name] = _run_scenario(client,
+                                                                scenario,
+                                                                iterations)
+    finally:
+        connection.use_debug_cursor = old_debug_cursor
+    return results
+
+def _run_scenario(client, scenario, iterations):
+    seconds = []
+    queries = []
+    sql_seconds = 0.0
+    errors = 0
+    response_bytes = 0
+    for iteration in xrange(iterations):
+        request = scenario.get_request(iteration)
+        started = time.time()
+        # The test client resets connection.queries when a request starts.
+        # Streamed content is only generated, and queried, when read.
+        response = _send(client, *request)
+        content = response.content
+        seconds.append(time.time() - started)
+        queries.append(len(connection.queries))
+        sql_seconds += sum(float(query['time'])
+                           for query in connection.queries)
+        response_bytes += len(content)
+        if response.status_code not in (200, 304):
+            errors += 1
+
+    seconds.sort()
+    total = sum(seconds)
+    return {
+            'requests': iterations,
+            'errors': errors,
+            'mean': round(total / iterations, 6),
+            'p50': round(_get_percentile(seconds, 50), 6),
+            'p90': round(_get_percentile(seconds, 90), 6),
+            'p99': round(_get_percentile(seconds, 99), 6),
+            'requestsPerSecond': round(iterations / total if total else 0, 1),
+            'queries': max(queries),
+            'sqlSeconds': round(sql_seconds / iterations, 6),
+            'responseBytes': response_bytes // iterations,
+            # ru_maxrss is the peak of the whole process so far, in KB
+            'peakMemoryKb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+           }
+
+def _get_percentile(sorted_values, percentile):
+    # Nearest rank
+    index = int(round(percentile / 100.0 * len(sorted_values) + 0.5)) - 1
+    return sorted_values[max(0, min(index, len(sorted_values) - 1))]
+
+def _send(client, method, path, data=None, extra=None):
+    extra = extra or {}
+    if method == 'GET':
+        return client.get(path, data or {}, **extra)
+    elif method == 'DELETE':
+        return client.delete(path, **extra)
+    if not isinstance(data, basestring):
+        data = json_codec.dumps(data)
+    return client.post(path, data, content_type='application/json', **extra)
+
+def compare(results, baseline, threshold=0.25):
+    '''
+    Returns a message for every scenario of baseline that got slower at the
+    median, ran more queries or used more memory than threshold allows, or
+    failed more often.
+    '''
+    regressions = []
+    for name, old in sorted(baseline['scenarios'].iteritems()):
+        new = results['scenarios'].get(name)
+        if new is None:
+            continue
+
+        if (new['p50'] > MIN_COMPARED_SECONDS
+            and new['p50'] > old['p50'] * (1 + threshold)):
+            regressions.append("%s: p50 %.2fms, was %.2fms"
+                               % (name, new['p50'] * 1000,
+                                  old['p50'] * 1000))
+        if new['queries'] > old['queries']:
+            regressions.append("%s: %d queries, was %d"
+                               % (name, new['queries'], old['queries']))
+        if new['errors'] > old['errors']:
+            regressions.append("%s: %d errors, was %d"
+                               % (name, new['errors'], old['errors']))
+
+    old_memory = max([0] + [old['peakMemoryKb']
+                            for old in baseline['scenarios'].values()])
+    new_memory = max([0] + [new['peakMemoryKb']
+                            for new in results['scenarios'].values()])
+    if old_memory and new_memory > old_memory * (1 + threshold):
+        regressions.append("peak memory %dKB, was %dKB"
+                           % (new_memory, old_memory))
+    return regressions
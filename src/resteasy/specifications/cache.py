@@ -0,0 +1,128 @@
+'''
+Cache for the serialized JSON of the read views.
+
+Entries are looked up in a bounded in-process LRU first and then, if
+SPECIFICATIONS_CACHE_BACKEND names one of the CACHES aliases, in that Django
+cache. Keys contain the ETag of the response, so a write that bumps a
+revision can never be answered from a stale entry; invalidate() additionally
+drops the entries of the written owner so they do not take up space.
+'''
+
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import get_cache
+
+class ResponseCache(object):
+    def __init__(self, max_entries, backend=None):
+        self.max_entries = max_entries
+        self.backend = backend
+        self.hits = 0
+        self.backend_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._owner_keys = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                owners, value = self._entries.pop(key)
+                self._entries[key] = owners, value
+                self.hits += 1
+                return value
+
+        if self.backend is not None:
+            entry = self.backend.get(key)
+            if entry is not None:
+                owners, value = entry
+                self._set_local(key, owners, value)
+                with self._lock:
+                    self.backend_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, owners, value):
+        '''
+        Stores value under key. owners lists the ids whose writes make the
+        entry obsolete, see invalidate().
+        '''
+        self._set_local(key, owners, value)
+        if self.backend is not None:
+            self.backend.set(key, (owners, value))
+
+    def get_or_set(self, key, owners, build):
+        value = self.get(key)
+        if value is None:
+            value = build()
+            self.set(key, owners, value)
+        return value
+
+    def invalidate(self, *owners):
+        keys = set()
+        with self._lock:
+            for owner in owners:
+                keys.update(self._owner_keys.pop(owner, ()))
+            for key in keys:
+                if key in self._entries:
+                    self._remove(key)
+                    self.invalidations += 1
+
+        if keys and self.backend is not None:
+            self.backend.delete_many(list(keys))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._owner_keys.clear()
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                    'entries': len(self._entries),
+                    'maxEntries': self.max_entries,
+                    'hits': self.hits,
+                    'backendHits': self.backend_hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'invalidations': self.invalidations
+                   }
+
+    def _set_local(self, key, owners, value):
+        if self.max_entries < 1:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = owners, value
+            for owner in owners:
+                self._owner_keys.setdefault(owner, set()).add(key)
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        owners, value = self._entries.pop(key)
+        for owner in owners:
+            owner_keys = self._owner_keys.get(owner)
+            if owner_keys is not None:
+                owner_keys.discard(key)
+                if not owner_keys:
+                    del self._owner_keys[owner]
+
+def _get_backend():
+    backend = getattr(settings, 'SPECIFICATIONS_CACHE_BACKEND', None)
+    if backend:
+        return get_cache(backend)
+    return None
+
+response_cache = ResponseCache(getattr(settings,
+                                       'SPECIFICATIONS_CACHE_SIZE', 1000),
+                               _get_backend())
@@ -0,0 +1,102 @@
+'''
+Change log of the writes to specifications, resources and elements.
+
+Every write path records what it saved or deleted in the same transaction
+as the write itself. Changes are numbered by the auto incremented id of
+Change, so a consumer can copy everything once and from then on only apply
+the changes after the last sequence number it has seen:
+    'save'    the object now has the recorded properties, whether it was
+              created or updated
+    'delete'  the object was deleted along with everything under it, i.e.
+              the resources and elements of a specification, the elements
+              of a resource or the subtree of an element
+
+Sequence numbers follow commit order as long as writes are serialized, as
+they are by SQLite. Databases committing concurrent writes out of order
+could let a consumer skip a change that commits after a later one.
+'''
+
+import threading
+import time
+from django.db.models import Max
+from resteasy.specifications import batch
+from resteasy.specifications.models import Change
+from resteasy.specifications.serialization import json_codec
+
+SAVE = 'save'
+DELETE = 'delete'
+# Longest wait for new changes, and how often other processes' writes are
+# looked for meanwhile
+MAX_WAIT = 30
+POLL_INTERVAL = 0.5
+
+_written = threading.Condition()
+
+def record_change(kind, action, object_id, owner_id=None, properties=None):
+    '''
+    Records a single change and returns its sequence number. Like
+    Model.save(), this commits right away unless it runs under transaction
+    management.
+    '''
+    change = Change.objects.create(kind=kind,
+                                   action=action,
+                                   object_id=object_id,
+                                   owner_id=owner_id,
+                                   properties=_dumps(properties))
+    _notify()
+    return change.id
+
+def record_saves(kind, saves):
+    '''
+    Records many saves of one kind, given as (object id, owner id,
+    properties) tuples, with batched inserts. Must run under transaction
+    management, see batch.py.
+    '''
+    batch.insert_rows(Change, ['kind', 'action', 'object_id', 'owner_id',
+                               'properties'],
+                      [(kind, SAVE, object_id, owner_id, _dumps(properties))
+                       for object_id, owner_id, properties in saves])
+    _notify()
+
+def get_last_sequence():
+    '''
+    Returns the sequence number of the last change, or 0 if there is none.
+    It changes with every write, for the cost of one lookup of the primary
+    key index.
+    '''
+    return Change.objects.aggregate(Max('id'))['id__max'] or 0
+
+def get_changes(since, limit):
+    '''
+    Returns up to limit change rows, see Change.ROW_FIELDS, with a sequence
+    number greater than since, in sequence order.
+    '''
+    return list(Change.objects.filter(id__gt=since)
+                              .order_by('id')
+                              .values_list(*Change.ROW_FIELDS)[:limit])
+
+def wait_for_changes(since, limit, timeout):
+    '''
+    Like get_changes(), but waits up to timeout seconds for a change if
+    there is none yet.
+    '''
+    deadline = time.time() + timeout
+    while True:
+        change_rows = get_changes(since, limit)
+        remaining = deadline - time.time()
+        if change_rows or remaining <= 0:
+            return change_rows
+
+        # Writes of this process wake the waiters up right away, those of
+        # other processes are found by the next poll.
+        with _written:
+            _written.wait(min(remaining, POLL_INTERVAL))
+
+def _notify():
+    with _written:
+        _written.notify_all()
+
+def _dumps(properties):
+    if properties is None:
+        return ''
+    return json_codec.dumps(properties)
@@ -0,0 +1,96 @@
+'''
+Database tuning for production and routing of reads to replicas.
+
+DatabaseMiddleware applies these settings when it is loaded:
+    SPECIFICATIONS_SQLITE_PRAGMAS       pragmas run on every new SQLite
+                                        connection, e.g. WAL journaling so
+                                        that readers and the writer do not
+                                        block each other
+    SPECIFICATIONS_PERSISTENT_CONNECTIONS
+                                        whether connections are kept open
+                                        across requests instead of being
+                                        closed at the end of each one, so
+                                        that requests do not pay for
+                                        connecting
+    SPECIFICATIONS_READ_DATABASES       aliases of DATABASES, e.g. replicas
+                                        of default, that PrimaryReplicaRouter
+                                        sends the reads of safe requests to
+
+Requests that write are pinned to the default database for both their
+reads and their writes, so that they never decide on replica data that is
+behind their own writes.
+'''
+
+import random
+import threading
+from django.conf import settings
+from django.core import signals
+from django.db.backends.signals import connection_created
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_state = threading.local()
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+
+    # The raw cursor keeps the pragmas out of connection.queries
+    cursor = connection.connection.cursor()
+    for name, value in getattr(settings, 'SPECIFICATIONS_SQLITE_PRAGMAS', ()):
+        cursor.execute('PRAGMA %s = %s' % (name, value))
+    cursor.close()
+
+def end_request(sender, **kwargs):
+    # Replaces close_connection for persistent connections. Reads outside
+    # transaction management may have left a transaction open, which would
+    # otherwise hold on to its snapshot until the next request.
+    from django.db import connections, transaction
+    for connection in connections.all():
+        if connection.connection is not None:
+            transaction.rollback_unless_managed(using=connection.alias)
+
+def _configure():
+    # django.db imports the routers, so it cannot be imported at the top
+    from django.db import close_connection
+    connection_created.connect(apply_sqlite_pragmas,
+                               dispatch_uid='specifications.db.pragmas')
+    if getattr(settings, 'SPECIFICATIONS_PERSISTENT_CONNECTIONS', False):
+        signals.request_finished.disconnect(close_connection)
+        signals.request_finished.connect(end_request,
+                                         dispatch_uid='specifications.db.end')
+
+class PrimaryReplicaRouter(object):
+    def db_for_read(self, model, **hints):
+        read_databases = getattr(settings, 'SPECIFICATIONS_READ_DATABASES', ())
+        if not read_databases or getattr(_state, 'use_primary', False):
+            return None
+        return random.choice(read_databases)
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_syncdb(self, db, model):
+        return db not in getattr(settings, 'SPECIFICATIONS_READ_DATABASES', ())
+
+def use_primary(is_pinned=True):
+    '''
+    Sends the reads of the current thread to the default database, or back
+    to the replicas.
+    '''
+    _state.use_primary = is_pinned
+
+class DatabaseMiddleware(object):
+    def __init__(self):
+        _configure()
+
+    def process_request(self, request):
+        use_primary(request.method not in SAFE_METHODS)
+
+    def process_response(self, request, response):
+        use_primary(False)
+        return response
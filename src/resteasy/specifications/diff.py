@@ -0,0 +1,130 @@
+'''
+Differences between two versions of a specification.
+
+Resources are matched by url, with a path segment equal to the version
+treated as the same in both versions, so that config/v1/first and
+config/v2/first are compared with each other. Elements are matched by name
+under their matched parents. Only subtrees whose hashes differ are loaded,
+one level at a time, so the number of rows read grows with the size of the
+change rather than the size of the specification.
+'''
+
+from django.db import transaction
+from resteasy.specifications import batch
+from resteasy.specifications.hashes import update_hashes
+from resteasy.specifications.models import Resource, Element
+
+DIFF_FIELDS = ('id', 'name', 'type', 'is_required', 'is_static', 'parent',
+               'subtree_hash')
+
+def diff_specifications(old_spec, new_spec):
+    old_resources = _get_resources(old_spec)
+    new_resources = _get_resources(new_spec)
+    
+    diff = {
+            'added': [],
+            'removed': [],
+            'changed': []
+           }
+    for key in sorted(set(old_resources) | set(new_resources)):
+        if key not in old_resources:
+            id, url, tree_hash = new_resources[key]
+            diff['added'].append({'id': id, 'url': url})
+        elif key not in new_resources:
+            id, url, tree_hash = old_resources[key]
+            diff['removed'].append({'id': id, 'url': url})
+        else:
+            old_id, old_url, old_hash = old_resources[key]
+            new_id, new_url, new_hash = new_resources[key]
+            if old_hash != new_hash:
+                diff['changed'].append({
+                                        'fromId': old_id,
+                                        'toId': new_id,
+                                        'url': new_url,
+                                        'elements': diff_elements(old_id,
+                                                                  new_id)
+                                       })
+    return diff
+
+def diff_elements(old_resource_id, new_resource_id):
+    diff = {
+            'added': [],
+            'removed': [],
+            'changed': []
+           }
+    # Pairs of matched parents whose subtrees differ, None being the root
+    pending = [(None, None, '$')]
+    while pending:
+        old_children = _get_children(old_resource_id,
+                                     [old_id for old_id, new_id, path
+                                      in pending])
+        new_children = _get_children(new_resource_id,
+                                     [new_id for old_id, new_id, path
+                                      in pending])
+        next_pending = []
+        for old_parent_id, new_parent_id, path in pending:
+            old_rows = old_children.get(old_parent_id, {})
+            new_rows = new_children.get(new_parent_id, {})
+            for name in sorted(set(old_rows) | set(new_rows)):
+                element_path = '%s.%s' % (path, name)
+                if name not in old_rows:
+                    diff['added'].append({'path': element_path,
+                                          'id': new_rows[name][0]})
+                elif name not in new_rows:
+                    diff['removed'].append({'path': element_path,
+                                            'id': old_rows[name][0]})
+                elif old_rows[name][-1] != new_rows[name][-1]:
+                    old_id, old_properties = _get_properties(old_rows[name])
+                    new_id, new_properties = _get_properties(new_rows[name])
+                    if _get_own_properties(old_properties) != \
+                       _get_own_properties(new_properties):
+                        diff['changed'].append({'path': element_path,
+                                                'from': old_properties,
+                                                'to': new_properties})
+                    next_pending.append((old_id, new_id, element_path))
+        pending = next_pending
+    
+    return diff
+
+def _get_resources(spec):
+    resources = {}
+    resource_rows = (Resource.objects.filter(specification=spec)
+                                     .values_list('id', 'url', 'tree_hash'))
+    for id, url, tree_hash in resource_rows:
+        if not tree_hash:
+            # Written before hashes were stored
+            tree_hash = _store_hashes(id)
+        url_key = Resource.replace_version(url, spec.version, '{version}')
+        resources[url_key] = id, url, tree_hash
+    return resources
+
+@transaction.commit_on_success
+def _store_hashes(resource_id):
+    # Diffs are read by GET requests, which are not under the transaction
+    # management that the batched writes of update_hashes need
+    return update_hashes(resource_id)
+
+def _get_children(resource_id, parent_ids):
+    element_rows = []
+    if None in parent_ids:
+        element_rows.extend(Element.objects.filter(resource__id=resource_id,
+                                                   parent__isnull=True)
+                                           .values_list(*DIFF_FIELDS))
+    
+    for chunk in batch.chunks(id for id in parent_ids if id is not None):
+        element_rows.extend(Element.objects.filter(resource__id=resource_id,
+                                                   parent__in=chunk)
+                                           .values_list(*DIFF_FIELDS))
+    
+    children = {}
+    for element_row in element_rows:
+        name, parent_id = element_row[1], element_row[5]
+        children.setdefault(parent_id, {})[name] = element_row
+    return children
+
+def _get_properties(element_row):
+    return Element.build_properties(*element_row[:-1])
+
+def _get_own_properties(properties):
+    return dict((key, value) for key, value in properties.iteritems()
+                if key not in ('id', 'parent'))
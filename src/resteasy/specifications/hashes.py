@@ -0,0 +1,106 @@
+'''
+Merkle hashes of the element trees.
+
+Every element stores a subtree hash of its own properties and of the subtree
+hashes of its children, and every resource stores a tree hash of its root
+elements. Unlike the ids, the hashes do not depend on the resource or the
+specification, so equal hashes in two versions of a specification mean equal
+subtrees and diffs only need to descend where hashes differ.
+'''
+
+from hashlib import md5
+from resteasy.specifications import batch
+from resteasy.specifications.models import Resource, Element
+
+def get_subtree_hash(name, type, is_required, is_static, child_hashes):
+    md5_hash = md5()
+    md5_hash.update(repr((name, type, bool(is_required), bool(is_static))))
+    for child_hash in sorted(child_hashes):
+        md5_hash.update(child_hash)
+    return md5_hash.hexdigest()
+
+def get_tree_hash(root_hashes):
+    md5_hash = md5()
+    for root_hash in sorted(root_hashes):
+        md5_hash.update(root_hash)
+    return md5_hash.hexdigest()
+
+def update_hashes(resource_id):
+    '''
+    Recomputes the hashes of a resource's elements in memory from one query
+    and writes back only those that changed. Must run under transaction
+    management, see batch.py.
+    '''
+    element_rows = (Element.objects.filter(resource__id=resource_id)
+                                   .values_list('id', 'name', 'type',
+                                                'is_required', 'is_static',
+                                                'parent', 'subtree_hash'))
+    properties = {}
+    stored_hashes = {}
+    children = {}
+    for (id, name, type, is_required, is_static, parent_id,
+         subtree_hash) in element_rows:
+        properties[id] = name, type, is_required, is_static
+        stored_hashes[id] = subtree_hash
+        children.setdefault(parent_id, []).append(id)
+
+    # Parents come before their children in a preorder walk, so walking it
+    # backwards hashes every child before its parent.
+    preorder = []
+    pending = list(children.get(None, []))
+    while pending:
+        id = pending.pop()
+        preorder.append(id)
+        pending.extend(children.get(id, []))
+
+    subtree_hashes = {}
+    for id in reversed(preorder):
+        child_hashes = [subtree_hashes[child_id]
+                        for child_id in children.get(id, [])]
+        subtree_hashes[id] = get_subtree_hash(*(properties[id] +
+                                                (child_hashes,)))
+
+    batch.update_field(Element, 'subtree_hash',
+                       [(id, subtree_hash)
+                        for id, subtree_hash in subtree_hashes.iteritems()
+                        if subtree_hash != stored_hashes[id]])
+    tree_hash = get_tree_hash(subtree_hashes[id]
+                              for id in children.get(None, []))
+    Resource.objects.filter(id=resource_id).update(tree_hash=tree_hash)
+    return tree_hash
+
+def update_ancestor_hashes(resource_id, element_id):
+    '''
+    Recomputes the hashes of an element and of its ancestors, and the tree
+    hash of its resource, after the element or its children were written.
+    Only the rows along the path to the root are read, so a single element
+    write costs a few queries per level rather than the whole tree. Pass the
+    parent of a deleted element, or None if it was a root.
+    '''
+    id = element_id
+    while id is not None:
+        name, type, is_required, is_static, parent_id = (
+                Element.objects.values_list('name', 'type', 'is_required',
+                                            'is_static', 'parent')
+                               .get(id=id))
+        child_hashes = list(Element.objects.filter(parent__id=id)
+                                           .values_list('subtree_hash',
+                                                        flat=True))
+        if '' in child_hashes:
+            # Written before hashes were stored
+            return update_hashes(resource_id)
+        
+        Element.objects.filter(id=id).update(
+                subtree_hash=get_subtree_hash(name, type, is_required,
+                                              is_static, child_hashes))
+        id = parent_id
+    
+    root_hashes = list(Element.objects.filter(resource__id=resource_id,
+                                              parent__isnull=True)
+                                      .values_list('subtree_hash', flat=True))
+    if '' in root_hashes:
+        return update_hashes(resource_id)
+    
+    tree_hash = get_tree_hash(root_hashes)
+    Resource.objects.filter(id=resource_id).update(tree_hash=tree_hash)
+    return tree_hash
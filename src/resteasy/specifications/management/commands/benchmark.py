@@ -0,0 +1,82 @@
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from resteasy.specifications.benchmarks import (DEFAULT_SCALE, compare,
+                                                run_benchmarks)
+from resteasy.specifications.serialization import json_codec
+
+class Command(BaseCommand):
+    help = ('Loads synthetic specifications into a throwaway test database, '
+            'times every view of the API against them and writes the '
+            'results as JSON. Fails if a baseline is given and the results '
+            'regressed beyond the threshold.')
+    option_list = BaseCommand.option_list + (
+        make_option('--specifications', type='int',
+                    default=DEFAULT_SCALE['specifications'],
+                    help='Number of specifications to generate.'),
+        make_option('--resources', type='int',
+                    default=DEFAULT_SCALE['resources'],
+                    help='Resources per specification.'),
+        make_option('--depth', type='int', default=DEFAULT_SCALE['depth'],
+                    help='Levels of elements per resource.'),
+        make_option('--fan-out', type='int', dest='fan_out',
+                    default=DEFAULT_SCALE['fanOut'],
+                    help='Children per element.'),
+        make_option('--iterations', type='int', default=50,
+                    help='Requests per scenario.'),
+        make_option('--scenarios', default=None,
+                    help='Comma separated names of the scenarios to run, '
+                         'all of them by default.'),
+        make_option('--output', default=None,
+                    help='File to write the results to instead of standard '
+                         'output, e.g. to use as a later baseline.'),
+        make_option('--baseline', default=None,
+                    help='Results of an earlier run to compare with.'),
+        make_option('--threshold', type='float', default=0.25,
+                    help='Allowed relative slowdown against the baseline.'),
+    )
+
+    def handle(self, *args, **options):
+        if options['specifications'] < 1 or options['resources'] < 1:
+            raise CommandError("--specifications and --resources must be at "
+                               "least 1")
+        if options['iterations'] < 1:
+            raise CommandError("--iterations must be at least 1")
+
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline']) as baseline_file:
+                    baseline = json_codec.loads(baseline_file.read())
+            except (IOError, ValueError) as error:
+                raise CommandError("Cannot read baseline: %s" % error)
+
+        scale = {
+                 'specifications': options['specifications'],
+                 'resources': options['resources'],
+                 'depth': options['depth'],
+                 'fanOut': options['fan_out']
+                }
+        names = None
+        if options['scenarios']:
+            names = options['scenarios'].split(',')
+
+        old_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            results = run_benchmarks(scale, options['iterations'], names)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        output = json_codec.dumps(results)
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(output)
+        else:
+            self.stdout.write(output + '\n')
+
+        if baseline is not None:
+            regressions = compare(results, baseline, options['threshold'])
+            if regressions:
+                raise CommandError("Regressions against %s:\n    %s"
+                                   % (options['baseline'],
+                                      '\n    '.join(regressions)))
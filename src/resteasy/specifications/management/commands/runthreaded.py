@@ -0,0 +1,49 @@
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from resteasy.specifications.server import ThreadPoolWSGIServer
+
+class Command(BaseCommand):
+    args = '[optional port number, or ipaddr:port]'
+    help = ('Serves the project from this process with a bounded pool of '
+            'worker threads, so that many concurrent clients do not need '
+            'more processes. Unlike runserver it does not reload code or '
+            'serve static files.')
+    option_list = BaseCommand.option_list + (
+        make_option('--threads', type='int', default=32,
+                    help='Number of worker threads.'),
+        make_option('--queue-size', type='int', default=None,
+                    dest='queue_size',
+                    help='Accepted connections waiting for a worker, four '
+                         'per thread by default.'),
+        make_option('--quiet', action='store_true', default=False,
+                    help='Do not log every request.'),
+    )
+
+    def handle(self, addrport='', *args, **options):
+        if args:
+            raise CommandError("Usage is runthreaded %s" % self.args)
+
+        address, port = '127.0.0.1', '8000'
+        if ':' in addrport:
+            address, port = addrport.rsplit(':', 1)
+        elif addrport:
+            port = addrport
+        if not port.isdigit():
+            raise CommandError("%r is not a valid port number" % port)
+        if options['threads'] < 1:
+            raise CommandError("--threads must be at least 1")
+
+        from resteasy.wsgi import application
+        server = ThreadPoolWSGIServer((address, int(port)),
+                                      options['threads'],
+                                      options['queue_size'],
+                                      not options['quiet'])
+        server.set_app(application)
+        self.stdout.write("Serving on http://%s:%s/ with %d threads\n"
+                          % (address, port, options['threads']))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,35 @@
+import json
+import sys
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from resteasy.specifications.validation import BatchValidator
+
+class Command(BaseCommand):
+    args = '[file]'
+    help = ('Validates newline delimited JSON payloads tagged with their '
+            'resource id, read from file or standard input, and writes one '
+            'JSON result per line followed by the totals.')
+    option_list = BaseCommand.option_list + (
+        make_option('--processes', type='int', default=None,
+                    help='Number of worker processes, one per CPU by default.'),
+        make_option('--chunk-size', type='int', default=1000,
+                    dest='chunk_size',
+                    help='Payloads of one resource validated per task.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) > 1:
+            raise CommandError("Expected at most one input file")
+        
+        if args and args[0] != '-':
+            try:
+                lines = open(args[0])
+            except IOError as error:
+                raise CommandError(str(error))
+        else:
+            lines = sys.stdin
+        
+        batch_validator = BatchValidator(options['processes'],
+                                         options['chunk_size'])
+        for result in batch_validator.validate(lines):
+            self.stdout.write(json.dumps(result) + '\n')
@@ -0,0 +1,294 @@
+'''
+Request metrics in the Prometheus text format, and a sampling profiler.
+
+MetricsMiddleware times every request and records, per view, its latency,
+the number and duration of its SQL queries, the time spent serializing its
+response and the size of that response. The views add their serialization
+time with add_serialization_time() and count InvalidRequest errors with
+count_invalid_request(). /metrics renders everything with render().
+
+Metrics are kept per process, so each process of a deployment has to be
+scraped. Queries are counted on every database in settings.DATABASES by
+wrapping the cursors of the request thread's connections, which only times
+them: unlike Django's debug cursor it keeps no SQL. The queries and bytes of
+streamed responses, which are only produced after the view has returned,
+are not included.
+
+When SPECIFICATIONS_PROFILING is on, a request with ?profile=true returns
+the stacks sampled while it ran, in the collapsed format of flame graph
+tools, instead of its response.
+'''
+
+import sys
+import threading
+import time
+from collections import defaultdict
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+from resteasy.specifications.cache import response_cache
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+BYTE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+PROFILE_INTERVAL = 0.001
+UNRESOLVED_VIEW = 'unresolved'
+
+class Counter(object):
+    def __init__(self, name, help, label_names):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, labels, value=1):
+        with self._lock:
+            self._values[labels] += value
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help),
+                 '# TYPE %s counter' % self.name]
+        with self._lock:
+            for labels, value in sorted(self._values.iteritems()):
+                lines.append('%s%s %s' % (self.name,
+                                          _format_labels(self.label_names,
+                                                         labels),
+                                          _format_value(value)))
+        return lines
+
+class Histogram(object):
+    def __init__(self, name, help, label_names, buckets):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = buckets
+        # Labels -> [count per bucket..., count above the last, sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            values = self._values.get(labels)
+            if values is None:
+                values = self._values[labels] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    values[index] += 1
+                    break
+            else:
+                values[-2] += 1
+            values[-1] += value
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help),
+                 '# TYPE %s histogram' % self.name]
+        label_names = self.label_names + ('le',)
+        with self._lock:
+            for labels, values in sorted(self._values.iteritems()):
+                # Buckets are cumulative in the exposition format
+                count = 0
+                for bound, bucket_count in zip(self.buckets + ('+Inf',),
+                                               values[:-1]):
+                    count += bucket_count
+                    lines.append('%s_bucket%s %d'
+                                 % (self.name,
+                                    _format_labels(label_names,
+                                                   labels + (bound,)),
+                                    count))
+                label_text = _format_labels(self.label_names, labels)
+                lines.append('%s_sum%s %s' % (self.name, label_text,
+                                              _format_value(values[-1])))
+                lines.append('%s_count%s %d' % (self.name, label_text, count))
+        return lines
+
+def _format_labels(names, values):
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value))
+                             for name, value in zip(names, values))
+
+def _escape(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+                      .replace('\n', '\\n'))
+
+def _format_value(value):
+    if value == int(value):
+        return '%d' % value
+    return repr(value)
+
+requests = Counter('resteasy_requests_total',
+                   "Requests by view, method and status code.",
+                   ('view', 'method', 'status'))
+request_seconds = Histogram('resteasy_request_duration_seconds',
+                            "Time from receiving a request to returning its "
+                            "response.", ('view', 'method'), LATENCY_BUCKETS)
+query_counts = Histogram('resteasy_request_queries',
+                         "SQL queries run per request.", ('view',),
+                         QUERY_BUCKETS)
+query_seconds = Histogram('resteasy_request_sql_duration_seconds',
+                          "Time spent in SQL queries per request.", ('view',),
+                          LATENCY_BUCKETS)
+serialization_seconds = Histogram('resteasy_serialization_duration_seconds',
+                                  "Time spent encoding response bodies per "
+                                  "request.", ('view',), LATENCY_BUCKETS)
+response_bytes = Histogram('resteasy_response_bytes',
+                           "Size of unstreamed response bodies.", ('view',),
+                           BYTE_BUCKETS)
+invalid_requests = Counter('resteasy_invalid_requests_total',
+                           "Requests rejected with an InvalidRequest, by "
+                           "view and status.", ('view', 'status'))
+
+METRICS = (requests, request_seconds, query_counts, query_seconds,
+           serialization_seconds, response_bytes, invalid_requests)
+
+def add_serialization_time(request, seconds):
+    request.metrics_serialization_seconds = (
+                    getattr(request, 'metrics_serialization_seconds', 0)
+                    + seconds)
+
+def count_invalid_request(request, status):
+    invalid_requests.inc((_get_view_name(request), status))
+
+def render():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+
+    cache_stats = response_cache.get_stats()
+    for key, name in [('hits', 'hits'), ('backendHits', 'backend_hits'),
+                      ('misses', 'misses'), ('evictions', 'evictions'),
+                      ('invalidations', 'invalidations')]:
+        metric_name = 'resteasy_response_cache_%s_total' % name
+        lines.extend(['# TYPE %s counter' % metric_name,
+                      '%s %d' % (metric_name, cache_stats[key])])
+    lines.extend(['# TYPE resteasy_response_cache_entries gauge',
+                  'resteasy_response_cache_entries %d'
+                  % cache_stats['entries']])
+    return '\n'.join(lines) + '\n'
+
+def _get_view_name(request):
+    return getattr(request, 'metrics_view', UNRESOLVED_VIEW)
+
+# Number and duration of the queries run by the current thread since its
+# request started
+_queries = threading.local()
+
+class QueryCountingCursor(object):
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, sql, params=()):
+        started = time.time()
+        try:
+            return self.cursor.execute(sql, params)
+        finally:
+            _count_query(time.time() - started)
+
+    def executemany(self, sql, param_list):
+        started = time.time()
+        try:
+            return self.cursor.executemany(sql, param_list)
+        finally:
+            _count_query(time.time() - started)
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+def _count_query(seconds):
+    _queries.count = getattr(_queries, 'count', 0) + 1
+    _queries.seconds = getattr(_queries, 'seconds', 0.0) + seconds
+
+def _count_queries(connection):
+    # Connections are thread local, so each thread wraps its own once
+    if 'cursor' in connection.__dict__:
+        return
+
+    get_cursor = connection.cursor
+    connection.cursor = lambda: QueryCountingCursor(get_cursor())
+
+class MetricsMiddleware(object):
+    def process_request(self, request):
+        request.metrics_started = time.time()
+        for alias in settings.DATABASES:
+            _count_queries(connections[alias])
+        _queries.count = 0
+        _queries.seconds = 0.0
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.metrics_view = view_func.__name__
+        if (getattr(settings, 'SPECIFICATIONS_PROFILING', False)
+            and request.GET.get('profile') in ('true', '1')):
+            return _profile(request, view_func, view_args, view_kwargs)
+        return None
+
+    def process_response(self, request, response):
+        started = getattr(request, 'metrics_started', None)
+        if started is None:
+            return response
+
+        view_name = _get_view_name(request)
+        requests.inc((view_name, request.method, response.status_code))
+        request_seconds.observe((view_name, request.method),
+                                time.time() - started)
+        query_counts.observe((view_name,), getattr(_queries, 'count', 0))
+        query_seconds.observe((view_name,), getattr(_queries, 'seconds', 0.0))
+        if hasattr(request, 'metrics_serialization_seconds'):
+            serialization_seconds.observe((view_name,),
+                                    request.metrics_serialization_seconds)
+        if getattr(response, '_is_string', True):
+            response_bytes.observe((view_name,), len(response.content))
+        return response
+
+class SamplingProfiler(object):
+    '''
+    Samples the stack of one thread every interval seconds from a second
+    thread, which costs the profiled code far less than tracing every call.
+    '''
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = defaultdict(int)
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sample)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def get_collapsed_stacks(self):
+        # One "outermost;...;innermost count" line per stack, most frequent
+        # first
+        return ''.join('%s %d\n' % (';'.join(stack), count)
+                       for stack, count in sorted(self.samples.iteritems(),
+                                                  key=lambda item: -item[1]))
+
+    def _sample(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('%s (%s:%d)' % (code.co_name, code.co_filename,
+                                             code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                self.samples[tuple(reversed(stack))] += 1
+
+def _profile(request, view_func, view_args, view_kwargs):
+    profiler = SamplingProfiler(threading.current_thread().ident)
+    profiler.start()
+    try:
+        response = view_func(request, *view_args, **view_kwargs)
+        # Streamed content is produced, and profiled, here
+        response.content
+    finally:
+        profiler.stop()
+    return HttpResponse(profiler.get_collapsed_stacks(), 'text/plain')
@@ -0,0 +1,48 @@
+'''
+Example payloads generated from the element tree of a resource, served by the
+mock view for integration tests and load tests.
+'''
+
+# Values used for elements without children, by element type. Elements of
+# any other type get their type name as a string value.
+EXAMPLES = {
+            'object': {},
+            'array': [],
+            'string': 'string',
+            'number': 0,
+            'integer': 0,
+            'boolean': True,
+            'null': None,
+           }
+
+def build_example(element_rows, include_optional=True):
+    '''
+    Builds a payload from (id, name, type, is_required, parent id) rows.
+    Elements with children become objects, except arrays, which get a single
+    item described by their children.
+    '''
+    children = {}
+    for id, name, type, is_required, parent_id in element_rows:
+        if is_required or include_optional:
+            children.setdefault(parent_id, []).append((id, name, type))
+
+    payload = {}
+    pending = [(payload, children.get(None, []))]
+    while pending:
+        container, element_rows = pending.pop()
+        for id, name, type in element_rows:
+            if id not in children:
+                value = EXAMPLES.get(type, type)
+                if isinstance(value, (dict, list)):
+                    # Copy the shared empty object or array
+                    value = value.__class__()
+            elif type == 'array':
+                item = {}
+                value = [item]
+                pending.append((item, children[id]))
+            else:
+                value = {}
+                pending.append((value, children[id]))
+            container[name] = value
+
+    return payload
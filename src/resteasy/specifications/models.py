@@ -1,10 +1,18 @@
 from hashlib import md5
 from django.db import models
+from resteasy.specifications.serialization import json_codec
 
 class Specification(models.Model):
     id = models.CharField(primary_key=True, max_length=32)
     name = models.TextField()
     version = models.TextField()
+    # Set to the change sequence whenever a resource or element of this
+    # specification is written, see _bump_revision() in views.py
+    revision = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        # Also serves the name/version lookups of the resources views
+        unique_together = ('name', 'version')
     
     def generate_id(self):
         md5_hash = md5()
@@ -25,20 +33,56 @@ class Resource(models.Model):
     id = models.CharField(primary_key=True, max_length=32)
     url = models.TextField()
     specification = models.ForeignKey(Specification)
+    # Set to the change sequence whenever an element of this resource is
+    # written
+    revision = models.PositiveIntegerField(default=0)
+    # Hash of the subtree hashes of the root elements, see hashes.py
+    tree_hash = models.CharField(max_length=32, blank=True, default='')
+    
+    # Columns needed by build_properties, for values_list() queries that
+    # serialize resources without instantiating models.
+    ROW_FIELDS = ('id', 'url', 'specification__name', 
+                  'specification__version')
+    # The ROW_FIELDS column behind each key of build_properties, so that
+    # ?fields= projections only fetch the columns they need.
+    PROPERTY_FIELDS = {
+                       'id': 'id',
+                       'url': 'url',
+                       'specName': 'specification__name',
+                       'specVersion': 'specification__version',
+                       'elementsHref': 'id'
+                      }
     
     def generate_id(self):
+        self.id = Resource.build_id(self.url, self.specification_id)
+    
+    @staticmethod
+    def build_id(url, specification_id):
         md5_hash = md5()
-        md5_hash.update(self.url+self.specification.id)
-        self.id = md5_hash.hexdigest()
+        md5_hash.update(url+specification_id)
+        return md5_hash.hexdigest()
     
-    def get_properties(self):
+    @staticmethod
+    def build_properties(id, url, spec_name, spec_version):
         return {
-                'id' : self.id,
-                'url' : self.url,
-                'specName': self.specification.name, 
-                'specVersion': self.specification.version,
-                'elementsHref': '/specifications/%s/elements' % self.id
+                'id' : id,
+                'url' : url,
+                'specName': spec_name, 
+                'specVersion': spec_version,
+                'elementsHref': '/specifications/%s/elements' % id
                }
+    
+    @staticmethod
+    def replace_version(url, version, new_version):
+        # Urls conventionally contain the specification version as a segment
+        return '/'.join(new_version if segment == version else segment
+                        for segment in url.split('/'))
+    
+    def get_properties(self):
+        return Resource.build_properties(self.id,
+                                         self.url,
+                                         self.specification.name,
+                                         self.specification.version)
      
     def __unicode__(self):
         return self.url
@@ -51,35 +95,65 @@ class Element(models.Model):
     is_static = models.BooleanField(default=True);
     resource = models.ForeignKey(Resource)
     parent = models.ForeignKey('self', null=True, blank=True)
+    # Hash of this element's properties and of its children's subtree hashes,
+    # independent of the resource, see hashes.py
+    subtree_hash = models.CharField(max_length=32, blank=True, default='')
+    
+    # Columns needed by build_properties, for values_list() queries that
+    # serialize elements without instantiating models.
+    ROW_FIELDS = ('id', 'name', 'type', 'is_required', 'is_static', 'parent')
+    # The ROW_FIELDS column behind each key of build_properties
+    PROPERTY_FIELDS = {
+                       'id': 'id',
+                       'name': 'name',
+                       'type': 'type',
+                       'required': 'is_required',
+                       'static': 'is_static',
+                       'parent': 'parent'
+                      }
     
     def generate_id(self):
+        self.id = Element.build_id(self.name, self.resource_id,
+                                   self.parent_id, self.id)
+    
+    @staticmethod
+    def build_id(name, resource_id, parent_id=None, id=''):
         tokens = [
-                    self.id,
-                    self.name,
-                    self.resource.id,
+                    id,
+                    name,
+                    resource_id,
                  ]
         
-        if self.parent:
-            tokens.append(self.parent.id)
+        if parent_id:
+            tokens.append(parent_id)
             
         md5_input = "".join(token for token in tokens)
         md5_hash = md5()
         md5_hash.update(md5_input)
-        self.id = md5_hash.hexdigest()
-        
-    def get_properties(self):
+        return md5_hash.hexdigest()
+    
+    @staticmethod
+    def build_properties(id, name, type, is_required, is_static, parent_id):
         elements = {
-                      'id': self.id,
-                      'name' : self.name,
-                      'type' : self.type,
-                      'required' : self.is_required,
-                      'static' : self.is_static,
+                      'id': id,
+                      'name' : name,
+                      'type' : type,
+                      'required' : is_required,
+                      'static' : is_static,
                      }
         
-        if self.parent:
-            elements['parent'] = self.parent.id
+        if parent_id:
+            elements['parent'] = parent_id
+        
+        return id, elements
         
-        return self.id, elements
+    def get_properties(self):
+        return Element.build_properties(self.id,
+                                        self.name,
+                                        self.type,
+                                        self.is_required,
+                                        self.is_static,
+                                        self.parent_id)
     
     def __unicode__(self):
         tokens = [
@@ -94,4 +168,41 @@ class Element(models.Model):
                             self.parent.name
                            ])
                                  
-        return "".join([token for token in tokens])
\ No newline at end of file
+        return "".join([token for token in tokens])
+class Change(models.Model):
+    # The auto incremented id is the sequence number of the change, see
+    # changes.py
+    kind = models.CharField(max_length=20)
+    action = models.CharField(max_length=10)
+    object_id = models.TextField()
+    # Id of the specification of a resource or of the resource of an element
+    owner_id = models.TextField(null=True, blank=True)
+    # JSON of the properties of a saved object, empty for deletes
+    properties = models.TextField(blank=True, default='')
+    
+    ROW_FIELDS = ('id', 'kind', 'action', 'object_id', 'owner_id',
+                  'properties')
+    OWNER_KEYS = {
+                  'resource': 'specificationId',
+                  'element': 'resourceId'
+                 }
+    
+    @staticmethod
+    def build_properties(id, kind, action, object_id, owner_id, properties):
+        change = {
+                  'sequence': id,
+                  'kind': kind,
+                  'action': action,
+                  'id': object_id
+                 }
+        
+        if owner_id:
+            change[Change.OWNER_KEYS[kind]] = owner_id
+        if properties:
+            change['properties'] = json_codec.loads(properties)
+        
+        return change
+    
+    def __unicode__(self):
+        return "%s: %s %s %s" % (self.id, self.action, self.kind,
+                                 self.object_id)
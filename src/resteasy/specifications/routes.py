@@ -0,0 +1,200 @@
+'''
+Index resolving request paths to the resources whose urls they match.
+
+Resource urls are split into '/' separated segments and stored in a trie.
+A segment written as {name} is a template matching any single segment, whose
+value is returned as a parameter. Literal segments take precedence over
+templates when both match.
+
+The index is loaded from the database on first use and then updated by the
+write paths of this process, once their transaction has committed. Writes
+made by other processes are picked up when a path fails to resolve and the
+resources have changed since the index was loaded, checked at most once
+every RELOAD_INTERVAL seconds.
+'''
+
+import threading
+import time
+from functools import wraps
+from django.db.models import Count, Sum
+from resteasy.specifications.models import Specification, Resource
+
+RELOAD_INTERVAL = 1.0
+
+class _Node(object):
+    __slots__ = ('literals', 'template', 'resources')
+
+    def __init__(self):
+        self.literals = {}
+        self.template = None
+        # Resource id -> (url, template parameter names) for urls ending here
+        self.resources = {}
+
+class RouteIndex(object):
+    def __init__(self):
+        self.root = _Node()
+        self.is_loaded = False
+        self.state = None
+        self.checked = 0
+        self._lock = threading.RLock()
+        self._local = threading.local()
+
+    def deferred(self, function):
+        '''
+        Decorates a function writing in a transaction, above its
+        commit_on_success, so that the urls it adds or removes are applied
+        once its transaction has committed, and dropped if it raises.
+        '''
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if getattr(self._local, 'changes', None) is not None:
+                # Applied by the outermost call
+                return function(*args, **kwargs)
+            
+            self._local.changes = []
+            try:
+                result = function(*args, **kwargs)
+                changes = self._local.changes
+            finally:
+                self._local.changes = None
+            for change, url, resource_id in changes:
+                change(url, resource_id)
+            return result
+        return wrapper
+
+    def add(self, url, resource_id):
+        changes = getattr(self._local, 'changes', None)
+        if changes is None:
+            self._add(url, resource_id)
+        else:
+            changes.append((self._add, url, resource_id))
+
+    def remove(self, url, resource_id):
+        changes = getattr(self._local, 'changes', None)
+        if changes is None:
+            self._remove(url, resource_id)
+        else:
+            changes.append((self._remove, url, resource_id))
+
+    def _add(self, url, resource_id):
+        with self._lock:
+            if not self.is_loaded:
+                # Loading will read it from the database
+                return
+
+            node = self.root
+            names = []
+            for segment in _get_segments(url):
+                name = _get_template_name(segment)
+                if name is None:
+                    node = node.literals.setdefault(segment, _Node())
+                else:
+                    if node.template is None:
+                        node.template = _Node()
+                    node = node.template
+                    names.append(name)
+            node.resources[resource_id] = url, names
+
+    def _remove(self, url, resource_id):
+        with self._lock:
+            path = [(self.root, None)]
+            for segment in _get_segments(url):
+                if _get_template_name(segment) is None:
+                    node = path[-1][0].literals.get(segment)
+                else:
+                    node = path[-1][0].template
+                if node is None:
+                    return
+                path.append((node, segment))
+
+            path[-1][0].resources.pop(resource_id, None)
+            # Prune the nodes left without urls below them
+            while len(path) > 1:
+                node, segment = path.pop()
+                if node.resources or node.literals or node.template:
+                    break
+                parent = path[-1][0]
+                if _get_template_name(segment) is None:
+                    del parent.literals[segment]
+                else:
+                    parent.template = None
+
+    def clear(self):
+        with self._lock:
+            self.root = _Node()
+            self.is_loaded = False
+
+    def resolve(self, path):
+        '''
+        Returns the ids of the resources matching a concrete path, along
+        with their url and the values of its template segments, as a list of
+        (resource id, url, parameters) tuples ordered by url and id. Only the
+        urls with the most literal segments from the left are returned, as a
+        literal segment is preferred over a template at each level. The list
+        is empty if nothing matches.
+        '''
+        self.load()
+        matches = self._resolve(path)
+        if not matches and self._is_stale():
+            self.load(reload=True)
+            matches = self._resolve(path)
+        return matches
+
+    def load(self, reload=False):
+        with self._lock:
+            if self.is_loaded and not reload:
+                return
+
+            self.root = _Node()
+            self.state = _get_state()
+            self.checked = time.time()
+            self.is_loaded = True
+            for id, url in Resource.objects.values_list('id', 'url').iterator():
+                self._add(url, id)
+
+    def _resolve(self, path):
+        segments = _get_segments(path)
+        # Depth first, trying literal children before the template child so
+        # that the most specific url wins; values holds the template values
+        # matched on the way down.
+        pending = [(self.root, 0, [])]
+        while pending:
+            node, depth, values = pending.pop()
+            if depth == len(segments):
+                if node.resources:
+                    return [(id, url, dict(zip(names, values)))
+                            for id, (url, names) in sorted(
+                                node.resources.iteritems(),
+                                key=lambda item: (item[1][0], item[0]))]
+                continue
+
+            segment = segments[depth]
+            if node.template is not None:
+                pending.append((node.template, depth + 1, values + [segment]))
+            literal = node.literals.get(segment)
+            if literal is not None:
+                pending.append((literal, depth + 1, values))
+        return []
+
+    def _is_stale(self):
+        now = time.time()
+        if now - self.checked < RELOAD_INTERVAL:
+            return False
+        self.checked = now
+        return _get_state() != self.state
+
+def _get_state():
+    # Adding or deleting a resource changes the resource count or bumps the
+    # revision of its specification
+    return (Resource.objects.aggregate(Count('id'))['id__count'],
+            Specification.objects.aggregate(Sum('revision'))['revision__sum'])
+
+def _get_segments(url):
+    return url.strip('/').split('/')
+
+def _get_template_name(segment):
+    if len(segment) > 2 and segment[0] == '{' and segment[-1] == '}':
+        return segment[1:-1]
+    return None
+
+route_index = RouteIndex()
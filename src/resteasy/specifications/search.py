@@ -0,0 +1,284 @@
+'''
+Full-text index of resource urls and element names and types.
+
+Texts are split into lower case words of letters and digits. Words written
+in camelCase are also indexed by their parts, so that a search for timeout
+finds connectTimeout. A query matches the resources and elements having all
+of its words, where a word ending with * matches any word it starts.
+
+Matches are ranked by the sum of the weights of their query words. A word
+weighs more the rarer it is across the index and the shorter the text it
+was found in, and weighs FIELD_WEIGHTS more in an element name than in a
+url or an element type.
+
+The index is loaded from the database on first use. After that it applies
+the change log, see changes.py, from the last sequence number it has seen
+before each search. It thereby follows the writes of every process, at the
+cost of one query per search when there were none.
+'''
+
+import heapq
+import math
+import re
+import threading
+from resteasy.specifications.changes import (DELETE, get_changes,
+                                             get_last_sequence)
+from resteasy.specifications.models import Resource, Element
+from resteasy.specifications.serialization import json_codec
+
+FIELD_WEIGHTS = {
+                 'name': 3.0,
+                 'url': 2.0,
+                 'type': 1.0
+                }
+# Changes applied per query while catching up with the change log
+CHANGE_BATCH_SIZE = 5000
+
+_WORD = re.compile(r'[A-Za-z0-9]+')
+_QUERY_WORD = re.compile(r'([A-Za-z0-9]+)(\*?)')
+_CAMEL_CASE_PART = re.compile(r'[A-Z0-9]+(?![a-z])|[A-Z]?[a-z0-9]+')
+
+class Document(object):
+    __slots__ = ('kind', 'id', 'owner_id', 'parent_id', 'text', 'type',
+                 'spec_name', 'spec_version')
+
+    def __init__(self, kind, id, owner_id, text, parent_id=None, type=None,
+                 spec_name=None, spec_version=None):
+        # A resource is owned by its specification, and its text is its url.
+        # An element is owned by its resource, and its text is its name.
+        self.kind = kind
+        self.id = id
+        self.owner_id = owner_id
+        self.text = text
+        self.parent_id = parent_id
+        self.type = type
+        self.spec_name = spec_name
+        self.spec_version = spec_version
+
+    def get_fields(self):
+        if self.kind == 'resource':
+            return [('url', self.text)]
+        return [('name', self.text), ('type', self.type)]
+
+class SearchIndex(object):
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.is_loaded = False
+            self.sequence = 0
+            self.documents = {}
+            # Word -> {document id: weight of the word in the document}
+            self.postings = {}
+            # Specification or resource id -> ids of the documents it owns
+            self.owned = {}
+
+    def load(self, reload=False):
+        with self._lock:
+            if self.is_loaded and not reload:
+                return
+
+            self.clear()
+            self.is_loaded = True
+            # Changes committed while the rows are read are applied again
+            # afterwards, which leaves the index as the change log says.
+            self.sequence = get_last_sequence()
+            resource_rows = Resource.objects.values_list('id', 'url',
+                                                'specification',
+                                                'specification__name',
+                                                'specification__version')
+            for id, url, spec_id, spec_name, spec_version in (
+                                                resource_rows.iterator()):
+                self._add(Document('resource', id, spec_id, url,
+                                   spec_name=spec_name,
+                                   spec_version=spec_version))
+            element_rows = Element.objects.values_list('id', 'name', 'type',
+                                                       'resource', 'parent')
+            for id, name, type, resource_id, parent_id in (
+                                                element_rows.iterator()):
+                self._add(Document('element', id, resource_id, name,
+                                   parent_id, type))
+
+    def refresh(self):
+        '''
+        Loads the index or applies the changes recorded since it was last
+        refreshed.
+        '''
+        with self._lock:
+            if not self.is_loaded:
+                self.load()
+                return
+
+            while True:
+                change_rows = get_changes(self.sequence, CHANGE_BATCH_SIZE)
+                for change_row in change_rows:
+                    self._apply(*change_row)
+                if len(change_rows) < CHANGE_BATCH_SIZE:
+                    return
+
+    def search(self, query, spec_name=None, spec_version=None, offset=0,
+               limit=100):
+        '''
+        Returns the number of documents matching query, restricted to a
+        specification name and version if given, along with a page of
+        (score, document) tuples of them, best first.
+        '''
+        words = _get_query_words(query)
+        if not words:
+            return 0, []
+
+        self.refresh()
+        with self._lock:
+            word_weights = [self._get_weights(word, is_prefix)
+                            for word, is_prefix in words]
+            matches = None
+            # Intersecting the rarest word first keeps the sets small
+            for weights in sorted(word_weights, key=len):
+                if matches is None:
+                    matches = set(weights)
+                else:
+                    matches.intersection_update(weights)
+                if not matches:
+                    return 0, []
+
+            if spec_name is not None or spec_version is not None:
+                matches = [id for id in matches
+                           if self._is_in_specification(self.documents[id],
+                                                        spec_name,
+                                                        spec_version)]
+
+            scores = dict((id, 0.0) for id in matches)
+            document_count = float(len(self.documents))
+            for weights in word_weights:
+                rarity = math.log(1 + document_count / len(weights))
+                for id in scores:
+                    scores[id] += rarity * weights[id]
+
+            page = heapq.nsmallest(offset + limit, scores.iteritems(),
+                                   key=lambda item: (-item[1], item[0]))
+            return len(scores), [(score, self.documents[id])
+                                 for id, score in page[offset:]]
+
+    def get_path(self, document):
+        # The names from the root element down, as in validation messages
+        names = []
+        while document is not None:
+            names.append(document.text or '')
+            document = self.documents.get(document.parent_id)
+        return '$.' + '.'.join(reversed(names))
+
+    def get_resource(self, document):
+        if document.kind == 'resource':
+            return document
+        return self.documents.get(document.owner_id)
+
+    def _get_weights(self, word, is_prefix):
+        if not is_prefix:
+            return self.postings.get(word, {})
+
+        weights = {}
+        for indexed_word, word_weights in self.postings.iteritems():
+            if indexed_word.startswith(word):
+                for id, weight in word_weights.iteritems():
+                    if weight > weights.get(id, 0):
+                        weights[id] = weight
+        return weights
+
+    def _is_in_specification(self, document, spec_name, spec_version):
+        resource = self.get_resource(document)
+        return (resource is not None
+                and spec_name in (None, resource.spec_name)
+                and spec_version in (None, resource.spec_version))
+
+    def _apply(self, sequence, kind, action, object_id, owner_id, properties):
+        self.sequence = sequence
+        if action == DELETE:
+            self._remove_all(object_id)
+            return
+
+        if kind == 'resource':
+            properties = json_codec.loads(properties)
+            self._add(Document('resource', object_id, owner_id,
+                               properties['url'],
+                               spec_name=properties['specName'],
+                               spec_version=properties['specVersion']))
+        elif kind == 'element':
+            properties = json_codec.loads(properties)
+            self._add(Document('element', object_id, owner_id,
+                               properties['name'], properties.get('parent'),
+                               properties['type']))
+
+    def _add(self, document):
+        # A saved document replaces the one with the same id
+        self._remove(document.id)
+        self.documents[document.id] = document
+        self.owned.setdefault(document.owner_id, set()).add(document.id)
+        for word, weight in _get_weights(document).iteritems():
+            self.postings.setdefault(word, {})[document.id] = weight
+
+    def _remove_all(self, id):
+        # Deleting a specification deletes its resources, a resource its
+        # elements and an element its descendants
+        document = self.documents.get(id)
+        if document is not None and document.kind == 'element':
+            children = {}
+            for owned_id in self.owned.get(document.owner_id, ()):
+                children.setdefault(self.documents[owned_id].parent_id,
+                                    []).append(owned_id)
+        else:
+            children = None
+
+        pending = [id]
+        while pending:
+            id = pending.pop()
+            if children is None:
+                pending.extend(self.owned.get(id, ()))
+            else:
+                pending.extend(children.get(id, ()))
+            self._remove(id)
+
+    def _remove(self, id):
+        document = self.documents.pop(id, None)
+        if document is None:
+            return
+
+        owned = self.owned.get(document.owner_id)
+        owned.discard(id)
+        if not owned:
+            del self.owned[document.owner_id]
+        for word in _get_weights(document):
+            weights = self.postings[word]
+            del weights[id]
+            if not weights:
+                del self.postings[word]
+
+def get_words(text):
+    words = set()
+    for word in _WORD.findall(text or ''):
+        words.add(word.lower())
+        parts = _CAMEL_CASE_PART.findall(word)
+        if len(parts) > 1:
+            words.update(part.lower() for part in parts)
+    return words
+
+def _get_query_words(query):
+    return [(word.lower(), bool(star))
+            for word, star in _QUERY_WORD.findall(query)]
+
+def _get_weights(document):
+    weights = {}
+    for field, text in document.get_fields():
+        words = get_words(text)
+        if not words:
+            continue
+        # Words of short texts weigh more, so that a name equal to the
+        # query ranks above longer names containing it
+        weight = FIELD_WEIGHTS[field] / math.sqrt(len(words))
+        for word in words:
+            if weight > weights.get(word, 0):
+                weights[word] = weight
+    return weights
+
+search_index = SearchIndex()
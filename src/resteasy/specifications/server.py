@@ -0,0 +1,69 @@
+'''
+WSGI server handling the connections of one process with a bounded pool of
+worker threads.
+
+Django 1.3 has no asynchronous views, so a request holds whichever thread
+serves it for its whole duration. Serving many slow or polling clients from
+one process therefore takes many threads, which are cheap while they wait
+on the database or the network since waiting releases the GIL. The pool
+bounds their number: connections accepted while every worker is busy wait
+in a queue of queue_size, and beyond that in the listen backlog, rather
+than spawning a thread each.
+
+Every thread has its own database connection, which Django closes at the
+end of each request.
+'''
+
+import threading
+import Queue
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+class ThreadPoolWSGIServer(WSGIServer):
+    # The default backlog of 5 would refuse bursts of clients
+    request_queue_size = 128
+
+    def __init__(self, server_address, threads=32, queue_size=None,
+                 log_requests=True):
+        if log_requests:
+            handler_class = WSGIRequestHandler
+        else:
+            handler_class = QuietWSGIRequestHandler
+        WSGIServer.__init__(self, server_address, handler_class)
+
+        self.connections = Queue.Queue(queue_size or 4 * threads)
+        self.workers = []
+        for index in xrange(threads):
+            worker = threading.Thread(target=self._work,
+                                      name='wsgi-worker-%d' % index)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def process_request(self, request, client_address):
+        # Blocks the accepting thread while the queue is full
+        self.connections.put((request, client_address))
+
+    def server_close(self):
+        WSGIServer.server_close(self)
+        for worker in self.workers:
+            self.connections.put(None)
+        for worker in self.workers:
+            worker.join()
+
+    def _work(self):
+        while True:
+            connection = self.connections.get()
+            if connection is None:
+                return
+
+            request, client_address = connection
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
@@ -0,0 +1,4 @@
+-- Serves the elements listing of a resource in id order, which the keyset
+-- paging and streaming of the elements view rely on.
+CREATE INDEX specifications_element_resource_id_id
+    ON specifications_element (resource_id, id);
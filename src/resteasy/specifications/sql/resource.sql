@@ -0,0 +1,4 @@
+-- Serves the resources listing of a specification in id order, which the
+-- keyset paging and streaming of the resources view rely on.
+CREATE INDEX specifications_resource_specification_id_id
+    ON specifications_resource (specification_id, id);
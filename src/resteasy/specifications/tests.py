@@ -5,7 +5,31 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
-from django.test import TestCase
+import json
+import sqlite3
+import tempfile
+import threading
+import time
+import urllib2
+import zlib
+from StringIO import StringIO
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.utils import unittest
+from resteasy.specifications import (benchmarks, changes, db, validation,
+                                     views)
+from resteasy.specifications.cache import ResponseCache, response_cache
+from resteasy.specifications.compression import brotli
+from resteasy.specifications.hashes import update_hashes
+from resteasy.specifications.models import Specification, Resource, Element
+from resteasy.specifications.routes import route_index
+from resteasy.specifications.search import get_words, search_index
+from resteasy.specifications.serialization import json_codec, msgpack
+from resteasy.specifications.server import ThreadPoolWSGIServer
+from resteasy.specifications.validation import BatchValidator, validator_cache
 
 
 class SimpleTest(TestCase):
@@ -14,3 +38,1618 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+def _post_json(client, url, data):
+    response = client.post(url, json.dumps(data),
+                           content_type='application/json')
+    return response, json.loads(response.content)
+
+def _get_json(client, url, data={}, **extra):
+    response = client.get(url, data, **extra)
+    return response, json.loads(response.content)
+
+def _load_tree(client):
+    document = {
+                'name': 'config',
+                'version': 'v1',
+                'resources': [
+                    {
+                     'url': 'config/v1/first',
+                     'elements': [
+                        {
+                         'name': 'a',
+                         'type': 'object',
+                         'elements': [
+                            {
+                             'name': 'b',
+                             'type': 'object',
+                             'elements': [{'name': 'c', 'type': 'string'}]
+                            }
+                         ]
+                        },
+                        {'name': 'd', 'type': 'number', 'required': False}
+                     ]
+                    }
+                ]
+               }
+    response, data = _post_json(client, '/specifications/bulk', document)
+    return data['resources'][0]['id']
+
+
+class SpecificationTestCase(TestCase):
+    def setUp(self):
+        # The caches outlive the test database
+        response_cache.clear()
+        validator_cache.clear()
+        route_index.clear()
+        search_index.clear()
+
+
+class BulkTest(SpecificationTestCase):
+    def _post(self, url, data):
+        return _post_json(self.client, url, data)
+    
+    def test_bulk_matches_single_posts(self):
+        document = {
+                    'name': 'config',
+                    'version': 'v1',
+                    'resources': [
+                        {
+                         'url': 'config/v1/first',
+                         'elements': [
+                            {
+                             'name': 'parent',
+                             'type': 'object',
+                             'elements': [
+                                {'name': 'child', 'type': 'string',
+                                 'required': False}
+                             ]
+                            }
+                         ]
+                        }
+                    ]
+                   }
+        response, data = self._post('/specifications/bulk', document)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['errors'], [])
+        self.assertEqual(data['elementCount'], 2)
+        
+        spec = Specification(name='config', version='v1')
+        spec.generate_id()
+        resource = Resource(url='config/v1/first', specification=spec)
+        resource.generate_id()
+        parent = Element(name='parent', resource=resource)
+        parent.generate_id()
+        child = Element(name='child', resource=resource, parent=parent)
+        child.generate_id()
+        
+        self.assertEqual(data['resources'][0]['id'], resource.id)
+        self.assertEqual(Element.objects.get(id=child.id).parent_id, parent.id)
+        self.assertFalse(Element.objects.get(id=child.id).is_required)
+    
+    def test_bulk_reports_item_errors(self):
+        document = {
+                    'name': 'config',
+                    'version': 'v1',
+                    'resources': [
+                        {'elements': []},
+                        {
+                         'url': 'config/v1/first',
+                         'elements': [
+                            {'name': 'untyped',
+                             'elements': [{'name': 'x', 'type': 'string'}]},
+                            {'name': 'typed', 'type': 'string'},
+                            {'name': 5, 'type': 'string'},
+                            {'name': 'nulltyped', 'type': None}
+                         ]
+                        },
+                        {'url': 5}
+                    ]
+                   }
+        response, data = self._post('/specifications/bulk', document)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(error['path'], error['message'])
+                          for error in data['errors']],
+                         [('resources[0]', "Missing required key: 'url'"),
+                          ('resources[1].elements[0]',
+                           "Missing required key: 'type'"),
+                          ('resources[1].elements[2]', "name must be a string"),
+                          ('resources[1].elements[3]',
+                           "type must be a string"),
+                          ('resources[2]', "url must be a string")])
+        self.assertEqual(Resource.objects.count(), 1)
+        self.assertEqual(Element.objects.count(), 1)
+        
+        for document in [{'name': 'config', 'version': 'v1', 'resources': 5},
+                         {'name': 'config', 'version': 'v1',
+                          'resources': [{'url': 'config/v1/second',
+                                         'elements': {'name': 'a'}}]},
+                         {'name': 'config', 'version': 5}]:
+            response, data = self._post('/specifications/bulk', document)
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(Resource.objects.count(), 1)
+    
+    def test_bulk_updates_existing_rows(self):
+        document = {
+                    'name': 'config',
+                    'version': 'v1',
+                    'resources': [
+                        {'url': 'config/v1/first',
+                         'elements': [{'name': 'a', 'type': 'string'}]}
+                    ]
+                   }
+        self._post('/specifications/bulk', document)
+        document['resources'][0]['elements'][0]['type'] = 'number'
+        response, data = self._post('/specifications/bulk', document)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Element.objects.get().type, 'number')
+    
+    def test_bulk_requires_specification(self):
+        response, data = self._post('/specifications/bulk', {'name': 'config'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Specification.objects.count(), 0)
+
+
+
+class SpecificationTest(SpecificationTestCase):
+    def test_duplicate_name_and_version(self):
+        response, data = _post_json(self.client,
+                                    '/specifications/specification',
+                                    {'name': 'config', 'version': 'v1'})
+        self.assertEqual(response.status_code, 200)
+        # Posting it again is a no-op
+        response, data = _post_json(self.client,
+                                    '/specifications/specification',
+                                    {'name': 'config', 'version': 'v1'})
+        self.assertEqual(response.status_code, 200)
+        
+        # A row of the same name and version under another id, e.g. written
+        # by a concurrent request
+        Specification.objects.all().update(id='other')
+        response, data = _post_json(self.client,
+                                    '/specifications/specification',
+                                    {'name': 'config', 'version': 'v1'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(data['error']['message'],
+                         "Specification 'config:v1' already exists")
+        self.assertEqual(Specification.objects.count(), 1)
+
+class QueryCountTest(SpecificationTestCase):
+    def _create_elements(self, resource, count):
+        parent = None
+        for index in xrange(count):
+            element = Element(name='element%d' % index, type='object',
+                              resource=resource, parent=parent)
+            element.generate_id()
+            element.save()
+            parent = element
+    
+    def test_read_query_counts_are_constant(self):
+        spec = Specification(name='config', version='v1')
+        spec.generate_id()
+        spec.save()
+        resource = Resource(url='config/v1/first', specification=spec)
+        resource.generate_id()
+        resource.save()
+        
+        for count in (2, 20):
+            self._create_elements(resource, count)
+            other = Resource(url='config/v1/%d' % count, specification=spec)
+            other.generate_id()
+            other.save()
+            # The rows above bypass the views, so nothing invalidated the
+            # responses cached during the previous round.
+            response_cache.clear()
+            
+            with self.assertNumQueries(2):
+                self.client.get('/specifications/%s/elements' % resource.id)
+            with self.assertNumQueries(2):
+                self.client.get('/specifications/config/v1/resources')
+            with self.assertNumQueries(1):
+                self.client.get('/specifications/resource/%s' % resource.id)
+
+
+class ElementTreeTest(SpecificationTestCase):
+    def setUp(self):
+        super(ElementTreeTest, self).setUp()
+        self.resource_id = _load_tree(self.client)
+        self.url = '/specifications/%s/elements' % self.resource_id
+    
+    def test_tree(self):
+        response, tree = _get_json(self.client, self.url, {'shape': 'tree'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(node['name'] for node in tree), ['a', 'd'])
+        a = [node for node in tree if node['name'] == 'a'][0]
+        self.assertEqual(a['children'][0]['name'], 'b')
+        self.assertEqual(a['children'][0]['children'][0]['name'], 'c')
+    
+    def test_tree_depth_and_root(self):
+        response, tree = _get_json(self.client, self.url, {'shape': 'tree'})
+        a = [node for node in tree if node['name'] == 'a'][0]
+        
+        response, tree = _get_json(self.client, self.url,
+                                   {'shape': 'tree', 'root': a['id'],
+                                    'depth': '2'})
+        self.assertEqual(len(tree), 1)
+        self.assertEqual(tree[0]['children'][0]['name'], 'b')
+        self.assertFalse('children' in tree[0]['children'][0])
+    
+    def test_tree_invalid_parameters(self):
+        for parameters in ({'shape': 'graph'},
+                           {'shape': 'tree', 'depth': '0'},
+                           {'shape': 'tree', 'root': 'missing'}):
+            response = self.client.get(self.url, parameters)
+            self.assertEqual(response.status_code, 400)
+
+
+class ConditionalGetTest(SpecificationTestCase):
+    def setUp(self):
+        super(ConditionalGetTest, self).setUp()
+        self.resource_id = _load_tree(self.client)
+    
+    def _assert_revalidates(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        return etag
+    
+    def test_read_views_revalidate(self):
+        for url in ['/specifications',
+                    '/specifications/config/v1/resources',
+                    '/specifications/resource/%s' % self.resource_id,
+                    '/specifications/%s/elements' % self.resource_id]:
+            self._assert_revalidates(url)
+    
+    def test_element_write_changes_etag(self):
+        url = '/specifications/%s/elements' % self.resource_id
+        etag = self._assert_revalidates(url)
+        
+        with self.assertNumQueries(1):
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        
+        _post_json(self.client, '/specifications/element',
+                   {'resourceId': self.resource_id,
+                    'name': 'e', 'type': 'string'})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+    
+    def test_resource_write_changes_etag(self):
+        url = '/specifications/config/v1/resources'
+        etag = self._assert_revalidates(url)
+        
+        _post_json(self.client, '/specifications/resource',
+                   {'specName': 'config', 'specVersion': 'v1',
+                    'url': 'config/v1/second'})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        
+        etag = response['ETag']
+        _post_json(self.client, '/specifications/resource',
+                   {'specName': 'config', 'specVersion': 'v1',
+                    'url': 'config/v1/second'})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+    
+    def test_recreated_rows_change_etag(self):
+        def create(url, element_name):
+            response, resource = _post_json(self.client,
+                                            '/specifications/resource',
+                                            {'specName': 'other',
+                                             'specVersion': 'v1',
+                                             'url': url})
+            _post_json(self.client, '/specifications/element',
+                       {'resourceId': resource['id'],
+                        'name': element_name, 'type': 'string'})
+            return resource['id']
+        
+        _post_json(self.client, '/specifications/specification',
+                   {'name': 'other', 'version': 'v1'})
+        resource_id = create('other/v1/first', 'old')
+        url = '/specifications/%s/elements' % resource_id
+        etag = self._assert_revalidates(url)
+        
+        # The same url gets the same id back, with as many writes
+        self.client.delete('/specifications/resource/%s' % resource_id)
+        self.assertEqual(create('other/v1/first', 'new'), resource_id)
+        response, elements = _get_json(self.client, url,
+                                       HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual([element['name'] for element in elements.values()],
+                         ['new'])
+        
+        resources_url = '/specifications/other/v1/resources'
+        etag = self._assert_revalidates(resources_url)
+        spec = Specification.objects.get(name='other')
+        self.client.delete('/specifications/specification/%s' % spec.id)
+        _post_json(self.client, '/specifications/specification',
+                   {'name': 'other', 'version': 'v1'})
+        create('other/v1/second', 'new')
+        response, resources = _get_json(self.client, resources_url,
+                                        HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([resource['url'] for resource in resources],
+                         ['other/v1/second'])
+    
+    def test_index_etag(self):
+        etag = self._assert_revalidates('/specifications')
+        with self.assertNumQueries(1):
+            self.client.get('/specifications', HTTP_IF_NONE_MATCH=etag)
+        
+        # Replacing a specification keeps their number
+        spec = Specification.objects.get()
+        self.client.delete('/specifications/specification/%s' % spec.id)
+        _post_json(self.client, '/specifications/specification',
+                   {'name': 'other', 'version': 'v1'})
+        response, data = _get_json(self.client, '/specifications',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data, [{'name': 'other', 'versions': ['v1']}])
+    
+    def test_query_string_changes_etag(self):
+        url = '/specifications/%s/elements' % self.resource_id
+        flat = self.client.get(url)
+        tree = self.client.get(url, {'shape': 'tree'})
+        self.assertNotEqual(flat['ETag'], tree['ETag'])
+
+
+class ResponseCacheTest(SpecificationTestCase):
+    def test_lru_eviction(self):
+        cache = ResponseCache(2)
+        cache.set('a', ['x'], '1')
+        cache.set('b', ['x'], '2')
+        cache.get('a')
+        cache.set('c', ['y'], '3')
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), '1')
+        self.assertEqual(cache.get_stats()['evictions'], 1)
+    
+    def test_invalidate_by_owner(self):
+        cache = ResponseCache(10)
+        cache.set('a', ['x'], '1')
+        cache.set('b', ['x', 'y'], '2')
+        cache.set('c', ['z'], '3')
+        cache.invalidate('y')
+        self.assertEqual(cache.get('a'), '1')
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('c'), '3')
+    
+    def test_views_use_cache(self):
+        resource_id = _load_tree(self.client)
+        url = '/specifications/%s/elements' % resource_id
+        first = self.client.get(url)
+        second = self.client.get(url)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(response_cache.get_stats()['entries'], 1)
+        
+        _post_json(self.client, '/specifications/element',
+                   {'resourceId': resource_id, 'name': 'e', 'type': 'string'})
+        self.assertEqual(response_cache.get_stats()['entries'], 0)
+        response, data = _get_json(self.client, url)
+        self.assertTrue('e' in [element['name'] for element in data.values()])
+
+
+class PaginationTest(SpecificationTestCase):
+    def setUp(self):
+        super(PaginationTest, self).setUp()
+        self.resource_id = _load_tree(self.client)
+    
+    def test_elements_pages(self):
+        url = '/specifications/%s/elements' % self.resource_id
+        response, everything = _get_json(self.client, url)
+        
+        collected = {}
+        parameters = {'limit': '3'}
+        while True:
+            response, page = _get_json(self.client, url, parameters)
+            self.assertTrue(len(page['elements']) <= 3)
+            collected.update(page['elements'])
+            if not page['next']:
+                break
+            parameters['after'] = page['next']
+        
+        self.assertEqual(collected, everything)
+    
+    def test_resources_pages(self):
+        _post_json(self.client, '/specifications/resource',
+                   {'specName': 'config', 'specVersion': 'v1',
+                    'url': 'config/v1/second'})
+        url = '/specifications/config/v1/resources'
+        response, first = _get_json(self.client, url, {'limit': '1'})
+        response, second = _get_json(self.client, url,
+                                     {'limit': '1', 'after': first['next']})
+        self.assertEqual(second['next'], None)
+        urls = [resource['url'] 
+                for resource in first['resources'] + second['resources']]
+        self.assertEqual(sorted(urls), ['config/v1/first', 'config/v1/second'])
+    
+    def test_tree_cannot_be_paginated(self):
+        url = '/specifications/%s/elements' % self.resource_id
+        response = self.client.get(url, {'shape': 'tree', 'limit': '2'})
+        self.assertEqual(response.status_code, 400)
+
+
+class StreamingTest(SpecificationTestCase):
+    def setUp(self):
+        super(StreamingTest, self).setUp()
+        self.resource_id = _load_tree(self.client)
+        _post_json(self.client, '/specifications/resource',
+                   {'specName': 'config', 'specVersion': 'v1',
+                    'url': 'config/v1/second'})
+        _post_json(self.client, '/specifications/specification',
+                   {'name': 'config', 'version': 'v2'})
+        # Small chunks make the listings above span several of them
+        self.chunk_size = views.STREAM_CHUNK_SIZE
+        views.STREAM_CHUNK_SIZE = 2
+    
+    def tearDown(self):
+        views.STREAM_CHUNK_SIZE = self.chunk_size
+    
+    def test_streamed_listings_match(self):
+        for url in ['/specifications',
+                    '/specifications/config/v1/resources',
+                    '/specifications/%s/elements' % self.resource_id]:
+            response, expected = _get_json(self.client, url)
+            response, streamed = _get_json(self.client, url,
+                                           {'stream': 'true'})
+            self.assertEqual(response.status_code, 200)
+            if isinstance(expected, list):
+                key = lambda properties: sorted(properties.items())
+                expected.sort(key=key)
+                streamed.sort(key=key)
+            self.assertEqual(streamed, expected)
+    
+    def test_stream_rejects_paging(self):
+        for url in ['/specifications/%s/elements' % self.resource_id,
+                    '/specifications/config/v1/resources']:
+            response = self.client.get(url, {'stream': 'true', 'limit': '2'},
+                                       HTTP_IF_NONE_MATCH='*')
+            self.assertEqual(response.status_code, 400)
+    
+    def test_index_stream_groups_versions(self):
+        for index in xrange(3):
+            for version in ('v1', 'v2'):
+                _post_json(self.client, '/specifications/specification',
+                           {'name': 'spec%d' % index, 'version': version})
+        response, streamed = _get_json(self.client, '/specifications',
+                                       {'stream': 'true'})
+        self.assertEqual([(spec['name'], spec['versions'])
+                          for spec in streamed],
+                         [('config', ['v1', 'v2'])] +
+                         [('spec%d' % index, ['v1', 'v2'])
+                          for index in xrange(3)])
+
+class ValidationTest(SpecificationTestCase):
+    def setUp(self):
+        super(ValidationTest, self).setUp()
+        self.resource_id = _load_tree(self.client)
+        self.url = '/specifications/%s/validate' % self.resource_id
+    
+    def test_valid_payload(self):
+        response, data = _post_json(self.client, self.url,
+                                    {'a': {'b': {'c': 'text'}}, 'd': 1.5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data, {'valid': True, 'violations': []})
+    
+    def test_reports_all_violations(self):
+        response, data = _post_json(self.client, self.url,
+                                    {'a': {'b': {'c': 1}}, 'd': True})
+        self.assertFalse(data['valid'])
+        self.assertEqual(sorted(violation['path'] 
+                                for violation in data['violations']),
+                         ['$.a.b.c', '$.d'])
+        
+        response, data = _post_json(self.client, self.url, {'a': {}})
+        self.assertEqual([violation['path'] 
+                          for violation in data['violations']], ['$.a.b'])
+    
+    def test_compiled_once_per_revision(self):
+        _post_json(self.client, self.url, {})
+        with self.assertNumQueries(1):
+            _post_json(self.client, self.url, {})
+        
+        _post_json(self.client, '/specifications/element',
+                   {'resourceId': self.resource_id,
+                    'name': 'e', 'type': 'string'})
+        response, data = _post_json(self.client, self.url,
+                                    {'a': {'b': {'c': 'text'}}})
+        self.assertEqual([violation['path'] 
+                          for violation in data['violations']], ['$.e'])
+
+
+class BatchValidationTest(SpecificationTestCase):
+    def setUp(self):
+        super(BatchValidationTest, self).setUp()
+        self.resource_id = _load_tree(self.client)
+        valid = {'a': {'b': {'c': 'text'}}}
+        invalid = {'a': {'b': {'c': 1}}}
+        self.lines = [json.dumps({'resourceId': self.resource_id,
+                                  'payload': payload})
+                      for payload in [valid, invalid, valid]]
+        self.lines += ['', 'not json',
+                       json.dumps({'resourceId': 'missing', 'payload': {}})]
+    
+    def _assert_results(self, results):
+        stats = results.pop()['stats']
+        self.assertEqual((stats['payloads'], stats['valid'], stats['invalid'],
+                          stats['errors']), (3, 2, 1, 2))
+        verdicts = dict((result['line'], result.get('valid'))
+                        for result in results)
+        self.assertEqual(verdicts, {1: True, 2: False, 3: True,
+                                    5: None, 6: None})
+    
+    def test_in_process(self):
+        batch_validator = BatchValidator(processes=1, chunk_size=2)
+        self._assert_results(list(batch_validator.validate(self.lines)))
+    
+    def test_process_pool(self):
+        batch_validator = BatchValidator(processes=2, chunk_size=2)
+        self._assert_results(list(batch_validator.validate(self.lines)))
+    
+    def test_endpoint(self):
+        def fail(*args, **kwargs):
+            self.fail("The endpoint must not fork a pool")
+        old_pool = validation.Pool
+        validation.Pool = fail
+        try:
+            response = self.client.post('/specifications/validate',
+                                        '\n'.join(self.lines),
+                                        content_type='application/x-ndjson')
+            # The results are produced while the response is read
+            content = response.content
+        finally:
+            validation.Pool = old_pool
+        self.assertEqual(response.status_code, 200)
+        self._assert_results([json.loads(line) 
+                              for line in content.splitlines()])
+    
+    def test_command(self):
+        input = tempfile.NamedTemporaryFile()
+        input.write('\n'.join(self.lines))
+        input.flush()
+        output = StringIO()
+        call_command('validate_payloads', input.name, processes=1,
+                     stdout=output)
+        self._assert_results([json.loads(line)
+                              for line in output.getvalue().splitlines()])
+
+
+class DiffTest(SpecificationTestCase):
+    def _load(self, version, c_type, last_element, last_url='only'):
+        document = {
+                    'name': 'config',
+                    'version': version,
+                    'resources': [
+                        {
+                         'url': 'config/%s/first' % version,
+                         'elements': [
+                            {
+                             'name': 'a',
+                             'type': 'object',
+                             'elements': [
+                                {
+                                 'name': 'b',
+                                 'type': 'object',
+                                 'elements': [{'name': 'c', 'type': c_type}]
+                                }
+                             ]
+                            },
+                            {'name': last_element, 'type': 'number'}
+                         ]
+                        },
+                        {
+                         'url': 'config/%s/same' % version,
+                         'elements': [{'name': 'x', 'type': 'string'}]
+                        },
+                        {'url': 'config/%s/%s' % (version, last_url)}
+                    ]
+                   }
+        _post_json(self.client, '/specifications/bulk', document)
+    
+    def test_diff(self):
+        self._load('v1', 'string', 'd', 'old')
+        self._load('v2', 'number', 'e', 'new')
+        response, data = _get_json(self.client,
+                                   '/specifications/config/v1/diff/v2')
+        self.assertEqual(response.status_code, 200)
+        
+        resources = data['resources']
+        self.assertEqual([resource['url'] for resource in resources['added']],
+                         ['config/v2/new'])
+        self.assertEqual([resource['url'] 
+                          for resource in resources['removed']],
+                         ['config/v1/old'])
+        self.assertEqual(len(resources['changed']), 1)
+        
+        elements = resources['changed'][0]['elements']
+        self.assertEqual([element['path'] for element in elements['added']],
+                         ['$.e'])
+        self.assertEqual([element['path'] for element in elements['removed']],
+                         ['$.d'])
+        self.assertEqual([(element['path'], element['from']['type'], 
+                           element['to']['type'])
+                          for element in elements['changed']],
+                         [('$.a.b.c', 'string', 'number')])
+    
+    def test_single_posts_keep_hashes_current(self):
+        self._load('v1', 'string', 'd')
+        self._load('v2', 'string', 'd')
+        response, data = _get_json(self.client,
+                                   '/specifications/config/v1/diff/v2')
+        self.assertEqual(data['resources']['changed'], [])
+        
+        resource = Resource.objects.get(url='config/v2/same')
+        _post_json(self.client, '/specifications/element',
+                   {'resourceId': resource.id, 'name': 'x', 'type': 'number'})
+        response, data = _get_json(self.client,
+                                   '/specifications/config/v1/diff/v2')
+        changed = data['resources']['changed']
+        self.assertEqual([resource['url'] for resource in changed],
+                         ['config/v2/same'])
+        self.assertEqual(changed[0]['elements']['changed'][0]['path'], '$.x')
+    
+    def test_single_writes_only_rehash_ancestors(self):
+        self._load('v1', 'string', 'd')
+        resource = Resource.objects.get(url='config/v1/first')
+        b = Element.objects.get(resource=resource, name='b')
+        # Reading b and its children, then updating it, for b, a and the
+        # tree hash, whatever the size of the tree
+        response, (element_id, element) = _post_json(
+                                        self.client, '/specifications/element',
+                                        {'resourceId': resource.id,
+                                         'parentId': b.id, 'name': 'new',
+                                         'type': 'string'})
+        self.client.delete('/specifications/element/%s' % b.id)
+        
+        def get_hashes():
+            return (sorted(Element.objects.filter(resource=resource)
+                                          .values_list('id', 'subtree_hash')),
+                    Resource.objects.get(id=resource.id).tree_hash)
+        hashes = get_hashes()
+        update_hashes(resource.id)
+        self.assertEqual(get_hashes(), hashes)
+
+
+class CloneTest(SpecificationTestCase):
+    def setUp(self):
+        super(CloneTest, self).setUp()
+        self.resource_id = _load_tree(self.client)
+    
+    def test_clone(self):
+        response, data = _post_json(self.client, '/specifications/clone',
+                                    {'name': 'config', 'version': 'v1',
+                                     'newVersion': 'v2'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['elementCount'], 4)
+        
+        response, resources = _get_json(self.client,
+                                        '/specifications/config/v2/resources')
+        self.assertEqual([resource['url'] for resource in resources],
+                         ['config/v2/first'])
+        
+        # The clone matches what posting the same tree to v2 would create
+        new_resource_id = resources[0]['id']
+        response, elements = _get_json(self.client,
+                                       '/specifications/%s/elements'
+                                       % new_resource_id)
+        a = Element(name='a', resource_id=new_resource_id)
+        a.generate_id()
+        b = Element(name='b', resource_id=new_resource_id, parent_id=a.id)
+        b.generate_id()
+        self.assertEqual(elements[b.id]['parent'], a.id)
+        
+        response, data = _get_json(self.client,
+                                   '/specifications/config/v1/diff/v2')
+        self.assertEqual(data['resources']['changed'], [])
+    
+    def test_clone_requires_new_version(self):
+        for clone_data in [{'name': 'config', 'version': 'v1',
+                            'newVersion': 'v1'},
+                           {'name': 'config', 'version': 'v9',
+                            'newVersion': 'v10'},
+                           {'name': 'config', 'version': 'v1',
+                            'newVersion': 5}]:
+            response, data = _post_json(self.client, '/specifications/clone',
+                                        clone_data)
+            self.assertEqual(response.status_code, 400)
+    
+    def test_clone_conflicts(self):
+        # The version created by a concurrent request under another id
+        Specification.objects.create(id='other', name='config', version='v2')
+        response, data = _post_json(self.client, '/specifications/clone',
+                                    {'name': 'config', 'version': 'v1',
+                                     'newVersion': 'v2'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(data['error']['message'],
+                         "Specification 'config (v2)' already exists")
+        self.assertEqual(Resource.objects.count(), 1)
+        
+        # Two urls that differ only in their version
+        response, data = _post_json(self.client, '/specifications/bulk',
+                                    {'name': 'config', 'version': 'v1',
+                                     'resources': [{'url': 'config/v3/first',
+                                                    'elements': []}]})
+        response, data = _post_json(self.client, '/specifications/clone',
+                                    {'name': 'config', 'version': 'v1',
+                                     'newVersion': 'v3'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Specification.objects.filter(version='v3').exists())
+
+
+class DeleteTest(SpecificationTestCase):
+    def setUp(self):
+        super(DeleteTest, self).setUp()
+        self.resource_id = _load_tree(self.client)
+    
+    def _delete(self, url):
+        response = self.client.delete(url)
+        return response, json.loads(response.content)
+    
+    def test_delete_element_subtree(self):
+        a = Element.objects.get(name='a')
+        response, data = self._delete('/specifications/element/%s' % a.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['deleted']['elements'], 3)
+        self.assertEqual([element.name for element in Element.objects.all()],
+                         ['d'])
+        
+        response, data = _post_json(self.client, '/specifications/%s/validate'
+                                    % self.resource_id, {})
+        self.assertTrue(data['valid'])
+    
+    def test_delete_resource(self):
+        url = '/specifications/config/v1/resources'
+        etag = self.client.get(url)['ETag']
+        response, data = self._delete('/specifications/resource/%s'
+                                      % self.resource_id)
+        self.assertEqual(data['deleted'], {'specifications': 0,
+                                           'resources': 1, 'elements': 4})
+        self.assertEqual(Element.objects.count(), 0)
+        response, resources = _get_json(self.client, url,
+                                        HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resources, [])
+    
+    def test_delete_specification(self):
+        spec = Specification.objects.get()
+        self.client.get('/specifications')
+        response, data = self._delete('/specifications/specification/%s'
+                                      % spec.id)
+        self.assertEqual(data['deleted'], {'specifications': 1,
+                                           'resources': 1, 'elements': 4})
+        self.assertEqual(Resource.objects.count(), 0)
+        response, specs = _get_json(self.client, '/specifications')
+        self.assertEqual(specs, [])
+    
+    def test_delete_missing(self):
+        for url in ['/specifications/specification/missing',
+                    '/specifications/resource/missing',
+                    '/specifications/element/missing']:
+            response = self.client.delete(url)
+            self.assertEqual(response.status_code, 400)
+
+
+class RouteIndexTest(SpecificationTestCase):
+    def setUp(self):
+        super(RouteIndexTest, self).setUp()
+        _post_json(self.client, '/specifications/bulk',
+                   {'name': 'config', 'version': 'v1',
+                    'resources': [{'url': 'config/v1/users/{id}'},
+                                  {'url': 'config/v1/users/me'}]})
+    
+    def _resolve(self, path):
+        return _get_json(self.client, '/specifications/routes',
+                         {'path': path})
+    
+    def test_templates_and_literals(self):
+        response, data = self._resolve('config/v1/users/42')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(match['url'], match['params'])
+                          for match in data['matches']],
+                         [('config/v1/users/{id}', {'id': '42'})])
+        
+        response, data = self._resolve('/config/v1/users/me')
+        self.assertEqual([match['url'] for match in data['matches']],
+                         ['config/v1/users/me'])
+        
+        response, data = self._resolve('config/v1/users')
+        self.assertEqual(response.status_code, 400)
+    
+    def test_follows_writes(self):
+        route_index.load()
+        _post_json(self.client, '/specifications/resource',
+                   {'specName': 'config', 'specVersion': 'v1',
+                    'url': 'config/v1/users/{id}/groups/{group}'})
+        with self.assertNumQueries(0):
+            matches = route_index.resolve('config/v1/users/7/groups/admins')
+        self.assertEqual(matches[0][2], {'id': '7', 'group': 'admins'})
+        
+        self.client.delete('/specifications/resource/%s' % matches[0][0])
+        self.assertEqual(route_index.resolve('config/v1/users/7/groups/a'), [])
+        # The nodes of the deleted url are pruned
+        users = route_index.root.literals['config'].literals['v1'] \
+                                .literals['users']
+        self.assertEqual(users.template.literals, {})
+    
+    def test_applies_writes_after_commit(self):
+        route_index.load()
+        @route_index.deferred
+        def create(url, fail):
+            route_index.add(url, 'new')
+            # Not visible until the transaction has committed
+            self.assertEqual(route_index.resolve(url), [])
+            if fail:
+                raise ValueError(url)
+        
+        self.assertRaises(ValueError, create, 'config/v1/groups', True)
+        self.assertEqual(route_index.resolve('config/v1/groups'), [])
+        create('config/v1/groups', False)
+        self.assertEqual(route_index.resolve('config/v1/groups'),
+                         [('new', 'config/v1/groups', {})])
+
+
+
+
+class BatchElementsTest(SpecificationTestCase):
+    def setUp(self):
+        super(BatchElementsTest, self).setUp()
+        self.resource_id = _load_tree(self.client)
+        response, data = _post_json(self.client, '/specifications/resource',
+                                    {'specName': 'config',
+                                     'specVersion': 'v1',
+                                     'url': 'config/v1/second'})
+        self.other_id = data['id']
+        self.missing_id = '0' * 32
+    
+    def _get(self, ids, **extra):
+        return _get_json(self.client, '/specifications/elements',
+                         {'ids': ','.join(ids)}, **extra)
+    
+    def test_ids(self):
+        with self.assertNumQueries(2):
+            response, data = self._get([self.resource_id, self.other_id,
+                                        self.missing_id, self.resource_id])
+        self.assertEqual(response.status_code, 200)
+        resources = data['resources']
+        self.assertEqual(sorted(resources), sorted([self.resource_id,
+                                                    self.other_id,
+                                                    self.missing_id]))
+        response, elements = _get_json(self.client,
+                                       '/specifications/%s/elements'
+                                       % self.resource_id)
+        self.assertEqual(resources[self.resource_id]['elements'], elements)
+        self.assertEqual(resources[self.resource_id]['resource']['url'],
+                         'config/v1/first')
+        self.assertEqual(resources[self.other_id]['elements'], {})
+        self.assertTrue('error' in resources[self.missing_id])
+        
+        response, data = _post_json(self.client,
+                                    '/specifications/elements?fields=name',
+                                    {'resourceIds': [self.resource_id]})
+        self.assertFalse(response.has_header('ETag'))
+        self.assertEqual(sorted(element['name'] for element
+                                in data['resources'][self.resource_id]
+                                       ['elements'].values()),
+                         ['a', 'b', 'c', 'd'])
+    
+    def test_non_ascii_ids(self):
+        missing_id = u'\xe9'
+        response, data = self._get([self.resource_id, missing_id])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue('error' in data['resources'][missing_id])
+        
+        response, data = _post_json(self.client, '/specifications/elements',
+                                    {'resourceIds': [missing_id]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(data['resources']), [missing_id])
+    
+    def test_specification(self):
+        response_cache.clear()
+        with self.assertNumQueries(3):
+            response, data = _get_json(self.client, '/specifications/elements',
+                                       {'specName': 'config',
+                                        'specVersion': 'v1'})
+        self.assertEqual(sorted(data['resources']),
+                         sorted([self.resource_id, self.other_id]))
+        self.assertEqual(len(data['resources'][self.resource_id]['elements']),
+                         4)
+        
+        response, data = _post_json(self.client, '/specifications/elements',
+                                    {'specName': 'config',
+                                     'specVersion': 'v2'})
+        self.assertEqual(response.status_code, 400)
+    
+    def test_revalidation(self):
+        ids = [self.resource_id, self.missing_id]
+        response, data = self._get(ids)
+        etag = response['ETag']
+        response = self.client.get('/specifications/elements',
+                                   {'ids': ','.join(ids)},
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        
+        _post_json(self.client, '/specifications/element',
+                   {'resourceId': self.resource_id, 'name': 'e',
+                    'type': 'string'})
+        response, data = self._get(ids, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(data['resources'][self.resource_id]['elements']),
+                         5)
+    
+    def test_invalid_requests(self):
+        response, data = _get_json(self.client, '/specifications/elements')
+        self.assertEqual(response.status_code, 400)
+        for post_data in [{}, {'resourceIds': self.resource_id},
+                          {'resourceIds': [1, 2]}]:
+            response, data = _post_json(self.client,
+                                        '/specifications/elements', post_data)
+            self.assertEqual(response.status_code, 400)
+
+class SearchTest(SpecificationTestCase):
+    def setUp(self):
+        super(SearchTest, self).setUp()
+        for name in ('config', 'other'):
+            _post_json(self.client, '/specifications/bulk',
+                       {'name': name, 'version': 'v1',
+                        'resources': [
+                            {'url': '%s/v1/timeout' % name},
+                            {
+                             'url': '%s/v1/connections/{id}' % name,
+                             'elements': [
+                                {
+                                 'name': 'connection',
+                                 'type': 'object',
+                                 'elements': [
+                                    {'name': 'timeout', 'type': 'integer'},
+                                    {'name': 'connectTimeout',
+                                     'type': 'integer'}
+                                 ]
+                                }
+                             ]
+                            }
+                        ]})
+    
+    def _search(self, **parameters):
+        return _get_json(self.client, '/specifications/search', parameters)
+    
+    def test_words(self):
+        self.assertEqual(get_words('connectTimeout'),
+                         set(['connecttimeout', 'connect', 'timeout']))
+        self.assertEqual(get_words('config/v1/users/{id}'),
+                         set(['config', 'v1', 'users', 'id']))
+        self.assertEqual(get_words('HTTPProxy_port'),
+                         set(['httpproxy', 'http', 'proxy', 'port']))
+    
+    def test_ranking_and_filters(self):
+        response, data = self._search(q='Timeout', specName='config')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['total'], 3)
+        self.assertEqual([(result['kind'], result.get('path'), result['url'])
+                          for result in data['results']],
+                         [('element', '$.connection.timeout',
+                           'config/v1/connections/{id}'),
+                          ('element', '$.connection.connectTimeout',
+                           'config/v1/connections/{id}'),
+                          ('resource', None, 'config/v1/timeout')])
+        self.assertEqual(data['results'][0]['type'], 'integer')
+        self.assertEqual(data['next'], None)
+        
+        response, data = self._search(q='timeout')
+        self.assertEqual(data['total'], 6)
+        response, data = self._search(q='integer connect*',
+                                      specVersion='v1')
+        self.assertEqual(sorted(result['specName']
+                                for result in data['results']),
+                         ['config', 'other'])
+        response, data = self._search(q='timeout', specVersion='v2')
+        self.assertEqual(data['total'], 0)
+    
+    def test_pages(self):
+        names = []
+        offset = 0
+        while offset is not None:
+            response, data = self._search(q='timeout', limit='4',
+                                          offset=str(offset))
+            names.extend(result['id'] for result in data['results'])
+            offset = data['next']
+        response, data = self._search(q='timeout')
+        self.assertEqual(names, [result['id'] for result in data['results']])
+        
+        for parameters in [{}, {'q': '!?'}, {'q': 'a', 'offset': '-1'},
+                           {'q': 'a', 'after': '4'},
+                           {'q': 'a', 'limit': '0'}]:
+            response, data = self._search(**parameters)
+            self.assertEqual(response.status_code, 400)
+    
+    def test_follows_writes(self):
+        search_index.load()
+        resource_id = Resource.objects.get(url='config/v1/connections/{id}').id
+        response, (element_id, element) = _post_json(
+                                        self.client, '/specifications/element',
+                                        {'resourceId': resource_id,
+                                         'name': 'readTimeout',
+                                         'type': 'integer'})
+        response, data = self._search(q='read')
+        self.assertEqual([result['id'] for result in data['results']],
+                         [element_id])
+        
+        parent_id = Element.objects.get(resource__id=resource_id,
+                                        name='connection').id
+        self.client.delete('/specifications/element/%s' % parent_id)
+        response, data = self._search(q='timeout', specName='config')
+        self.assertEqual([result.get('name', result['url'])
+                          for result in data['results']],
+                         ['readTimeout', 'config/v1/timeout'])
+        
+        other = Specification.objects.get(name='other')
+        self.client.delete('/specifications/specification/%s' % other.id)
+        with self.assertNumQueries(1):
+            response, data = self._search(q='timeout')
+        self.assertEqual(data['total'], 2)
+
+class MockTest(SpecificationTestCase):
+    def setUp(self):
+        super(MockTest, self).setUp()
+        _load_tree(self.client)
+    
+    def test_example_payload(self):
+        response, data = _get_json(self.client, '/mock/config/v1/first')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data, {'a': {'b': {'c': 'string'}}, 'd': 0})
+        
+        response, data = _get_json(self.client, '/mock/config/v1/first',
+                                   {'optional': 'false'})
+        self.assertEqual(data, {'a': {'b': {'c': 'string'}}})
+        
+        response = self.client.get('/mock/config/v1/missing')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(json.loads(response.content)['error']['message'],
+                         "No resource matches path 'config/v1/missing'")
+    
+    def test_prefers_literals(self):
+        _post_json(self.client, '/specifications/bulk',
+                   {'name': 'config', 'version': 'v1',
+                    'resources': [{'url': 'config/v1/{kind}/{id}',
+                                   'elements': [{'name': 'kind',
+                                                 'type': 'string'}]},
+                                  {'url': 'config/v1/{zone}/{name}',
+                                   'elements': [{'name': 'zone',
+                                                 'type': 'string'}]},
+                                  {'url': 'config/v1/users/{id}',
+                                   'elements': [{'name': 'user',
+                                                 'type': 'string'}]}]})
+        response, data = _get_json(self.client, '/mock/config/v1/users/7')
+        self.assertEqual(data, {'user': 'string'})
+        # Templates alone match in the order of their url
+        for _ in range(3):
+            route_index.clear()
+            response, data = _get_json(self.client,
+                                       '/mock/config/v1/groups/7')
+            self.assertEqual(data, {'kind': 'string'})
+    
+    def test_arrays_and_revisions(self):
+        response, data = _post_json(self.client, '/specifications/bulk',
+            {'name': 'config', 'version': 'v1',
+             'resources': [{'url': 'config/v1/items/{id}',
+                            'elements': [{'name': 'items', 'type': 'array',
+                                          'elements': [{'name': 'n',
+                                                        'type': 'integer'}]},
+                                         {'name': 'tags', 'type': 'array'}]}]})
+        resource_id = data['resources'][0]['id']
+        
+        response, data = _get_json(self.client, '/mock/config/v1/items/3')
+        self.assertEqual(data, {'items': [{'n': 0}], 'tags': []})
+        with self.assertNumQueries(1):
+            self.client.post('/mock/config/v1/items/4')
+        
+        _post_json(self.client, '/specifications/element',
+                   {'resourceId': resource_id, 'name': 'ok',
+                    'type': 'boolean'})
+        response, data = _get_json(self.client, '/mock/config/v1/items/3')
+        self.assertEqual(data['ok'], True)
+
+
+class SerializationTest(SpecificationTestCase):
+    def setUp(self):
+        super(SerializationTest, self).setUp()
+        self.resource_id = _load_tree(self.client)
+    
+    def test_json_is_the_default(self):
+        response = self.client.get('/specifications/config/v1/resources',
+                                   HTTP_ACCEPT='text/html, */*')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response['Vary'], 'Accept, Accept-Encoding')
+        self.assertEqual(len(json.loads(response.content)), 1)
+        
+        response = self.client.post('/specifications/specification', '[]',
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content)['error']['message'],
+                         "Root of JSON must be an type object")
+    
+    def test_json_round_trip(self):
+        value = {'url': 'config/v1/users/{id}',
+                 'numbers': [0.1 + 0.2, 1 / 3.0, 123456789.123, 1e300, 2 ** 53]}
+        content = json_codec.dumps(value)
+        self.assertEqual(content, json.dumps(value))
+        self.assertEqual(json_codec.loads(content), value)
+        
+        response = self.client.get('/specifications/config/v1/resources')
+        self.assertTrue('"config/v1/first"' in response.content)
+    
+    @unittest.skipIf(msgpack is None, "msgpack is not installed")
+    def test_msgpack_negotiation(self):
+        url = '/specifications/%s/elements' % self.resource_id
+        json_response = self.client.get(url)
+        response = self.client.get(url, HTTP_ACCEPT='application/x-msgpack')
+        self.assertEqual(response['Content-Type'], 'application/x-msgpack')
+        self.assertNotEqual(response['ETag'], json_response['ETag'])
+        self.assertEqual(msgpack.unpackb(response.content, raw=False),
+                         json.loads(json_response.content))
+        
+        # Cached JSON is not served to MessagePack clients, or vice versa
+        response = self.client.get(url)
+        self.assertEqual(response.content, json_response.content)
+        
+        response = self.client.get(url,
+                                   HTTP_ACCEPT='application/x-msgpack;q=0')
+        self.assertEqual(response['Content-Type'], 'application/json')
+    
+    @unittest.skipIf(msgpack is None, "msgpack is not installed")
+    def test_msgpack_post_data(self):
+        body = msgpack.packb({'name': 'config', 'version': 'v2'},
+                             use_bin_type=True)
+        response = self.client.post('/specifications/specification', body,
+                                    content_type='application/x-msgpack',
+                                    HTTP_ACCEPT='application/x-msgpack')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(msgpack.unpackb(response.content,
+                                         raw=False)['version'], 'v2')
+        self.assertTrue(Specification.objects.filter(version='v2').exists())
+        
+        response = self.client.post('/specifications/specification', '\xc1',
+                                    content_type='application/x-msgpack')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content)['error']['message'],
+                         "Invalid MessagePack post data to create a "
+                         "specification")
+
+
+class ProjectionTest(SpecificationTestCase):
+    def setUp(self):
+        super(ProjectionTest, self).setUp()
+        self.resource_id = _load_tree(self.client)
+    
+    def test_resources(self):
+        response, data = _get_json(self.client,
+                                   '/specifications/config/v1/resources',
+                                   {'fields': 'id,url'})
+        self.assertEqual(data, [{'id': self.resource_id,
+                                 'url': 'config/v1/first'}])
+        
+        response, data = _get_json(self.client,
+                                   '/specifications/resource/%s'
+                                   % self.resource_id,
+                                   {'fields': 'elementsHref'})
+        self.assertEqual(data, {'elementsHref': '/specifications/%s/elements'
+                                                % self.resource_id})
+        
+        response, data = _get_json(self.client,
+                                   '/specifications/config/v1/resources',
+                                   {'fields': 'specName', 'stream': 'true'})
+        self.assertEqual(data, [{'specName': 'config'}])
+    
+    def test_elements(self):
+        url = '/specifications/%s/elements' % self.resource_id
+        response, everything = _get_json(self.client, url)
+        response, data = _get_json(self.client, url, {'fields': 'name,type'})
+        self.assertEqual(data, dict((id, {'name': element['name'],
+                                          'type': element['type']})
+                                    for id, element in everything.items()))
+        
+        response, streamed = _get_json(self.client, url,
+                                       {'fields': 'name,type',
+                                        'stream': 'true'})
+        self.assertEqual(streamed, data)
+        
+        response, tree = _get_json(self.client, url,
+                                   {'fields': 'name', 'shape': 'tree'})
+        self.assertEqual(sorted(node['name'] for node in tree), ['a', 'd'])
+        node = [node for node in tree if node['name'] == 'a'][0]
+        self.assertEqual(node['children'][0]['name'], 'b')
+        self.assertEqual(sorted(node['children'][0]), ['children', 'name'])
+    
+    def test_unknown_fields(self):
+        url = '/specifications/%s/elements' % self.resource_id
+        for fields in ['url', '', 'name,,bogus']:
+            response = self.client.get(url, {'fields': fields})
+            self.assertEqual(response.status_code, 400)
+
+
+class CompressionTest(SpecificationTestCase):
+    def setUp(self):
+        super(CompressionTest, self).setUp()
+        self.resource_id = _load_tree(self.client)
+        self.url = '/specifications/%s/elements' % self.resource_id
+    
+    def test_gzip_variant(self):
+        plain = self.client.get(self.url)
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['ETag'], plain['ETag'][:-1] + '-gzip"')
+        self.assertEqual(zlib.decompress(response.content,
+                                         16 + zlib.MAX_WBITS),
+                         plain.content)
+        
+        # Later requests are answered from the cached variant
+        hits = response_cache.get_stats()['hits']
+        again = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(again.content, response.content)
+        self.assertEqual(response_cache.get_stats()['hits'], hits + 1)
+        
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip',
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], again['ETag'])
+    
+    def test_identity(self):
+        response = self.client.get(self.url,
+                                   HTTP_ACCEPT_ENCODING='gzip;q=0, deflate')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        
+        # Bodies this small are not worth compressing
+        response = self.client.get('/specifications/resource/%s'
+                                   % self.resource_id,
+                                   HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(json.loads(response.content)['id'], self.resource_id)
+    
+    @unittest.skipIf(brotli is None, "brotli is not installed")
+    def test_brotli_variant(self):
+        plain = self.client.get(self.url)
+        response = self.client.get(self.url,
+                                   HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.content), plain.content)
+
+
+class ThreadPoolServerTest(TestCase):
+    def _serve(self, application, threads):
+        server = ThreadPoolWSGIServer(('127.0.0.1', 0), threads,
+                                      log_requests=False)
+        server.set_app(application)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        
+        def stop():
+            server.shutdown()
+            server.server_close()
+        self.addCleanup(stop)
+        return 'http://127.0.0.1:%d' % server.server_port
+    
+    def _get_concurrently(self, url, count):
+        responses = []
+        def get():
+            responses.append(urllib2.urlopen(url, timeout=10).read())
+        clients = [threading.Thread(target=get) for index in range(count)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        return responses
+    
+    def test_requests_overlap(self):
+        thread_names = set()
+        def application(environ, start_response):
+            thread_names.add(threading.current_thread().name)
+            time.sleep(0.2)
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return ['done']
+        
+        url = self._serve(application, 4)
+        started = time.time()
+        responses = self._get_concurrently(url, 8)
+        self.assertEqual(responses, ['done'] * 8)
+        # Eight requests on four threads take two rounds, not eight
+        self.assertTrue(time.time() - started < 1.2)
+        self.assertEqual(len(thread_names), 4)
+    
+    def test_django_application(self):
+        url = self._serve(WSGIHandler(), 2)
+        responses = self._get_concurrently(url + '/specifications/cache', 6)
+        self.assertEqual(len(responses), 6)
+        self.assertTrue('maxEntries' in json.loads(responses[0]))
+
+
+class ChangesTest(SpecificationTestCase):
+    def setUp(self):
+        super(ChangesTest, self).setUp()
+        self.resource_id = _load_tree(self.client)
+    
+    def test_sync(self):
+        response, data = _get_json(self.client, '/specifications/changes')
+        self.assertEqual([(change['kind'], change['action'])
+                          for change in data['changes']],
+                         [('specification', 'save'), ('resource', 'save')] +
+                         [('element', 'save')] * 4)
+        self.assertEqual(data['changes'][1]['specificationId'],
+                         data['changes'][0]['id'])
+        self.assertEqual(data['changes'][1]['properties']['url'],
+                         'config/v1/first')
+        self.assertFalse(data['more'])
+        
+        response, (element_id, element) = _post_json(
+                                        self.client, '/specifications/element',
+                                        {'resourceId': self.resource_id,
+                                         'name': 'e', 'type': 'string'})
+        self.client.delete('/specifications/element/%s' % element_id)
+        response, data = _get_json(self.client, '/specifications/changes',
+                                   {'since': data['next']})
+        self.assertEqual([(change['action'], change['id'],
+                           change['resourceId'])
+                          for change in data['changes']],
+                         [('save', element_id, self.resource_id),
+                          ('delete', element_id, self.resource_id)])
+        self.assertEqual(data['changes'][0]['properties'], element)
+        self.assertFalse('properties' in data['changes'][1])
+        
+        response, data = _get_json(self.client, '/specifications/changes',
+                                   {'since': data['next'], 'wait': '0.1'})
+        self.assertEqual(data['changes'], [])
+    
+    def test_clone_and_delete(self):
+        _post_json(self.client, '/specifications/clone',
+                   {'name': 'config', 'version': 'v1', 'newVersion': 'v2'})
+        new_spec = Specification.objects.get(version='v2')
+        response, data = _get_json(self.client, '/specifications/changes',
+                                   {'since': '6'})
+        self.assertEqual([change['kind'] for change in data['changes']],
+                         ['specification', 'resource'] + ['element'] * 4)
+        self.assertEqual(data['changes'][1]['properties']['specVersion'],
+                         'v2')
+        
+        self.client.delete('/specifications/specification/%s' % new_spec.id)
+        response, data = _get_json(self.client, '/specifications/changes',
+                                   {'since': data['next']})
+        self.assertEqual([(change['kind'], change['action'], change['id'])
+                          for change in data['changes']],
+                         [('specification', 'delete', new_spec.id)])
+    
+    def test_limit(self):
+        response, data = _get_json(self.client, '/specifications/changes',
+                                   {'limit': '4'})
+        self.assertEqual([change['sequence'] for change in data['changes']],
+                         [1, 2, 3, 4])
+        self.assertEqual(data['next'], 4)
+        self.assertTrue(data['more'])
+        
+        for since in ['-1', 'x']:
+            response = self.client.get('/specifications/changes',
+                                       {'since': since})
+            self.assertEqual(response.status_code, 400)
+        response = self.client.get('/specifications/changes', {'wait': 'nan'})
+        self.assertEqual(response.status_code, 400)
+    
+    def test_event_stream(self):
+        response = self.client.get('/specifications/changes', {'wait': '0'},
+                                   HTTP_ACCEPT='text/event-stream',
+                                   HTTP_LAST_EVENT_ID='5')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = response.content.strip().split('\n\n')
+        self.assertEqual(len(events), 1)
+        lines = events[0].split('\n')
+        self.assertEqual(lines[:2], ['id: 6', 'event: change'])
+        self.assertEqual(json.loads(lines[2][len('data: '):])['sequence'], 6)
+
+
+class BenchmarkTest(SpecificationTestCase):
+    def test_every_scenario_runs(self):
+        results = benchmarks.run_benchmarks({'specifications': 1,
+                                             'resources': 2,
+                                             'depth': 2,
+                                             'fanOut': 2},
+                                            iterations=2)
+        self.assertEqual(len(results['scenarios']), 31)
+        for name, result in results['scenarios'].items():
+            self.assertEqual(result['errors'], 0, name)
+            self.assertTrue(result['p50'] <= result['p99'], name)
+        self.assertEqual(results['scenarios']['elements_not_modified']
+                                ['responseBytes'], 0)
+        self.assertEqual(benchmarks.compare(results, results), [])
+    
+    def test_compare(self):
+        baseline = {'scenarios': {'elements': {'p50': 0.01, 'queries': 2,
+                                               'errors': 0,
+                                               'peakMemoryKb': 1000}}}
+        results = {'scenarios': {'elements': {'p50': 0.02, 'queries': 3,
+                                              'errors': 0,
+                                              'peakMemoryKb': 1100}}}
+        self.assertEqual(benchmarks.compare(results, baseline),
+                         ["elements: p50 20.00ms, was 10.00ms",
+                          "elements: 3 queries, was 2"])
+        self.assertEqual(len(benchmarks.compare(results, baseline,
+                                                threshold=1.0)), 1)
+
+
+class MetricsTest(SpecificationTestCase):
+    def setUp(self):
+        super(MetricsTest, self).setUp()
+        self.resource_id = _load_tree(self.client)
+    
+    def _get_sample(self, name):
+        response = self.client.get('/metrics')
+        for line in response.content.splitlines():
+            if line.startswith(name + ' '):
+                return float(line.split(' ')[-1])
+        return 0
+    
+    def test_request_metrics(self):
+        requests = ('resteasy_requests_total'
+                    '{view="elements",method="GET",status="200"}')
+        serializations = ('resteasy_serialization_duration_seconds_count'
+                          '{view="elements"}')
+        queries = 'resteasy_request_queries_bucket{view="elements",le="2"}'
+        before = [self._get_sample(name)
+                  for name in (requests, serializations, queries)]
+        
+        self.client.get('/specifications/%s/elements' % self.resource_id)
+        after = [self._get_sample(name)
+                 for name in (requests, serializations, queries)]
+        self.assertEqual([value - before[index]
+                          for index, value in enumerate(after)], [1, 1, 1])
+        
+        response = self.client.get('/metrics')
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4')
+        self.assertTrue('# TYPE resteasy_request_duration_seconds histogram'
+                        in response.content)
+        self.assertTrue('resteasy_response_cache_entries' in response.content)
+    
+    def test_queries_are_not_kept(self):
+        name = 'resteasy_request_queries_sum{view="elements"}'
+        before = self._get_sample(name)
+        connection.use_debug_cursor = None
+        del connection.queries[:]
+        self.client.get('/specifications/%s/elements' % self.resource_id)
+        self.assertEqual(self._get_sample(name) - before, 2)
+        self.assertEqual(connection.use_debug_cursor, None)
+        self.assertEqual(connection.queries, [])
+    
+    def test_invalid_requests(self):
+        name = 'resteasy_invalid_requests_total{view="elements",status="400"}'
+        before = self._get_sample(name)
+        self.client.get('/specifications/missing/elements')
+        self.client.get('/specifications/missing/elements')
+        self.assertEqual(self._get_sample(name) - before, 2)
+    
+    def test_profile(self):
+        url = '/specifications/%s/elements' % self.resource_id
+        response = self.client.get(url, {'profile': 'true'})
+        self.assertEqual(response['Content-Type'], 'application/json')
+        
+        settings.SPECIFICATIONS_PROFILING = True
+        try:
+            response = self.client.get(url, {'profile': 'true'})
+        finally:
+            settings.SPECIFICATIONS_PROFILING = False
+        self.assertEqual(response['Content-Type'], 'text/plain')
+        for line in response.content.splitlines():
+            stack, count = line.rsplit(' ', 1)
+            self.assertTrue(int(count) > 0)
+
+
+class DatabaseTest(TestCase):
+    def setUp(self):
+        self.old_read_databases = settings.SPECIFICATIONS_READ_DATABASES
+        self.old_pragmas = settings.SPECIFICATIONS_SQLITE_PRAGMAS
+    
+    def tearDown(self):
+        settings.SPECIFICATIONS_READ_DATABASES = self.old_read_databases
+        settings.SPECIFICATIONS_SQLITE_PRAGMAS = self.old_pragmas
+        db.use_primary(False)
+    
+    def test_reads_of_writing_requests_use_primary(self):
+        router = db.PrimaryReplicaRouter()
+        self.assertEqual(router.db_for_read(Element), None)
+        
+        settings.SPECIFICATIONS_READ_DATABASES = ('replica',)
+        middleware = db.DatabaseMiddleware()
+        for method, database in [('GET', 'replica'), ('POST', None),
+                                 ('DELETE', None)]:
+            request = type('Request', (object,), {'method': method})()
+            middleware.process_request(request)
+            self.assertEqual(router.db_for_read(Element), database)
+            middleware.process_response(request, None)
+            self.assertEqual(router.db_for_read(Element), 'replica')
+        
+        self.assertEqual(router.db_for_write(Element), None)
+        self.assertFalse(router.allow_syncdb('replica', Element))
+    
+    def test_sqlite_pragmas(self):
+        settings.SPECIFICATIONS_SQLITE_PRAGMAS = (('journal_mode', 'WAL'),
+                                                  ('busy_timeout', 1234))
+        database = tempfile.NamedTemporaryFile(suffix='.db')
+        connection = type('Connection', (object,),
+                          {'vendor': 'sqlite',
+                           'connection': sqlite3.connect(database.name)})()
+        db.apply_sqlite_pragmas(None, connection)
+        cursor = connection.connection.cursor()
+        self.assertEqual(cursor.execute('PRAGMA journal_mode').fetchone(),
+                         ('wal',))
+        self.assertEqual(cursor.execute('PRAGMA busy_timeout').fetchone(),
+                         (1234,))
+
+
+class TransactionTest(TransactionTestCase):
+    # Requests outside the transaction TestCase wraps every test in
+    def setUp(self):
+        response_cache.clear()
+        validator_cache.clear()
+        route_index.clear()
+        search_index.clear()
+    
+    def _reset_transaction_state(self):
+        # As in a server thread that has not run a managed transaction yet.
+        # Leaving one leaves the dirty flag set, which lets writes that
+        # need transaction management through unnoticed.
+        connection._dirty = None
+    
+    def test_writes_and_hash_backfill(self):
+        resource_id = _load_tree(self.client)
+        _post_json(self.client, '/specifications/clone',
+                   {'name': 'config', 'version': 'v1', 'newVersion': 'v2'})
+        # As if written before hashes were stored
+        Element.objects.all().update(subtree_hash='')
+        Resource.objects.all().update(tree_hash='')
+        
+        self._reset_transaction_state()
+        response, data = _get_json(self.client,
+                                   '/specifications/config/v1/diff/v2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['resources']['changed'], [])
+        self.assertFalse(Resource.objects.filter(tree_hash='').exists())
+        
+        self._reset_transaction_state()
+        response, (element_id, element) = _post_json(
+                                        self.client, '/specifications/element',
+                                        {'resourceId': resource_id,
+                                         'name': 'e', 'type': 'string'})
+        self.assertEqual(response.status_code, 200)
+        self._reset_transaction_state()
+        response = self.client.delete('/specifications/element/%s'
+                                      % element_id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Element.objects.filter(resource__id=resource_id)
+                                        .count(), 4)
+    
+    def test_creates_are_atomic(self):
+        # Fails after the change is recorded, the last step of a save. The
+        # views reply from a finally block, which raises an error of its own.
+        def fail():
+            raise RuntimeError("change log unavailable")
+        
+        notify = changes._notify
+        changes._notify = fail
+        try:
+            self._reset_transaction_state()
+            self.assertRaises(Exception, _post_json, self.client,
+                              '/specifications/specification',
+                              {'name': 'config', 'version': 'v1'})
+            self.assertFalse(Specification.objects.exists())
+            
+            Specification.objects.create(id='config', name='config',
+                                         version='v1')
+            route_index.load()
+            self._reset_transaction_state()
+            self.assertRaises(Exception, _post_json, self.client,
+                              '/specifications/resource',
+                              {'specName': 'config', 'specVersion': 'v1',
+                               'url': 'config/v1/first'})
+        finally:
+            changes._notify = notify
+        self.assertFalse(Resource.objects.exists())
+        self.assertEqual(route_index.resolve('config/v1/first'), [])
@@ -9,6 +9,17 @@ from django.conf.urls.defaults import patterns
 '''
 API
 GET:
+All GET responses carry an ETag. Sending it back in If-None-Match returns
+304 Not Modified when the specification or resource has not changed.
+Responses are JSON unless the request sends Accept: application/x-msgpack
+and msgpack is installed, in which case they are MessagePack. POST bodies
+may likewise be sent as MessagePack with that Content-Type. Streamed and
+newline delimited responses are always JSON.
+Unstreamed index, resources, resource and elements responses are gzip (or
+br, when brotli is installed) compressed for clients sending a matching
+Accept-Encoding. The compressed bodies are cached, and their ETags end with
+-gzip or -br.
+
 hostname/specifications/ 
     -> shows all the specifications and their resources under each version
         [
@@ -63,7 +74,247 @@ hostname/specifications/:resource_id/elements
             },
             ...
         }
+
+hostname/specifications/elements?ids=:resource_id,:resource_id,...
+hostname/specifications/elements?specName=config&specVersion=v1
+    -> shows many resources with their elements at once, either those
+       listed or all those of a specification, keyed by resource id. Ids
+       that do not exist get an error entry instead. Longer lists of ids
+       can be POSTed as {"resourceIds": [...]}, or the specification as
+       {"specName": "config", "specVersion": "v1"}. ?fields= applies to
+       the elements.
+        {
+            "resources": {
+                "338a6cc36afc5ab36a18a7eed1d8c0cf": {
+                    "resource": {
+                        "url": "config/v1/first",
+                        "id": "338a6cc36afc5ab36a18a7eed1d8c0cf",
+                        ...
+                    },
+                    "elements": {
+                        "578a08534564542a9dd2f41b1d89fbaa": { ... },
+                        ...
+                    }
+                },
+                "00000000000000000000000000000000": {
+                    "error": "Resource with id: '0000...' does not exist."
+                }
+            }
+        }
+
+hostname/specifications/:spec_name/:version/resources?limit=N&after=:id
+hostname/specifications/:resource_id/elements?limit=N&after=:id
+    -> pages through the listings above in id order. Either parameter turns
+       paging on; limit defaults to 100. "next" is the cursor to pass as
+       "after" for the following page, or null on the last page.
+        {
+            "resources": [ ... ],       or  "elements": { ... },
+            "next": "90f71e690ccffc40f8f5cf139754252f"
+        }
+
+hostname/specifications?stream=true
+hostname/specifications/:spec_name/:version/resources?stream=true
+hostname/specifications/:resource_id/elements?stream=true
+    -> sends the same listings as above, generated and written in chunks
+       while the rows are read, so that memory use does not grow with the
+       size of the listing. Cannot be combined with limit, after or
+       shape=tree.
+
+hostname/specifications/:resource_id/elements?shape=tree
+    -> shows the elements of a resource nested under their parents.
+       Optional parameters:
+           depth=N      only include N levels; nodes on the last level have
+                        no "children" key
+           root=:id     only include the subtree of the given element
+        [
+            {
+                "id": "8b298e10b06ecf85ffeb75c74c670fbb",
+                "static": true,
+                "required": true,
+                "type": "object",
+                "name": "parent",
+                "children": [
+                    {
+                        "id": "578a08534564542a9dd2f41b1d89fbaa",
+                        "static": true,
+                        "required": true,
+                        "type": "string",
+                        "name": "child",
+                        "parent": "8b298e10b06ecf85ffeb75c74c670fbb",
+                        "children": []
+                    }
+                ]
+            },
+            ...
+        ]
+
+hostname/specifications/:spec_name/:version/resources?fields=id,url
+hostname/specifications/resource/:resource_id?fields=id,url
+hostname/specifications/:resource_id/elements?fields=name,type
+    -> only include the listed keys of each resource or element, and only
+       read the columns behind them. Combines with every other parameter.
+       Resources have id, url, specName, specVersion and elementsHref;
+       elements have id, name, type, required, static and parent. Element
+       maps stay keyed by id either way.
+
+
+hostname/specifications/changes?since=N
+    -> lists the writes made after sequence number N, 0 by default, oldest
+       first. A "save" carries the properties of the created or updated
+       object. A "delete" also deletes everything under the object. Apply
+       the changes in order and ask again with since set to "next"; "more"
+       tells whether there are further changes already.
+       Optional parameters:
+           limit=N      return at most N changes, 100 by default
+           wait=S       wait up to S seconds, at most 30, for a change if
+                        there is none yet
+        {
+            "changes": [
+                {
+                    "sequence": 42,
+                    "kind": "element",
+                    "action": "save",
+                    "id": "578a08534564542a9dd2f41b1d89fbaa",
+                    "resourceId": "338a6cc36afc5ab36a18a7eed1d8c0cf",
+                    "properties": {"id": "578a...", "name": "child", ...}
+                },
+                {
+                    "sequence": 43,
+                    "kind": "resource",
+                    "action": "delete",
+                    "id": "90f71e690ccffc40f8f5cf139754252f",
+                    "specificationId": "e2a4b6a7c1d6a1f8e5b3c9d0f4a7b2c1"
+                }
+            ],
+            "next": 43,
+            "more": false
+        }
+       With Accept: text/event-stream the changes are instead sent as
+       Server-Sent Events named "change", with the sequence number as the
+       event id, for wait seconds (30 by default). After that, the client
+       reconnects with Last-Event-ID.
+
+
+hostname/specifications/:spec_name/:version/diff/:other_version
+    -> shows what changed from one version of a specification to another.
+       Resources are matched by url, treating the version segment as equal,
+       and elements by name under their matched parents.
+        {
+            "from": {"id": "...", "name": "config", "version": "v1"},
+            "to": {"id": "...", "name": "config", "version": "v2"},
+            "resources": {
+                "added": [{"id": "...", "url": "config/v2/third"}],
+                "removed": [{"id": "...", "url": "config/v1/second"}],
+                "changed": [
+                    {
+                        "fromId": "338a6cc36afc5ab36a18a7eed1d8c0cf",
+                        "toId": "0f1b7d8e52c3a59e9c7e1f3b2a4d6c88",
+                        "url": "config/v2/first",
+                        "elements": {
+                            "added": [{"path": "$.parent.new", "id": "..."}],
+                            "removed": [{"path": "$.old", "id": "..."}],
+                            "changed": [
+                                {
+                                    "path": "$.parent.child",
+                                    "from": { element properties },
+                                    "to": { element properties }
+                                }
+                            ]
+                        }
+                    }
+                ]
+            }
+        }
+
+hostname/specifications/routes?path=config/v1/users/42
+    -> finds the resources whose url matches a concrete path. A url segment
+       written as {name} matches any value, which is returned in "params";
+       literal segments win over such templates.
+        {
+            "path": "config/v1/users/42",
+            "matches": [
+                {
+                    "resourceId": "90f71e690ccffc40f8f5cf139754252f",
+                    "url": "config/v1/users/{id}",
+                    "params": {"id": "42"},
+                    "elementsHref": "/specifications/90f71e690ccffc40f8f5cf139754252f/elements"
+                }
+            ]
+        }
+
+hostname/specifications/search?q=timeout
+    -> finds the resources whose url and the elements whose name or type
+       contain every word of the query, best matches first. Words are
+       matched case insensitively, camelCase names also by their parts, and
+       a word ending with * matches any word it starts.
+       Optional parameters:
+           specName=name        only search one specification
+           specVersion=version  only search one version
+           limit=N              return at most N results, 100 by default
+           offset=N             skip the first N results, see "next"
+        {
+            "query": "timeout",
+            "total": 2,
+            "results": [
+                {
+                    "kind": "element",
+                    "id": "578a08534564542a9dd2f41b1d89fbaa",
+                    "score": 4.3944,
+                    "name": "timeout",
+                    "type": "integer",
+                    "path": "$.connection.timeout",
+                    "resourceId": "338a6cc36afc5ab36a18a7eed1d8c0cf",
+                    "url": "config/v1/first",
+                    "specName": "config",
+                    "specVersion": "v1",
+                    "elementsHref": "/specifications/338a.../elements"
+                },
+                {
+                    "kind": "resource",
+                    "id": "90f71e690ccffc40f8f5cf139754252f",
+                    "score": 1.1703,
+                    "url": "config/v1/timeout/{id}",
+                    ...
+                }
+            ],
+            "next": null
+        }
+
+hostname/specifications/cache
+    -> shows the counters of the response cache used by the views above
+        {
+            "entries": 120,
+            "maxEntries": 1000,
+            "hits": 5230,
+            "backendHits": 12,
+            "misses": 310,
+            "evictions": 0,
+            "invalidations": 190
+        }
     
+hostname/mock/:path
+    -> answers any method with an example payload for the resource whose url
+       matches the path, resolved like /specifications/routes. The payload
+       has every element, with placeholder values by type; ?optional=false
+       leaves out the elements that are not required. A literal segment is
+       preferred over a template, and urls ending at the same templates are
+       tried in the order of their url. Answers 404 if no url matches.
+
+DELETE:
+hostname/specifications/specification/:specification_id
+    -> deletes a specification with all of its resources and elements
+hostname/specifications/resource/:resource_id
+    -> deletes a resource with all of its elements
+hostname/specifications/element/:element_id
+    -> deletes an element with all of its descendants
+        {
+            "deleted": {
+                "specifications": 0,
+                "resources": 0,
+                "elements": 12
+            }
+        }
+
 POST:
 hostname/specifications/specification
     -> creates a new specification
@@ -71,18 +322,95 @@ hostname/specification/resource
     -> creates a new resource
 hostname/specification/elements
     -> creates a new element
+hostname/specifications/bulk
+    -> creates a specification with all of its resources and elements in
+       one transaction. Items that fail to parse are skipped and reported.
+        {
+            "name": "config",
+            "version": "v1",
+            "resources": [
+                {
+                    "url": "config/v1/first",
+                    "elements": [
+                        {
+                            "name": "parent",
+                            "type": "object",
+                            "elements": [
+                                {
+                                    "name": "child",
+                                    "type": "string",
+                                    "required": false
+                                }
+                            ]
+                        }
+                    ]
+                },
+                ...
+            ]
+        }
+hostname/specifications/clone
+    -> copies a specification with all of its resources and elements to a
+       new version, in one transaction. Url segments equal to the version
+       are replaced with the new version.
+        {
+            "name": "config",
+            "version": "v2",
+            "newVersion": "v3"
+        }
+hostname/specifications/:resource_id/validate
+    -> checks the posted JSON payload against the elements of a resource:
+       required keys must be present and values must match the element
+       types object, array, string, number, integer, boolean and null.
+       The children of an array element describe each of its items.
+        {
+            "valid": false,
+            "violations": [
+                {
+                    "path": "$.parent.child",
+                    "message": "Expected string, got number"
+                },
+                ...
+            ]
+        }
+hostname/specifications/validate
+    -> validates many payloads, one JSON object per line:
+        {"resourceId": "338a6cc36afc5ab36a18a7eed1d8c0cf", "payload": {...}}
+       The reply is newline delimited JSON with one result per line, grouped
+       by resource rather than in input order, and the totals last:
+        {"line": 1, "resourceId": "338a...", "valid": true, "violations": []}
+        {"line": 2, "error": "Invalid JSON"}
+        ...
+        {"stats": {"payloads": 1, "valid": 1, "invalid": 0, "errors": 1,
+                   "seconds": 0.002, "payloadsPerSecond": 500.0}}
+       Payloads are validated in the server process. The same is available
+       offline, over a pool of worker processes, with
+       'manage.py validate_payloads'.
 '''
 
 urlpatterns = patterns('specifications.views',
                        # GET resources
                        (r'^$', 'index'),
                        (r'^/(?P<specification>\w+)/(?P<version>\w+)/resources$', 'resources'),
+                       (r'^/(?P<specification>\w+)/(?P<from_version>\w+)/diff/(?P<to_version>\w+)$', 'diff'),
                        (r'^/resource/(?P<resource_id>\w+)$', 'resource'),
                        (r'^/(?P<resource_id>\w+)/elements$', 'elements'),
+                       (r'^/elements$', 'batch_elements'),
+                       (r'^/cache$', 'cache_stats'),
+                       (r'^/routes$', 'routes'),
+                       (r'^/changes$', 'changes'),
+                       (r'^/search$', 'search'),
                        
                        
                        # POST resources
                        (r'^/specification$', 'specification'),
                        (r'^/resource$', 'resource'),
-                       (r'^/element$', 'element')
+                       (r'^/element$', 'element'),
+                       (r'^/bulk$', 'bulk'),
+                       (r'^/clone$', 'clone'),
+                       (r'^/(?P<resource_id>\w+)/validate$', 'validate'),
+                       (r'^/validate$', 'validate_batch'),
+                       
+                       # DELETE resources, along with /resource/:resource_id
+                       (r'^/specification/(?P<specification_id>\w+)$', 'specification'),
+                       (r'^/element/(?P<element_id>\w+)$', 'element')
                       )
@@ -0,0 +1,321 @@
+'''
+Validation of JSON payloads against the element tree of a resource.
+
+The element rows of a resource are compiled once into nested Field objects
+holding the expected keys, their Python types and whether they are required.
+Compiled validators are cached per resource revision, so validating a
+payload normally costs one revision lookup and no element queries.
+
+BatchValidator validates streams of payloads for many resources, spreading
+them over a process pool in chunks that share one compiled validator.
+'''
+
+import cPickle
+import time
+from collections import deque
+from multiprocessing import Pool, cpu_count
+from django.conf import settings
+from resteasy.specifications.cache import ResponseCache
+from resteasy.specifications.models import Resource, Element
+from resteasy.specifications.serialization import json_codec
+
+# Python types accepted for the element types that have a JSON meaning.
+# Elements of any other type accept every value.
+TYPES = {
+         'object': (dict,),
+         'array': (list,),
+         'string': (basestring,),
+         'number': (int, long, float),
+         'integer': (int, long),
+         'boolean': (bool,),
+         'null': (type(None),),
+        }
+
+class Field(object):
+    __slots__ = ('name', 'type', 'types', 'is_required', 'fields')
+
+    def __init__(self, name, type, is_required):
+        self.name = name
+        self.type = type
+        self.types = TYPES.get(type)
+        self.is_required = is_required
+        self.fields = []
+
+    def accepts(self, value):
+        if self.types is None:
+            return True
+        # bool is a subclass of int, but true is not a JSON number
+        if isinstance(value, bool) and bool not in self.types:
+            return False
+        return isinstance(value, self.types)
+
+class PayloadValidator(object):
+    def __init__(self, fields):
+        self.fields = fields
+
+    @classmethod
+    def compile(cls, element_rows):
+        '''
+        Builds a validator from (id, name, type, is_required, parent id) rows.
+        '''
+        fields = {}
+        parent_ids = {}
+        for id, name, type, is_required, parent_id in element_rows:
+            fields[id] = Field(name, type, is_required)
+            parent_ids[id] = parent_id
+
+        root_fields = []
+        for id, field in fields.iteritems():
+            parent = fields.get(parent_ids[id])
+            if parent is None:
+                root_fields.append(field)
+            else:
+                parent.fields.append(field)
+
+        return cls(root_fields)
+
+    def validate(self, payload):
+        '''
+        Returns every violation of the payload as a dict with the JSON path of
+        the offending value and a message. An empty list means it is valid.
+        '''
+        violations = []
+        pending = [(self.fields, payload, '$')]
+        while pending:
+            fields, value, path = pending.pop()
+            if not isinstance(value, dict):
+                violations.append(_get_violation(path, "Expected object, got %s"
+                                                       % _get_type_name(value)))
+                continue
+
+            for field in fields:
+                field_path = '%s.%s' % (path, field.name)
+                if field.name not in value:
+                    if field.is_required:
+                        violations.append(_get_violation(field_path,
+                                                         "Missing required key"))
+                    continue
+
+                field_value = value[field.name]
+                if not field.accepts(field_value):
+                    violations.append(_get_violation(field_path,
+                                            "Expected %s, got %s"
+                                            % (field.type,
+                                               _get_type_name(field_value))))
+                elif field.fields and isinstance(field_value, list):
+                    # The children of an array describe each of its items
+                    for index, item in enumerate(field_value):
+                        pending.append((field.fields, item,
+                                        '%s[%d]' % (field_path, index)))
+                elif field.fields:
+                    pending.append((field.fields, field_value, field_path))
+
+        return violations
+
+class BatchValidator(object):
+    '''
+    Validates newline delimited JSON objects of the form
+        {"resourceId": "338a6cc36afc5ab36a18a7eed1d8c0cf", "payload": {...}}
+    Payloads are grouped by resource into chunks of chunk_size, each
+    validated by one of processes worker processes, or in this process if
+    processes is 1. Only the parent process queries the database.
+    
+    Each validator is pickled once and sent along with the chunks of its
+    resource, and unpickled once per worker, which keeps it for the life of
+    the pool.
+    '''
+    def __init__(self, processes=None, chunk_size=1000):
+        self.processes = processes or cpu_count()
+        self.chunk_size = chunk_size
+
+    def validate(self, lines):
+        '''
+        Yields a result for every non-blank line, grouped by chunk rather than
+        in line order, followed by {"stats": {...}} for the whole stream.
+        '''
+        started = time.time()
+        stats = {
+                 'payloads': 0,
+                 'valid': 0,
+                 'invalid': 0,
+                 'errors': 0
+                }
+        validators = {}
+        chunks = {}
+        pending = deque()
+        pool = None
+        if self.processes > 1:
+            pool = Pool(self.processes, _init_worker)
+
+        try:
+            for line_number, line in enumerate(lines, 1):
+                if not line.strip():
+                    continue
+
+                try:
+                    resource_id, payload = _parse_line(line)
+                    validator = self._get_validator(validators, resource_id)
+                except ValueError as error:
+                    stats['errors'] += 1
+                    yield {
+                           'line': line_number,
+                           'error': str(error)
+                          }
+                    continue
+
+                chunk = chunks.setdefault(resource_id, [])
+                chunk.append((line_number, payload))
+                if len(chunk) >= self.chunk_size:
+                    del chunks[resource_id]
+                    pending.append(self._submit(pool, validator, resource_id,
+                                                chunk))
+                    # Keep the pool busy without buffering the whole stream
+                    while len(pending) > 2 * self.processes:
+                        for result in _count(stats, pending.popleft().get()):
+                            yield result
+
+            for resource_id, chunk in chunks.iteritems():
+                pending.append(self._submit(pool, validators[resource_id],
+                                            resource_id, chunk))
+            while pending:
+                for result in _count(stats, pending.popleft().get()):
+                    yield result
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+        seconds = time.time() - started
+        stats['seconds'] = round(seconds, 3)
+        stats['payloadsPerSecond'] = round(stats['payloads'] / seconds
+                                           if seconds else 0, 1)
+        yield {'stats': stats}
+
+    def _get_validator(self, validators, resource_id):
+        if resource_id not in validators:
+            try:
+                revision = (Resource.objects.values_list('revision', flat=True)
+                                            .get(id=resource_id))
+            except Resource.DoesNotExist:
+                validators[resource_id] = None
+            else:
+                validators[resource_id] = _PickledValidator(
+                                        '%s:%s' % (resource_id, revision),
+                                        get_validator(resource_id, revision))
+
+        if validators[resource_id] is None:
+            raise ValueError("Resource with id '%s' does not exist"
+                             % resource_id)
+        return validators[resource_id]
+
+    def _submit(self, pool, validator, resource_id, chunk):
+        if pool is None:
+            return _FinishedChunk(_validate_chunk(validator.validator,
+                                                  resource_id, chunk))
+        return pool.apply_async(_validate_pickled_chunk,
+                                (validator.key, validator.get_pickle(),
+                                 resource_id, chunk))
+
+class _PickledValidator(object):
+    # A compiled validator, pickled on first use for the worker processes
+    def __init__(self, key, validator):
+        self.key = key
+        self.validator = validator
+        self._pickle = None
+
+    def get_pickle(self):
+        if self._pickle is None:
+            self._pickle = cPickle.dumps(self.validator,
+                                         cPickle.HIGHEST_PROTOCOL)
+        return self._pickle
+
+# Validators unpickled by a worker process, by resource id and revision
+_worker_validators = {}
+
+def _init_worker():
+    # Forked workers start with a copy of the parent's validators, if any
+    _worker_validators.clear()
+
+def _validate_pickled_chunk(key, pickle, resource_id, chunk):
+    validator = _worker_validators.get(key)
+    if validator is None:
+        validator = _worker_validators[key] = cPickle.loads(pickle)
+    return _validate_chunk(validator, resource_id, chunk)
+
+class _FinishedChunk(object):
+    # Stands in for the AsyncResult of a chunk validated in this process
+    def __init__(self, results):
+        self.results = results
+
+    def get(self):
+        return self.results
+
+def _parse_line(line):
+    try:
+        data = json_codec.loads(line)
+    except ValueError:
+        raise ValueError("Invalid JSON")
+
+    if not isinstance(data, dict):
+        raise ValueError("Line must be an type object")
+    if 'resourceId' not in data:
+        raise ValueError("Missing required key: 'resourceId'")
+    if 'payload' not in data:
+        raise ValueError("Missing required key: 'payload'")
+    if not isinstance(data['resourceId'], basestring):
+        raise ValueError("resourceId must be a string")
+    return data['resourceId'], data['payload']
+
+def _validate_chunk(validator, resource_id, chunk):
+    results = []
+    for line_number, payload in chunk:
+        violations = validator.validate(payload)
+        results.append({
+                        'line': line_number,
+                        'resourceId': resource_id,
+                        'valid': not violations,
+                        'violations': violations
+                       })
+    return results
+
+def _count(stats, results):
+    for result in results:
+        stats['payloads'] += 1
+        if result['valid']:
+            stats['valid'] += 1
+        else:
+            stats['invalid'] += 1
+        yield result
+
+def get_validator(resource_id, revision):
+    cache_key = 'validator:%s:%s' % (resource_id, revision)
+    return validator_cache.get_or_set(cache_key, [resource_id],
+                                      lambda: _compile(resource_id))
+
+def _compile(resource_id):
+    element_rows = (Element.objects.filter(resource__id=resource_id)
+                                   .values_list('id', 'name', 'type',
+                                                'is_required', 'parent'))
+    return PayloadValidator.compile(element_rows)
+
+def _get_violation(path, message):
+    return {
+            'path': path,
+            'message': message
+           }
+
+def _get_type_name(value):
+    if value is None:
+        return 'null'
+    elif isinstance(value, bool):
+        return 'boolean'
+    elif isinstance(value, (int, long, float)):
+        return 'number'
+    elif isinstance(value, basestring):
+        return 'string'
+    elif isinstance(value, list):
+        return 'array'
+    return 'object'
+
+validator_cache = ResponseCache(getattr(settings,
+                                        'SPECIFICATIONS_VALIDATOR_CACHE_SIZE',
+                                        200))
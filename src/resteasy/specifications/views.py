@@ -1,8 +1,37 @@
-import json
-from StringIO import StringIO
-from django.http import HttpResponse, HttpResponseBadRequest
+import time
+from hashlib import md5
+from itertools import groupby
+from operator import itemgetter
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.http import (HttpResponse, HttpResponseBadRequest,
+                         HttpResponseNotFound, HttpResponseNotModified)
 from django.views.decorators.csrf import csrf_exempt
-from resteasy.specifications.models import Specification, Resource, Element
+from resteasy.specifications import batch
+from resteasy.specifications.cache import response_cache
+from resteasy.specifications.changes import (DELETE, MAX_WAIT, SAVE,
+                                             get_last_sequence, record_change,
+                                             record_saves, wait_for_changes)
+from resteasy.specifications.compression import (compress, get_encoding,
+                                                 get_encodings)
+from resteasy.specifications.diff import diff_specifications
+from resteasy.specifications.hashes import (update_ancestor_hashes,
+                                             update_hashes)
+from resteasy.specifications.metrics import (add_serialization_time,
+                                             count_invalid_request, render)
+from resteasy.specifications.mocks import build_example
+from resteasy.specifications.models import (Specification, Resource, Element,
+                                            Change)
+from resteasy.specifications.routes import route_index
+from resteasy.specifications.search import get_words, search_index
+from resteasy.specifications.serialization import (get_request_codec,
+                                                   get_response_codec,
+                                                   json_codec)
+from resteasy.specifications.validation import (BatchValidator, get_validator,
+                                                validator_cache)
+
+DEFAULT_PAGE_SIZE = 100
+STREAM_CHUNK_SIZE = 500
 
 class InvalidRequest(Exception):
     def __init__(self, request, status, message):
@@ -21,23 +50,48 @@ class InvalidRequest(Exception):
                                  'message' : self.message
                                  }
                      }
+        count_invalid_request(self.request, self.status)
         return self.status, response
 
+class SerializedResponse(object):
+    '''
+    A response that has already been serialized, e.g. by the response cache,
+    or an iterator yielding it in fragments. _reply sends it as is, with the
+    content coding it was compressed with, if any.
+    '''
+    def __init__(self, content, content_type=json_codec.content_type,
+                 content_encoding=None):
+        self.content = content
+        self.content_type = content_type
+        self.content_encoding = content_encoding
+
 # Views for Specifications
 def index(request):
+    etag = None
     try:
-        status = '200'
-        response = _get_index_response(request)
+        # Every write, including adding or deleting a specification, records
+        # a change, so the last one tags the index without reading it
+        etag = _get_etag(request, 'index', get_last_sequence())
+        if _is_not_modified(request, etag):
+            status, response = '304', None
+        elif _is_streamed(request):
+            status = '200'
+            response = SerializedResponse(_stream_index())
+        else:
+            status = '200'
+            response = _get_cached_response(request, 'index', etag,
+                                            ['index'], _get_index_response,
+                                            request)
     except InvalidRequest as invalid_request:
         status, response = invalid_request.get_response()
     finally:
-        return _reply(status, response)
+        return _reply(request, status, response, etag)
 
 def _get_index_response(request):
     response_properties = []
     
-    spec_models = Specification.objects.all()
-    versions = _get_versions(spec_models)
+    spec_rows = Specification.objects.values_list('name', 'version')
+    versions = _get_versions(spec_rows)
     
     for spec in versions.keys():
         spec_properties = {
@@ -48,38 +102,59 @@ def _get_index_response(request):
             
     return response_properties
 
-def _get_versions(spec_models):
+def _stream_index():
+    # Keyed by name and version rather than id, so that the versions of a
+    # specification arrive together
+    spec_rows = _iterate_rows(Specification.objects.values_list('name',
+                                                                'version'),
+                              ('name', 'version'))
+    spec_properties = ({
+                        'name': name,
+                        'versions': [version for name, version in rows]
+                       }
+                       for name, rows in groupby(spec_rows, itemgetter(0)))
+    return _stream_list(spec_properties)
+
+def _get_versions(spec_rows):
     versions = {}
-    for spec_model in spec_models:
-        if versions.has_key(spec_model.name):
-            versions[spec_model.name].append(spec_model.version)
+    for name, version in spec_rows:
+        if versions.has_key(name):
+            versions[name].append(version)
         else:
-            versions[spec_model.name] = [spec_model.version]
+            versions[name] = [version]
             
     return versions
 
 @csrf_exempt
-def specification(request):
+def specification(request, specification_id=None):
     try:
         if request.method == 'POST':
             status = '200'
             response = _create_specification(request)
+        elif request.method == 'DELETE' and specification_id:
+            status = '200'
+            response = _delete_specification(request, specification_id)
         else:
-            error_message = "Only POST is supported."
+            error_message = "Only POST and DELETE are supported."
             raise InvalidRequest(request, '400', error_message)
     except InvalidRequest as invalid_request:
         status, response = invalid_request.get_response()
     finally:    
-        return _reply(status, response)
+        return _reply(request, status, response)
 
 def _create_specification(request):
+    specification_data = _get_post_data(request)
     try:
-        specification_data = _get_post_data(request)
         return _parse_and_save_specification(request,
                                              specification_data)
-    except InvalidRequest as invalid_request:
-        raise invalid_request
+    except IntegrityError:
+        # Another row already has the name and version
+        error_message = ("Specification '%s:%s' already exists"
+                         % (specification_data['name'],
+                            specification_data['version']))
+        raise InvalidRequest(request, '400', error_message)
 
+@transaction.commit_on_success
 def _parse_and_save_specification(request, specification_data):
     try:
         name = specification_data['name']
@@ -100,50 +175,734 @@ def _parse_and_save_specification(request, specification_data):
         error_message = "Missing required key: %s" % key_error
         raise InvalidRequest(request, '400', error_message)
         
+@route_index.deferred
+@transaction.commit_on_success
+def _delete_specification(request, specification_id):
+    try:
+        spec = Specification.objects.get(id=specification_id)
+    except Specification.DoesNotExist:
+        error_message = ("Specification with id '%s' does not exist" 
+                         % specification_id)
+        raise InvalidRequest(request, '400', error_message)
+    
+    resource_urls = dict(Resource.objects.filter(specification=spec)
+                                         .values_list('id', 'url'))
+    resource_ids = resource_urls.keys()
+    element_ids = list(Element.objects.filter(resource__specification=spec)
+                                      .values_list('id', flat=True))
+    batch.delete_rows(Element, element_ids)
+    batch.delete_rows(Resource, resource_ids)
+    batch.delete_rows(Specification, [spec.id])
+    record_change('specification', DELETE, spec.id)
+    
+    response_cache.invalidate('index', spec.id, *resource_ids)
+    validator_cache.invalidate(*resource_ids)
+    for id, url in resource_urls.iteritems():
+        route_index.remove(url, id)
+    return _get_delete_response(1, len(resource_ids), len(element_ids))
+
+@csrf_exempt
+def clone(request):
+    try:
+        if request.method == 'POST':
+            status = '200'
+            response = _create_clone(request)
+        else:
+            error_message = "Only POST is supported."
+            raise InvalidRequest(request, '400', error_message)
+    except InvalidRequest as invalid_request:
+        status, response = invalid_request.get_response()
+    finally:
+        return _reply(request, status, response)
+
+def _create_clone(request):
+    clone_data = _get_post_data(request)
+    try:
+        name = clone_data['name']
+        version = clone_data['version']
+        new_version = clone_data['newVersion']
+    except KeyError as key_error:
+        error_message = "Missing required key: %s" % key_error
+        raise InvalidRequest(request, '400', error_message)
+    
+    if not new_version:
+        error_message = "newVersion cannot be null or empty"
+        raise InvalidRequest(request, '400', error_message)
+    
+    _check_string(request, 'newVersion', new_version)
+    
+    spec = _get_specification(request, name, version)
+    new_spec = Specification(name=name, version=new_version)
+    new_spec.generate_id()
+    try:
+        return _clone_specification(request, spec, new_spec)
+    except IntegrityError:
+        # A concurrent request created the version after the check
+        error_message = ("Specification '%s (%s)' already exists" 
+                         % (name, new_version))
+        raise InvalidRequest(request, '400', error_message)
+
+@route_index.deferred
+@transaction.commit_on_success
+def _clone_specification(request, spec, new_spec):
+    # Checked in the transaction of the copy, whose inserts fail on the
+    # unique keys if another request gets there first
+    if Specification.objects.filter(id=new_spec.id).exists():
+        error_message = ("Specification '%s (%s)' already exists" 
+                         % (new_spec.name, new_spec.version))
+        raise InvalidRequest(request, '400', error_message)
+    
+    # Rows are copied as tuples rather than models, which would cost more
+    # than the inserts themselves for large specifications.
+    resource_rows = (Resource.objects.filter(specification=spec)
+                                     .values_list('id', 'url', 'tree_hash'))
+    new_resource_ids = {}
+    new_resource_rows = []
+    new_urls = {}
+    for id, url, tree_hash in resource_rows:
+        new_url = Resource.replace_version(url, spec.version, new_spec.version)
+        if new_url in new_urls:
+            error_message = ("Resources '%s' and '%s' would both become '%s'"
+                             % (new_urls[new_url], url, new_url))
+            raise InvalidRequest(request, '400', error_message)
+        new_urls[new_url] = url
+        new_resource_ids[id] = Resource.build_id(new_url, new_spec.id)
+        new_resource_rows.append((new_resource_ids[id], new_url, new_spec.id,
+                                  0, tree_hash))
+    
+    element_rows = (Element.objects.filter(resource__specification=spec)
+                                   .values_list('id', 'name', 'type',
+                                                'is_required', 'is_static',
+                                                'resource', 'parent',
+                                                'subtree_hash'))
+    children = {}
+    for element_row in element_rows:
+        children.setdefault(element_row[6], []).append(element_row)
+    
+    # Ids include the parent id, so parents are copied before their children.
+    # The subtree hashes do not depend on ids and are copied as they are.
+    new_element_rows = []
+    pending = [(None, element_row) for element_row in children.get(None, [])]
+    while pending:
+        new_parent_id, element_row = pending.pop()
+        (id, name, type, is_required, is_static, resource_id, parent_id,
+         subtree_hash) = element_row
+        new_resource_id = new_resource_ids[resource_id]
+        new_id = Element.build_id(name, new_resource_id, new_parent_id)
+        new_element_rows.append((new_id, name, type, is_required, is_static,
+                                 new_resource_id, new_parent_id, subtree_hash))
+        pending.extend((new_id, child_row)
+                       for child_row in children.get(id, []))
+    
+    _save_model(new_spec)
+    batch.insert_rows(Resource, ['id', 'url', 'specification', 'revision',
+                                 'tree_hash'], new_resource_rows)
+    batch.insert_rows(Element, ['id', 'name', 'type', 'is_required',
+                                'is_static', 'resource', 'parent',
+                                'subtree_hash'], new_element_rows)
+    record_saves('resource', [(id, new_spec.id,
+                               Resource.build_properties(id, url,
+                                                         new_spec.name,
+                                                         new_spec.version))
+                              for id, url, spec_id, revision, tree_hash
+                              in new_resource_rows])
+    record_saves('element', [(element_row[0], element_row[5],
+                              Element.build_properties(*element_row[:5] +
+                                                       element_row[6:7])[1])
+                             for element_row in new_element_rows])
+    sequence = get_last_sequence()
+    for chunk in batch.chunks([row[0] for row in new_resource_rows]):
+        _bump_revision(Resource.objects.filter(id__in=chunk), sequence)
+    _bump_revision(Specification.objects.filter(id=new_spec.id), sequence)
+    response_cache.invalidate('index')
+    for resource_row in new_resource_rows:
+        route_index.add(resource_row[1], resource_row[0])
+    
+    return {
+            'specification': new_spec.get_properties(),
+            'resourceCount': len(new_resource_rows),
+            'elementCount': len(new_element_rows)
+           }
+        
+# Views for resolving paths
+def routes(request):
+    try:
+        status = '200'
+        path = request.GET.get('path')
+        if not path:
+            error_message = "Must specify a path"
+            raise InvalidRequest(request, '400', error_message)
+        
+        response = _get_routes_response(request, path)
+    except InvalidRequest as invalid_request:
+        status, response = invalid_request.get_response()
+    finally:
+        return _reply(request, status, response)
+
+def _get_routes_response(request, path):
+    matches = route_index.resolve(path)
+    if not matches:
+        error_message = "No resource matches path '%s'" % path
+        raise InvalidRequest(request, '400', error_message)
+    
+    return {
+            'path': path,
+            'matches': [{
+                         'resourceId': id,
+                         'url': url,
+                         'params': params,
+                         'elementsHref': '/specifications/%s/elements' % id
+                        }
+                        for id, url, params in matches]
+           }
+
+# Views for searching
+def search(request):
+    try:
+        status = '200'
+        query = request.GET.get('q', '').strip()
+        if not query:
+            error_message = "Must specify a query"
+            raise InvalidRequest(request, '400', error_message)
+        if not get_words(query):
+            error_message = "Query must contain letters or digits"
+            raise InvalidRequest(request, '400', error_message)
+        
+        response = _get_search_response(request, query)
+    except InvalidRequest as invalid_request:
+        status, response = invalid_request.get_response()
+    
+    return _reply(request, status, response)
+
+def _get_search_response(request, query):
+    limit = _get_positive_int(request, 'limit') or DEFAULT_PAGE_SIZE
+    offset = _get_offset(request)
+    total, matches = search_index.search(query,
+                                         request.GET.get('specName'),
+                                         request.GET.get('specVersion'),
+                                         offset, limit)
+    next_offset = None
+    if offset + limit < total:
+        next_offset = offset + limit
+    
+    return {
+            'query': query,
+            'total': total,
+            'results': [_build_search_result(score, document)
+                        for score, document in matches],
+            'next': next_offset
+           }
+
+def _get_offset(request):
+    # Ranks move as the index changes, so search results are paged by
+    # position, unlike the after id cursor of the other listings
+    if 'after' in request.GET:
+        error_message = "Search results are paged with offset, not after"
+        raise InvalidRequest(request, '400', error_message)
+    
+    value = request.GET.get('offset', '0')
+    if not value.isdigit():
+        error_message = "offset must be the position of a result"
+        raise InvalidRequest(request, '400', error_message)
+    
+    return int(value)
+
+def _build_search_result(score, document):
+    result = {
+              'kind': document.kind,
+              'id': document.id,
+              'score': round(score, 4)
+             }
+    
+    if document.kind == 'element':
+        result.update({
+                       'name': document.text,
+                       'type': document.type,
+                       'path': search_index.get_path(document),
+                       'resourceId': document.owner_id
+                      })
+    resource = search_index.get_resource(document)
+    if resource is not None:
+        result.update({
+                       'url': resource.text,
+                       'specName': resource.spec_name,
+                       'specVersion': resource.spec_version,
+                       'elementsHref': '/specifications/%s/elements'
+                                       % resource.id
+                      })
+    return result
+
+# Views for the change feed
+def changes(request):
+    try:
+        since = _get_sequence(request)
+        limit = _get_positive_int(request, 'limit') or DEFAULT_PAGE_SIZE
+        if _is_event_stream(request):
+            return _stream_changes(since, limit, _get_wait(request, MAX_WAIT))
+        
+        status = '200'
+        response = _get_changes_response(since, limit, _get_wait(request, 0))
+    except InvalidRequest as invalid_request:
+        status, response = invalid_request.get_response()
+    
+    return _reply(request, status, response)
+
+def _get_changes_response(since, limit, wait):
+    # One extra row tells whether the consumer should ask again right away
+    change_rows = wait_for_changes(since, limit + 1, wait)
+    has_more = len(change_rows) > limit
+    change_rows = change_rows[:limit]
+    if change_rows:
+        since = change_rows[-1][0]
+    
+    return {
+            'changes': [Change.build_properties(*change_row)
+                        for change_row in change_rows],
+            'next': since,
+            'more': has_more
+           }
+
+def _stream_changes(since, limit, wait):
+    response = HttpResponse(_iterate_change_events(since, limit, wait),
+                            'text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+def _iterate_change_events(since, limit, wait):
+    # Sends the changes after since as they are made for wait seconds, after
+    # which the client reconnects with the Last-Event-ID of the last one.
+    deadline = time.time() + wait
+    while True:
+        change_rows = wait_for_changes(since, limit,
+                                       max(deadline - time.time(), 0))
+        if change_rows:
+            yield ''.join('id: %d\nevent: change\ndata: %s\n\n'
+                          % (change_row[0],
+                             json_codec.dumps(
+                                    Change.build_properties(*change_row)))
+                          for change_row in change_rows)
+            since = change_rows[-1][0]
+        
+        if time.time() >= deadline:
+            return
+
+def _get_sequence(request):
+    # EventSource clients send the id of the last event they received when
+    # they reconnect
+    value = (request.META.get('HTTP_LAST_EVENT_ID') 
+             or request.GET.get('since', '0'))
+    if not value.isdigit():
+        error_message = "since must be a sequence number"
+        raise InvalidRequest(request, '400', error_message)
+    
+    return int(value)
+
+def _get_wait(request, default):
+    value = request.GET.get('wait')
+    if value is None:
+        return default
+    
+    try:
+        wait = float(value)
+    except ValueError:
+        wait = -1
+    
+    if not wait >= 0:
+        error_message = "wait must be a number of seconds"
+        raise InvalidRequest(request, '400', error_message)
+    
+    return min(wait, MAX_WAIT)
+
+def _is_event_stream(request):
+    return 'text/event-stream' in request.META.get('HTTP_ACCEPT', '')
+
+# Views for the mock server
+@csrf_exempt
+def mock(request, path):
+    try:
+        status = '200'
+        response = _get_mock_response(request, path)
+    except InvalidRequest as invalid_request:
+        status, response = invalid_request.get_response()
+    finally:
+        return _reply(request, status, response)
+
+def _get_mock_response(request, path):
+    # Matches are the most specific urls, ordered by url and id
+    matches = route_index.resolve(path)
+    if not matches:
+        error_message = "No resource matches path '%s'" % path
+        raise InvalidRequest(request, '404', error_message)
+    
+    resource_id = matches[0][0]
+    include_optional = _boolean(request.GET.get('optional', 'true'))
+    try:
+        revision = (Resource.objects.values_list('revision', flat=True)
+                                    .get(id=resource_id))
+    except Resource.DoesNotExist:
+        # Deleted since the route index was updated
+        error_message = "No resource matches path '%s'" % path
+        raise InvalidRequest(request, '404', error_message)
+    
+    # Examples only change with the elements, so they are built once per
+    # resource revision and then served from the response cache.
+    codec = get_response_codec(request)
+    cache_key = 'specifications:mock:%s:%s:%s:%s' % (resource_id, revision,
+                                                     include_optional,
+                                                     codec.name)
+    content = response_cache.get_or_set(
+                        cache_key, [resource_id],
+                        lambda: _dumps(request, codec,
+                                       _get_mock_example(resource_id,
+                                                         include_optional)))
+    return SerializedResponse(content, codec.content_type)
+
+def _get_mock_example(resource_id, include_optional):
+    element_rows = (Element.objects.filter(resource__id=resource_id)
+                                   .values_list('id', 'name', 'type',
+                                                'is_required', 'parent'))
+    return build_example(element_rows, include_optional)
+
+# Views for the response cache
+def cache_stats(request):
+    status = '200'
+    response = response_cache.get_stats()
+    return _reply(request, status, response)
+
+# Views for monitoring
+def metrics(request):
+    return HttpResponse(render(), 'text/plain; version=0.0.4')
+
+# Views for bulk loading
+@csrf_exempt
+def bulk(request):
+    try:
+        if request.method == 'POST':
+            status = '200'
+            response = _create_bulk(request)
+        else:
+            error_message = "Only POST is supported."
+            raise InvalidRequest(request, '400', error_message)
+    except InvalidRequest as invalid_request:
+        status, response = invalid_request.get_response()
+    finally:
+        return _reply(request, status, response)
+
+def _create_bulk(request):
+    bulk_data = _get_post_data(request)
+    return _parse_and_save_bulk(request, bulk_data)
+
+@route_index.deferred
+@transaction.commit_on_success
+def _parse_and_save_bulk(request, bulk_data):
+    spec = _parse_bulk_specification(request, bulk_data)
+    errors = []
+    resource_models = {}
+    element_models = {}
+    
+    resources_data = _get_bulk_list(request, bulk_data, 'resources')
+    for index, resource_data in enumerate(resources_data):
+        path = 'resources[%d]' % index
+        try:
+            resource = _parse_bulk_resource(request, spec, resource_data)
+            if resource.id in resource_models:
+                error_message = "Duplicate resource url '%s'" % resource.url
+                raise InvalidRequest(request, '400', error_message)
+        except InvalidRequest as invalid_request:
+            errors.append(_get_bulk_error(path, invalid_request))
+            continue
+        
+        resource_models[resource.id] = resource
+        _parse_bulk_elements(request, resource, resource_data, path,
+                             element_models, errors)
+    
+    _save_model(spec)
+    batch.save_models(resource_models.values(), update_existing=False)
+    batch.save_models(element_models.values())
+    for resource_id in resource_models.keys():
+        update_hashes(resource_id)
+    record_saves('resource', [(resource.id, spec.id, resource.get_properties())
+                              for resource in resource_models.values()])
+    record_saves('element', [(element.id, element.resource_id,
+                              element.get_properties()[1])
+                             for element in element_models.values()])
+    
+    sequence = get_last_sequence()
+    for chunk in batch.chunks(resource_models.keys()):
+        _bump_revision(Resource.objects.filter(id__in=chunk), sequence)
+    _bump_revision(Specification.objects.filter(id=spec.id), sequence)
+    response_cache.invalidate('index', spec.id, *resource_models.keys())
+    validator_cache.invalidate(*resource_models.keys())
+    for resource in resource_models.values():
+        route_index.add(resource.url, resource.id)
+    
+    return {
+            'specification': spec.get_properties(),
+            'resources': [resource.get_properties()
+                          for resource in resource_models.values()],
+            'elementCount': len(element_models),
+            'errors': errors
+           }
+
+def _parse_bulk_specification(request, bulk_data):
+    try:
+        name = bulk_data['name']
+        version = bulk_data['version']
+    except KeyError as key_error:
+        error_message = "Missing required key: %s" % key_error
+        raise InvalidRequest(request, '400', error_message)
+    
+    if not name:
+        error_message = "name cannot be null or empty"
+        raise InvalidRequest(request, '400', error_message)
+    
+    if not version:
+        error_message = "version cannot be null or empty"
+        raise InvalidRequest(request, '400', error_message)
+    
+    _check_string(request, 'name', name)
+    _check_string(request, 'version', version)
+    spec = Specification(name=name, version=version)
+    spec.generate_id()
+    return spec
+
+def _parse_bulk_resource(request, spec, resource_data):
+    if not isinstance(resource_data, dict):
+        error_message = "Resource must be an type object"
+        raise InvalidRequest(request, '400', error_message)
+    
+    try:
+        url = resource_data['url']
+    except KeyError as key_error:
+        error_message = "Missing required key: %s" % key_error
+        raise InvalidRequest(request, '400', error_message)
+    
+    if not url:
+        error_message = "url cannot be null or empty"
+        raise InvalidRequest(request, '400', error_message)
+    
+    _check_string(request, 'url', url)
+    resource = Resource(url=url, specification=spec)
+    resource.generate_id()
+    return resource
+
+def _parse_bulk_elements(request, resource, resource_data, path,
+                         element_models, errors):
+    # Walk the nested elements depth first without recursion so that deep
+    # trees do not hit the interpreter's recursion limit. An element that
+    # fails to parse is reported and its subtree is skipped.
+    pending = [(None, '%s.elements' % path,
+                _get_bulk_list(request, resource_data, 'elements'))]
+    while pending:
+        parent, children_path, children_data = pending.pop()
+        for index, element_data in enumerate(children_data):
+            element_path = '%s[%d]' % (children_path, index)
+            try:
+                element = _parse_bulk_element(request, resource, parent,
+                                              element_data)
+                if element.id in element_models:
+                    error_message = ("Duplicate element '%s'" 
+                                     % element.name)
+                    raise InvalidRequest(request, '400', error_message)
+            except InvalidRequest as invalid_request:
+                errors.append(_get_bulk_error(element_path, invalid_request))
+                continue
+            
+            element_models[element.id] = element
+            pending.append((element, '%s.elements' % element_path,
+                            _get_bulk_list(request, element_data,
+                                           'elements')))
+
+def _parse_bulk_element(request, resource, parent, element_data):
+    if not isinstance(element_data, dict):
+        error_message = "Element must be an type object"
+        raise InvalidRequest(request, '400', error_message)
+    
+    try:
+        name = element_data['name']
+        type = element_data['type']
+    except KeyError as key_error:
+        error_message = "Missing required key: %s" % key_error
+        raise InvalidRequest(request, '400', error_message)
+    
+    if name is None:
+        error_message = "name cannot be null"
+        raise InvalidRequest(request, '400', error_message)
+    
+    _check_string(request, 'name', name)
+    _check_string(request, 'type', type)
+    is_required = True
+    if element_data.has_key('required'):
+        is_required = _boolean(element_data['required'])
+    
+    is_static = True
+    if element_data.has_key('static'):
+        is_static = _boolean(element_data['static'])
+    
+    element = Element(name=name,
+                      type=type,
+                      is_required=is_required,
+                      is_static=is_static,
+                      resource=resource,
+                      parent=parent
+                     )
+    element.generate_id()
+    return element
+
+def _get_bulk_list(request, data, key):
+    # A malformed list fails the whole import: there are no items in it to
+    # report errors for
+    value = data.get(key) or []
+    if not isinstance(value, list):
+        error_message = "%s must be a list" % key
+        raise InvalidRequest(request, '400', error_message)
+    return value
+
+def _check_string(request, key, value):
+    # Ids are hashed from these values, and the columns are NOT NULL
+    if not isinstance(value, basestring):
+        error_message = "%s must be a string" % key
+        raise InvalidRequest(request, '400', error_message)
+
+def _get_bulk_error(path, invalid_request):
+    return {
+            'path': path,
+            'message': invalid_request.message
+           }
+
 # Views for Resources    
 def resources(request, specification, version):
+    etag = None
     try:
-        status = '200'
-        response = _get_resources_response(request, specification, version)
+        _check_stream(request)
+        spec = _get_specification(request, specification, version)
+        etag = _get_etag(request, spec.id, spec.revision)
+        if _is_not_modified(request, etag):
+            status, response = '304', None
+        elif _is_streamed(request):
+            status = '200'
+            response = SerializedResponse(_stream_resources(request, spec))
+        else:
+            status = '200'
+            response = _get_cached_response(request, 'resources', etag,
+                                            [spec.id],
+                                            _get_resources_response,
+                                            request, spec)
     except InvalidRequest as invalid_request:
         status, response = invalid_request.get_response()
     finally:
-        return _reply(status, response)
+        return _reply(request, status, response, etag)
     
-def _get_resources_response(request, specification, version):
+def _get_specification(request, specification, version):
     try:
-        spec = Specification.objects.get(name=specification, version=version)
+        return Specification.objects.get(name=specification, version=version)
     except Specification.DoesNotExist:
         error_message = ("Specification '" + specification + ":" + version 
                             + "' does not exist.")
         raise InvalidRequest(request, '400', error_message)
-    else:
-        resources = Resource.objects.filter(specification=spec)
-        response_properties = [resource.get_properties() 
-                               for resource in resources]
-        return response_properties          
+
+def _stream_resources(request, spec):
+    fields = _get_fields(request, Resource)
+    row_fields = _get_row_fields(Resource, fields)
+    resource_rows = (Resource.objects.filter(specification=spec)
+                                     .values_list(*row_fields))
+    return _stream_list(_build_properties(Resource, row_fields, resource_row,
+                                          fields)
+                        for resource_row in _iterate_rows(resource_rows))
+
+def _get_resources_response(request, spec):
+    fields = _get_fields(request, Resource)
+    row_fields = _get_row_fields(Resource, fields)
+    resource_rows = (Resource.objects.filter(specification=spec)
+                                     .values_list(*row_fields))
+    page = _get_page(request, resource_rows)
+    if page:
+        resource_rows, next_cursor = page
+    
+    response_properties = [_build_properties(Resource, row_fields,
+                                             resource_row, fields)
+                           for resource_row in resource_rows]
+    if page:
+        return {
+                'resources': response_properties,
+                'next': next_cursor
+               }
+    return response_properties          
+
+def diff(request, specification, from_version, to_version):
+    etag = None
+    try:
+        old_spec = _get_specification(request, specification, from_version)
+        new_spec = _get_specification(request, specification, to_version)
+        etag = _get_etag(request, old_spec.id, old_spec.revision,
+                         new_spec.id, new_spec.revision)
+        if _is_not_modified(request, etag):
+            status, response = '304', None
+        else:
+            status = '200'
+            response = {
+                        'from': old_spec.get_properties(),
+                        'to': new_spec.get_properties(),
+                        'resources': diff_specifications(old_spec, new_spec)
+                       }
+    except InvalidRequest as invalid_request:
+        status, response = invalid_request.get_response()
+    
+    return _reply(request, status, response, etag)
 
 @csrf_exempt   
 def resource(request, resource_id=None):
+    etag = None
     try:
         status = '200'
         if request.method == 'POST':
             response = _create_resource(request)
+        elif request.method == 'DELETE' and resource_id:
+            response = _delete_resource(request, resource_id)
         elif request.method == 'GET':
             resource = _get_resource(request, resource_id)
-            response = resource.get_properties()
+            # A resource's properties are all derived from its id, so the id
+            # alone identifies the representation.
+            etag = _get_etag(request, resource.id)
+            fields = _get_fields(request, Resource)
+            if _is_not_modified(request, etag):
+                status, response = '304', None
+            else:
+                response = _get_cached_response(request, 'resource', etag,
+                                                [resource.id], _project,
+                                                resource.get_properties(),
+                                                fields)
         else:
-            error_message = "Only POST and GET are supported"
+            error_message = "Only POST, GET and DELETE are supported"
             raise InvalidRequest(request, '400', error_message)
     except InvalidRequest as invalid_request:
         status, response = invalid_request.get_response()
     finally:
-        return _reply(status, response)
+        return _reply(request, status, response, etag)
         
+@route_index.deferred
+@transaction.commit_on_success
+def _delete_resource(request, resource_id):
+    resource = _get_resource(request, resource_id)
+    element_ids = list(Element.objects.filter(resource=resource)
+                                      .values_list('id', flat=True))
+    batch.delete_rows(Element, element_ids)
+    batch.delete_rows(Resource, [resource.id])
+    sequence = record_change('resource', DELETE, resource.id,
+                             resource.specification_id)
+    
+    _bump_revisions(resource, sequence)
+    response_cache.invalidate(resource.specification_id, resource.id)
+    validator_cache.invalidate(resource.id)
+    route_index.remove(resource.url, resource.id)
+    return _get_delete_response(0, 1, len(element_ids))
+
 def _create_resource(request):
     resource_data = _get_post_data(request)
     return _parse_and_save_resource(request, resource_data)
         
+@route_index.deferred
+@transaction.commit_on_success
 def _parse_and_save_resource(request, resource_data):
     try:
         specification = resource_data['specName']
@@ -163,50 +922,509 @@ def _parse_and_save_resource(request, resource_data):
         raise InvalidRequest(request, '400', error_message)
 
 def elements(request, resource_id):
+    etag = None
     try:
         status = '200'
-        if resource_id:
-            response = _get_elements_response(request, resource_id)
-        else:
+        shape = request.GET.get('shape', 'flat')
+        if not resource_id:
             error_message = "Must specify a resource id"
             raise InvalidRequest(request, '400', error_message)
+        elif shape not in ['flat', 'tree']:
+            error_message = "shape must be either 'flat' or 'tree'"
+            raise InvalidRequest(request, '400', error_message)
+        elif shape == 'tree' and _is_paginated(request):
+            error_message = "limit and after are only supported by shape 'flat'"
+            raise InvalidRequest(request, '400', error_message)
+        elif shape == 'tree' and _is_streamed(request):
+            error_message = "stream is only supported by shape 'flat'"
+            raise InvalidRequest(request, '400', error_message)
+        _check_stream(request)
+        
+        resource = _get_resource(request, resource_id)
+        etag = _get_etag(request, resource.id, resource.revision)
+        if _is_not_modified(request, etag):
+            status, response = '304', None
+        elif _is_streamed(request):
+            response = SerializedResponse(_stream_elements(request, resource))
+        elif shape == 'flat':
+            response = _get_cached_response(request, 'elements', etag,
+                                            [resource.id],
+                                            _get_elements_response,
+                                            request, resource)
+        else:
+            response = _get_cached_response(request, 'elements', etag,
+                                            [resource.id],
+                                            _get_element_tree_response,
+                                            request, resource)
     except InvalidRequest as invalid_request:
         status, response = invalid_request.get_response()
     finally:
-        return _reply(status, response)
+        return _reply(request, status, response, etag)
 
-def _get_elements_response(request, resource_id): 
-    resource = _get_resource(request, resource_id)          
-    element_models = Element.objects.filter(resource=resource)
+def _get_elements_response(request, resource): 
+    fields = _get_fields(request, Element)
+    row_fields = _get_row_fields(Element, fields)
+    element_rows = (Element.objects.filter(resource=resource)
+                                   .values_list(*row_fields))
+    page = _get_page(request, element_rows)
+    if page:
+        element_rows, next_cursor = page
+    
     element_model_properties = {}
-    for element_model in element_models:
-        id, elements = element_model.get_properties()
-        element_model_properties[id] = elements
-                
+    for element_row in element_rows:
+        element_model_properties[element_row[0]] = _build_properties(
+                                    Element, row_fields, element_row, fields)
+    
+    if page:
+        return {
+                'elements': element_model_properties,
+                'next': next_cursor
+               }
     return element_model_properties
         
+def _stream_elements(request, resource):
+    fields = _get_fields(request, Element)
+    row_fields = _get_row_fields(Element, fields)
+    element_rows = (Element.objects.filter(resource=resource)
+                                   .values_list(*row_fields))
+    return _stream_dict((element_row[0],
+                         _build_properties(Element, row_fields, element_row,
+                                           fields))
+                        for element_row in _iterate_rows(element_rows))
+
+def _get_element_tree_response(request, resource):
+    depth = _get_positive_int(request, 'depth')
+    root_id = request.GET.get('root')
+    fields = _get_fields(request, Element)
+    # The parent is always fetched, since the tree is built from it
+    row_fields = _get_row_fields(Element, fields, ('id', 'parent'))
+    parent_index = row_fields.index('parent')
+    
+    element_rows = (Element.objects.filter(resource=resource)
+                                   .values_list(*row_fields))
+    element_model_properties = {}
+    children = {}
+    for element_row in element_rows:
+        id = element_row[0]
+        element_model_properties[id] = _build_properties(Element, row_fields,
+                                                         element_row, fields)
+        children.setdefault(element_row[parent_index], []).append(id)
+    
+    if not root_id:
+        root_ids = children.get(None, [])
+    elif root_id in element_model_properties:
+        root_ids = [root_id]
+    else:
+        error_message = ("Element with id '%s' does not exist in resource '%s'"
+                         % (root_id, resource.id))
+        raise InvalidRequest(request, '400', error_message)
+    
+    return _build_element_tree(root_ids, element_model_properties, children,
+                               depth)
+
+def _build_element_tree(root_ids, element_model_properties, children, depth):
+    # Nodes on the last level allowed by depth have no 'children' key, which
+    # tells clients that the tree was cut there rather than being a leaf.
+    tree = []
+    pending = [(tree, root_ids, 1)]
+    while pending:
+        nodes, ids, level = pending.pop()
+        for id in ids:
+            node = element_model_properties[id]
+            nodes.append(node)
+            if depth is None or level < depth:
+                node['children'] = []
+                pending.append((node['children'], children.get(id, []),
+                                level + 1))
+    
+    return tree
+
+def _is_paginated(request):
+    return 'limit' in request.GET or 'after' in request.GET
+
+def _get_page(request, rows):
+    '''
+    Returns the rows after the 'after' cursor, up to 'limit' of them, along
+    with the cursor of the next page, or None if the request is not
+    paginated. rows must be a values_list() queryset starting with the id.
+    '''
+    if not _is_paginated(request):
+        return None
+    
+    limit = _get_positive_int(request, 'limit') or DEFAULT_PAGE_SIZE
+    after = request.GET.get('after')
+    
+    rows = rows.order_by('id')
+    if after:
+        rows = rows.filter(id__gt=after)
+    
+    # Fetching one extra row tells whether there is a next page without a
+    # separate count query.
+    rows = list(rows[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1][0]
+    
+    return rows, next_cursor
+
+def _get_fields(request, model):
+    '''
+    Returns the property keys listed by ?fields=, or None if all of them
+    are to be returned.
+    '''
+    value = request.GET.get('fields')
+    if value is None:
+        return None
+    
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown_fields = [field for field in fields
+                      if field not in model.PROPERTY_FIELDS]
+    if not fields or unknown_fields:
+        error_message = ("fields must be a comma separated list of: %s"
+                         % ', '.join(sorted(model.PROPERTY_FIELDS)))
+        raise InvalidRequest(request, '400', error_message)
+    
+    return fields
+
+def _get_row_fields(model, fields, required_fields=('id',)):
+    # The subset of ROW_FIELDS, in order, behind the projected keys. The id
+    # is always fetched since pages, streams and element maps are keyed by
+    # it, and leaving out the specification columns of resources also
+    # leaves out their join.
+    if fields is None:
+        return model.ROW_FIELDS
+    
+    columns = set(model.PROPERTY_FIELDS[field] for field in fields)
+    columns.update(required_fields)
+    return tuple(field for field in model.ROW_FIELDS if field in columns)
+
+def _build_properties(model, row_fields, row, fields):
+    if row_fields != model.ROW_FIELDS:
+        values = dict(zip(row_fields, row))
+        row = [values.get(field) for field in model.ROW_FIELDS]
+    
+    properties = model.build_properties(*row)
+    if model is Element:
+        id, properties = properties
+    return _project(properties, fields)
+
+def _project(properties, fields):
+    if fields is None:
+        return properties
+    return dict((field, properties[field]) for field in fields
+                if field in properties)
+
+def _is_streamed(request):
+    return _boolean(request.GET.get('stream', 'false'))
+
+def _check_stream(request):
+    # Checked before the ETag, so that an invalid request never gets a 304
+    if _is_streamed(request) and _is_paginated(request):
+        error_message = "limit and after cannot be combined with stream"
+        raise InvalidRequest(request, '400', error_message)
+
+def _iterate_rows(rows, key_fields=('id',)):
+    '''
+    Yields the rows of a values_list() queryset starting with key_fields, a
+    unique key, reading them in keyset chunks so that only one chunk is held
+    in memory at a time whatever the database backend does with large result
+    sets, and no cursor stays open, blocking writers, while they are sent.
+    '''
+    rows = rows.order_by(*key_fields)
+    last_row = None
+    while True:
+        chunk = rows
+        if last_row is not None:
+            chunk = chunk.filter(_get_keyset_filter(key_fields, last_row))
+        chunk = list(chunk[:STREAM_CHUNK_SIZE])
+        for row in chunk:
+            yield row
+        
+        if len(chunk) < STREAM_CHUNK_SIZE:
+            return
+        last_row = chunk[-1]
+
+def _get_keyset_filter(key_fields, last_row):
+    # The rows ordered after last_row: (a > x) or (a = x and b > y) or ...
+    keyset_filter = None
+    for index, field in enumerate(key_fields):
+        conditions = dict(zip(key_fields[:index], last_row[:index]))
+        conditions[field + '__gt'] = last_row[index]
+        if keyset_filter is None:
+            keyset_filter = Q(**conditions)
+        else:
+            keyset_filter |= Q(**conditions)
+    return keyset_filter
+
+def _stream_list(values):
+    return _stream_json('[', ']', (json_codec.dumps(value)
+                                   for value in values))
+
+def _stream_dict(items):
+    return _stream_json('{', '}', ('%s: %s' % (json_codec.dumps(key),
+                                               json_codec.dumps(value))
+                                   for key, value in items))
+
+def _stream_json(start, end, fragments):
+    # Streams are always JSON, whatever the request accepts, since other
+    # formats cannot be written one item at a time without knowing the count.
+    # The fragments are only generated while the response is being sent, so
+    # the queries behind them run after the view has returned. Fragments are
+    # joined into chunks to keep the number of writes down.
+    chunk = [start]
+    for index, fragment in enumerate(fragments):
+        if index:
+            chunk.append(', ')
+        chunk.append(fragment)
+        if len(chunk) >= STREAM_CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+    
+    chunk.append(end)
+    yield ''.join(chunk)
+
+def _get_positive_int(request, key):
+    value = request.GET.get(key)
+    if value is None:
+        return None
+    
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    
+    if number < 1:
+        error_message = "%s must be a positive integer" % key
+        raise InvalidRequest(request, '400', error_message)
+    
+    return number
+        
 def _get_resource(request, resource_id):
     try:    
-        return Resource.objects.get(id=resource_id)
+        return (Resource.objects.select_related('specification')
+                                .get(id=resource_id))
     except Resource.DoesNotExist:
         error_message = ("Resource with id: '" + resource_id 
                          + "' does not exist.")
         raise InvalidRequest(request, '400', error_message)
     
+# Views for reading many resources at once
+@csrf_exempt
+def batch_elements(request):
+    etag = None
+    try:
+        status = '200'
+        if request.method == 'GET':
+            resource_ids = request.GET.get('ids')
+            if resource_ids is not None:
+                resource_ids = [id for id in resource_ids.split(',') if id]
+            spec_name = request.GET.get('specName')
+            spec_version = request.GET.get('specVersion')
+        elif request.method == 'POST':
+            post_data = _get_post_data(request)
+            resource_ids = post_data.get('resourceIds')
+            spec_name = post_data.get('specName')
+            spec_version = post_data.get('specVersion')
+        else:
+            error_message = "Only GET and POST are supported"
+            raise InvalidRequest(request, '400', error_message)
+        
+        if resource_ids is not None:
+            if not _is_id_list(resource_ids):
+                error_message = "resourceIds must be a list of resource ids"
+                raise InvalidRequest(request, '400', error_message)
+            etag, owners, rows = _get_batch_by_ids(request, resource_ids)
+        elif spec_name and spec_version:
+            spec = _get_specification(request, spec_name, spec_version)
+            etag = _get_etag(request, spec.id, spec.revision)
+            owners = [spec.id]
+            rows = (_get_resource_rows(specification=spec),
+                    [Element.objects.filter(resource__specification=spec)],
+                    [])
+        else:
+            error_message = ("Must specify either resource ids or a "
+                             "specification name and version")
+            raise InvalidRequest(request, '400', error_message)
+        
+        if request.method == 'GET' and _is_not_modified(request, etag):
+            status, response = '304', None
+        else:
+            response = _get_cached_response(request, 'batch_elements', etag,
+                                            owners, _get_batch_response,
+                                            request, *rows)
+        if request.method != 'GET':
+            # The tag would describe the body of a request, not a resource
+            etag = None
+    except InvalidRequest as invalid_request:
+        status, response = invalid_request.get_response()
+    
+    return _reply(request, status, response, etag)
+
+def _is_id_list(value):
+    return (isinstance(value, list)
+            and all(isinstance(id, basestring) for id in value))
+
+def _get_batch_by_ids(request, resource_ids):
+    # The resources, with their revisions, are read up front for the ETag.
+    # Their elements are only read when the response is not cached.
+    resource_ids = sorted(set(resource_ids))
+    resource_rows = []
+    for chunk in batch.chunks(resource_ids):
+        resource_rows.extend(_get_resource_rows(id__in=chunk))
+    resource_rows.sort()
+    found_ids = [resource_row[0] for resource_row in resource_rows]
+    missing_ids = sorted(set(resource_ids).difference(found_ids))
+    
+    tokens = []
+    for resource_row in resource_rows:
+        tokens.extend([resource_row[0], resource_row[-1]])
+    tokens.append('missing')
+    tokens.extend(missing_ids)
+    etag = _get_etag(request, *tokens)
+    element_rows = [Element.objects.filter(resource__in=chunk)
+                    for chunk in batch.chunks(found_ids)]
+    return etag, found_ids, (resource_rows, element_rows, missing_ids)
+
+def _get_resource_rows(**filters):
+    # The resource properties followed by the revision
+    return (Resource.objects.filter(**filters)
+                            .values_list(*Resource.ROW_FIELDS + ('revision',)))
+
+def _get_batch_response(request, resource_rows, element_rows, missing_ids):
+    # element_rows are querysets of elements, each read with one query
+    # whatever the number of resources it covers
+    fields = _get_fields(request, Element)
+    row_fields = _get_row_fields(Element, fields)
+    
+    resources = {}
+    for resource_row in resource_rows:
+        resources[resource_row[0]] = {
+                                      'resource': Resource.build_properties(
+                                                        *resource_row[:-1]),
+                                      'elements': {}
+                                     }
+    for rows in element_rows:
+        for element_row in rows.values_list('resource', *row_fields):
+            resources[element_row[0]]['elements'][element_row[1]] = (
+                        _build_properties(Element, row_fields, element_row[1:],
+                                          fields))
+    for id in missing_ids:
+        resources[id] = {
+                         'error': ("Resource with id: '" + id
+                                   + "' does not exist.")
+                        }
+    return {'resources': resources}
+    
+# Views for validation
 @csrf_exempt
-def element(request):
+def validate(request, resource_id):
     try:
         if request.method == 'POST':
             status = '200'
-            response = _create_element(request)
+            response = _validate_payload(request, resource_id)
         else:
             error_message = "Only POST is supported"
             raise InvalidRequest(request, '400', error_message)
     except InvalidRequest as invalid_request:
         status, response = invalid_request.get_response()
+    finally:
+        return _reply(request, status, response)
+
+def _validate_payload(request, resource_id):
+    payload = _get_post_data(request)
+    try:
+        revision = (Resource.objects.values_list('revision', flat=True)
+                                    .get(id=resource_id))
+    except Resource.DoesNotExist:
+        error_message = ("Resource with id: '" + resource_id 
+                         + "' does not exist.")
+        raise InvalidRequest(request, '400', error_message)
+    
+    violations = get_validator(resource_id, revision).validate(payload)
+    return {
+            'valid': not violations,
+            'violations': violations
+           }
+
+@csrf_exempt
+def validate_batch(request):
+    try:
+        if request.method == 'POST':
+            return _validate_payloads(request)
+        else:
+            error_message = "Only POST is supported"
+            raise InvalidRequest(request, '400', error_message)
+    except InvalidRequest as invalid_request:
+        status, response = invalid_request.get_response()
+        return _reply(request, status, response)
+
+def _validate_payloads(request):
+    # Results are written as newline delimited JSON while they are produced.
+    # They are validated in this process: forking a pool per request costs
+    # more than it saves, and forking a threaded server can deadlock.
+    results = BatchValidator(processes=1).validate(
+                                        request.raw_post_data.splitlines())
+    return HttpResponse((json_codec.dumps(result) + '\n'
+                         for result in results),
+                        'application/x-ndjson')
+
+@csrf_exempt
+def element(request, element_id=None):
+    try:
+        if request.method == 'POST':
+            status = '200'
+            response = _create_element(request)
+        elif request.method == 'DELETE' and element_id:
+            status = '200'
+            response = _delete_element(request, element_id)
+        else:
+            error_message = "Only POST and DELETE are supported"
+            raise InvalidRequest(request, '400', error_message)
+    except InvalidRequest as invalid_request:
+        status, response = invalid_request.get_response()
         
-    return _reply(status, response)
+    return _reply(request, status, response)
 
+@transaction.commit_on_success
+def _delete_element(request, element_id):
+    element = _get_element(request, element_id)
+    
+    # Collect the subtree from the resource's (id, parent) rows in memory
+    # rather than one query per level, so that the deletes that follow, and
+    # the write lock they take, are as short as possible.
+    children = {}
+    element_rows = (Element.objects.filter(resource__id=element.resource_id)
+                                   .values_list('id', 'parent'))
+    for id, parent_id in element_rows:
+        children.setdefault(parent_id, []).append(id)
+    
+    element_ids = []
+    pending = [element.id]
+    while pending:
+        id = pending.pop()
+        element_ids.append(id)
+        pending.extend(children.get(id, []))
+    
+    batch.delete_rows(Element, element_ids)
+    sequence = record_change('element', DELETE, element.id,
+                             element.resource_id)
+    update_ancestor_hashes(element.resource_id, element.parent_id)
+    _bump_revisions(element, sequence)
+    _invalidate_cache(element)
+    return _get_delete_response(0, 0, len(element_ids))
+
+def _get_delete_response(specification_count, resource_count, element_count):
+    return {
+            'deleted': {
+                        'specifications': specification_count,
+                        'resources': resource_count,
+                        'elements': element_count
+                       }
+           }
+
+# The element, its tree hashes and its change are written together
+@transaction.commit_on_success
 def _create_element(request):
     element_data = _get_post_data(request)
     return _parse_and_save_element(request, element_data)
@@ -249,6 +1467,8 @@ def _parse_and_save_element(request, element_data):
         return element_properties
 
 def _boolean(str):
+    if isinstance(str, bool):
+        return str
     return str in ['True', 'true', '1']
 
 def _get_element(request, element_id):
@@ -260,31 +1480,182 @@ def _get_element(request, element_id):
 
 def _save_model(model):
     model.generate_id()
+    if isinstance(model, (Specification, Resource)):
+        # Every column of a specification or resource except its revision is
+        # derived from the id, so an existing row is already up to date and
+        # saving it again would only reset the revision.
+        if type(model).objects.filter(id=model.id).exists():
+            return
+    
     model.save()
+    if isinstance(model, Resource):
+        route_index.add(model.url, model.id)
+    elif isinstance(model, Element):
+        update_ancestor_hashes(model.resource_id, model.id)
+    sequence = _record_save(model)
+    if isinstance(model, (Specification, Resource)):
+        model.revision = sequence
+        _bump_revision(type(model).objects.filter(id=model.id), sequence)
+    _bump_revisions(model, sequence)
+    _invalidate_cache(model)
+
+def _record_save(model):
+    if isinstance(model, Specification):
+        return record_change('specification', SAVE, model.id, None,
+                             model.get_properties())
+    elif isinstance(model, Resource):
+        return record_change('resource', SAVE, model.id,
+                             model.specification_id, model.get_properties())
+    elif isinstance(model, Element):
+        return record_change('element', SAVE, model.id, model.resource_id,
+                             model.get_properties()[1])
+
+def _bump_revisions(model, sequence):
+    if isinstance(model, Resource):
+        _bump_revision(Specification.objects.filter(id=model.specification_id),
+                       sequence)
+    elif isinstance(model, Element):
+        _bump_revision(Resource.objects.filter(id=model.resource_id), sequence)
+        _bump_revision(Specification.objects.filter(
+                                            resource__id=model.resource_id),
+                       sequence)
+
+def _bump_revision(queryset, sequence):
+    # Revisions are the sequence number of the last change written under the
+    # row rather than a count from 0. Ids are derived from content, so a row
+    # deleted and created again gets its old id back, and counting again
+    # would repeat the revisions its ETags and cache keys were built from.
+    queryset.update(revision=sequence)
+
+def _invalidate_cache(model):
+    if isinstance(model, Specification):
+        response_cache.invalidate('index')
+    elif isinstance(model, Resource):
+        response_cache.invalidate(model.specification_id)
+    elif isinstance(model, Element):
+        response_cache.invalidate(model.resource_id)
+        validator_cache.invalidate(model.resource_id)
+
+def _get_cached_response(request, view_name, etag, owners, get_response,
+                         *args):
+    # The ETag identifies the exact representation, including its format, so
+    # it is a complete key.
+    codec = get_response_codec(request)
+    cache_key = 'specifications:%s:%s' % (view_name, etag.strip('"'))
+    encoding = get_encoding(request)
+    if encoding:
+        # The compressed variant is cached next to the plain body, which is
+        # only needed to build it.
+        variant_key = '%s:%s' % (cache_key, encoding)
+        variant = response_cache.get(variant_key)
+        if variant is not None:
+            return SerializedResponse(variant[1], codec.content_type,
+                                      variant[0])
+    
+    content = response_cache.get_or_set(
+                        cache_key, owners,
+                        lambda: _dumps(request, codec, get_response(*args)))
+    if encoding:
+        variant = compress(content, encoding)
+        response_cache.set(variant_key, owners, variant)
+        return SerializedResponse(variant[1], codec.content_type, variant[0])
+    return SerializedResponse(content, codec.content_type)
+
+def _get_etag(request, *tokens):
+    # The query string and the negotiated format are part of the tag because
+    # parameters such as ?shape=tree change the representation of the same
+    # revision. Tokens may be ids sent by the client, in any characters.
+    md5_hash = md5()
+    md5_hash.update(":".join(unicode(token).encode('utf-8')
+                             for token in tokens))
+    md5_hash.update("?" + repr(sorted(request.GET.lists())))
+    md5_hash.update(";" + get_response_codec(request).name)
+    return '"%s"' % md5_hash.hexdigest()
+
+def _is_not_modified(request, etag):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if not if_none_match:
+        return False
+    
+    tags = [_strip_encoding(tag.strip()) for tag in if_none_match.split(',')]
+    return etag in tags or '*' in tags
+
+def _get_matched_etag(request, etag):
+    # A 304 repeats the ETag of the variant the client has
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH', '')
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    for encoding in get_encodings():
+        tag = '%s-%s"' % (etag[:-1], encoding)
+        if tag in tags:
+            return tag
+    return etag
+
+def _strip_encoding(tag):
+    # Compressed bodies are sent with the coding appended to their ETag, see
+    # _reply, but are not modified when the uncompressed body is not.
+    for encoding in get_encodings():
+        suffix = '-%s"' % encoding
+        if tag.endswith(suffix):
+            return tag[:-len(suffix)] + '"'
+    return tag
 
 def _get_post_data(request):
-    data_stream = StringIO(request.raw_post_data)
+    codec = get_request_codec(request)
+    if codec is None:
+        error_message = ("Content type '%s' is not supported"
+                         % request.META.get('CONTENT_TYPE'))
+        raise InvalidRequest(request, '400', error_message)
+    
+    # Decoding the body string directly avoids copying it into a file object
     try:
-        data = json.load(data_stream)
+        data = codec.loads(request.raw_post_data)
     except ValueError:
-        error_message = "Invalid JSON post data to create a specification"
+        error_message = ("Invalid %s post data to create a specification"
+                         % codec.label)
         raise InvalidRequest(request, '400', error_message)
     else:
         if isinstance(data, dict):
             return data
         else:
-            error_message = "Root of JSON must be an type object"
+            error_message = "Root of %s must be an type object" % codec.label
             raise InvalidRequest(request, '400', error_message)
 
-def _reply(status, response):
-    mime_type = 'application/json'
-    json_response = json.dumps(response)
+def _reply(request, status, response, etag=None):
     if status == '200':
-        reply = HttpResponse(json_response, mime_type)
+        reply = HttpResponse(*_serialize(request, response))
+        content_encoding = getattr(response, 'content_encoding', None)
+        if content_encoding:
+            # Byte-wise different bodies need different strong ETags
+            reply['Content-Encoding'] = content_encoding
+            if etag:
+                etag = '%s-%s"' % (etag[:-1], content_encoding)
+    elif status == '304':
+        reply = HttpResponseNotModified()
+        etag = _get_matched_etag(request, etag)
     elif status == '400':
-        reply = HttpResponseBadRequest(json_response, mime_type)
+        reply = HttpResponseBadRequest(*_serialize(request, response))
+        etag = None
+    elif status == '404':
+        reply = HttpResponseNotFound(*_serialize(request, response))
+        etag = None
     else:
         raise Exception("Reply status '%s' not supported" % status)
+    
+    if etag:
+        reply['ETag'] = etag
+    reply['Vary'] = 'Accept, Accept-Encoding'
         
     return reply
+
+def _serialize(request, response):
+    if isinstance(response, SerializedResponse):
+        return response.content, response.content_type
+    codec = get_response_codec(request)
+    return _dumps(request, codec, response), codec.content_type
+
+def _dumps(request, codec, response):
+    started = time.time()
+    content = codec.dumps(response)
+    add_serialization_time(request, time.time() - started)
+    return content
     
@@ -6,6 +6,11 @@ from django.conf.urls.defaults import patterns, include, url
 
 urlpatterns = patterns('',
                        (r'^specifications', include('specifications.urls')),
+                       # Example payloads for every resource url, see
+                       # specifications.views.mock
+                       (r'^mock/(?P<path>.*)$', 'specifications.views.mock'),
+                       # Prometheus metrics, see specifications.metrics
+                       (r'^metrics$', 'specifications.views.metrics'),
                        
     # Uncomment the admin/doc line below to enable admin documentation:
     # url(r'^admin/doc/', include('django.contrib.admindocs.urls')),
@@ -0,0 +1,20 @@
+'''
+WSGI entry point of the project, for servers such as mod_wsgi or gunicorn
+(resteasy.wsgi:application) and for the runthreaded management command.
+'''
+
+import os
+import sys
+
+# Settings are imported as resteasy.settings and apps by their bare name, as
+# manage.py makes possible, so both directories must be importable.
+_project_dir = os.path.dirname(os.path.abspath(__file__))
+for _path in (_project_dir, os.path.dirname(_project_dir)):
+    if _path not in sys.path:
+        sys.path.append(_path)
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'resteasy.settings')
+
+from django.core.handlers.wsgi import WSGIHandler
+
+application = WSGIHandler()